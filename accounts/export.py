@@ -0,0 +1,139 @@
+import json
+import threading
+import zipfile
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from orders.models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem, ShippingAddress
+from payments.models import ArchivedPayment, ArchivedRefund, Payment, Refund
+from reviews.models import Review
+from .models import User, UserProfile
+
+# Secrets and internal bookkeeping left out of exports
+EXCLUDED_FIELDS = {
+    User: {'password', 'email_verification_token'},
+    Order: {'idempotency_key', 'version', 'rollup_state'},
+    Payment: {'razorpay_signature', 'reconciliation_run'},
+    ArchivedPayment: {'razorpay_signature', 'reconciliation_run'},
+    Refund: {'attempts', 'available_at', 'locked_at', 'last_error'},
+    Review: {'duplicate_of'},
+}
+
+# Archive files and the querysets whose rows they hold, for a user id
+EXPORT_FILES = [
+    ('account.jsonl', lambda user_id: [User.objects.filter(id=user_id)]),
+    ('profile.jsonl', lambda user_id: [UserProfile.objects.filter(user_id=user_id)]),
+    ('addresses.jsonl', lambda user_id: [ShippingAddress.objects.filter(user_id=user_id)]),
+    ('orders.jsonl', lambda user_id: [
+        Order.objects.filter(user_id=user_id),
+        ArchivedOrder.objects.filter(user_id=user_id),
+    ]),
+    ('order_items.jsonl', lambda user_id: [
+        OrderItem.objects.filter(order__user_id=user_id),
+        ArchivedOrderItem.objects.filter(order__user_id=user_id),
+    ]),
+    ('payments.jsonl', lambda user_id: [
+        Payment.objects.filter(user_id=user_id),
+        ArchivedPayment.objects.filter(user_id=user_id),
+    ]),
+    ('refunds.jsonl', lambda user_id: [
+        Refund.objects.filter(payment__user_id=user_id),
+        ArchivedRefund.objects.filter(payment__user_id=user_id),
+    ]),
+    ('reviews.jsonl', lambda user_id: [Review.objects.filter(user_id=user_id)]),
+]
+
+# Bytes of compressed output collected before they are sent on
+FLUSH_SIZE = 64 * 1024
+
+_slots = None
+_slots_lock = threading.Lock()
+
+
+def _export_slots():
+    global _slots
+    if _slots is None:
+        with _slots_lock:
+            if _slots is None:
+                _slots = threading.BoundedSemaphore(settings.DATA_EXPORT_MAX_CONCURRENT)
+    return _slots
+
+
+class _Pipe:
+    """Write-only file collecting what zipfile writes, until it is drained"""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+def _rows(queryset, chunk_size):
+    model = queryset.model
+    excluded = EXCLUDED_FIELDS.get(model, set())
+    fields = [field.attname for field in model._meta.concrete_fields if field.name not in excluded]
+    archived = model._meta.object_name.startswith('Archived')
+    for row in queryset.order_by('pk').values(*fields).iterator(chunk_size=chunk_size):
+        if archived:
+            row['archived'] = True
+        yield row
+
+
+def generate_export(user_id, chunk_size=500):
+    """Yield a ZIP of one JSONL file per kind of data, as it is written.
+
+    Rows are read ``chunk_size`` at a time and compressed output is handed
+    on every FLUSH_SIZE bytes, so memory stays flat whatever the history.
+    """
+    pipe = _Pipe()
+    # zipfile writes data descriptors when the target cannot seek
+    with zipfile.ZipFile(pipe, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, querysets in EXPORT_FILES:
+            with archive.open(name, 'w', force_zip64=True) as member:
+                for queryset in querysets(user_id):
+                    for row in _rows(queryset, chunk_size):
+                        member.write(json.dumps(row, cls=DjangoJSONEncoder).encode() + b'\n')
+                        if pipe.size >= FLUSH_SIZE:
+                            yield pipe.drain()
+    yield pipe.drain()
+
+
+class ExportBusy(Exception):
+    """Every export slot of this process is taken"""
+
+
+class UserDataExport:
+    """Iterable ZIP export holding one of the process's export slots until closed.
+
+    StreamingHttpResponse closes it when the response finishes, including
+    when the client goes away before the first byte.
+    """
+
+    def __init__(self, user_id, chunk_size=500):
+        if not _export_slots().acquire(blocking=False):
+            raise ExportBusy()
+        self._chunks = generate_export(user_id, chunk_size)
+        self._released = False
+
+    def __iter__(self):
+        return self._chunks
+
+    def close(self):
+        self._chunks.close()
+        if not self._released:
+            self._released = True
+            _export_slots().release()
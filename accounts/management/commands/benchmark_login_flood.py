@@ -0,0 +1,95 @@
+import statistics
+import threading
+import time
+from contextlib import redirect_stdout
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from ecommerce.ratelimit import get_buckets
+
+UNLIMITED = (10 ** 9, 1)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure home page latency while the login form is flooded with bad passwords, '
+        'without and with login throttling. Runs against a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--attackers', type=int, default=8, help='Flooding clients, one IP each')
+        parser.add_argument('--rate', type=float, default=50, help='Login attempts per second, all attackers')
+        parser.add_argument('--seconds', type=float, default=10, help='Length of each phase')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            get_user_model().objects.create_user('victim', email='victim@example.com', password='correct horse')
+            phase = (options['attackers'], options['rate'], options['seconds'])
+            self.report('no flood', self.run_phase(0, 0, options['seconds']))
+            with override_settings(LOGIN_RATE_LIMIT_PER_IP=UNLIMITED, LOGIN_RATE_LIMIT_PER_USERNAME=UNLIMITED):
+                self.report('flood, unthrottled', self.run_phase(*phase))
+            get_buckets().clear()
+            self.report('flood, throttled', self.run_phase(*phase))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def run_phase(self, attackers, rate, seconds):
+        with redirect_stdout(StringIO()):  # views may print
+            return self._run_phase(attackers, rate, seconds)
+
+    def _run_phase(self, attackers, rate, seconds):
+        stop = threading.Event()
+        outcomes = {'hashed': 0, 'throttled': 0}
+        lock = threading.Lock()
+
+        def flood(ip):
+            client = Client(REMOTE_ADDR=ip)
+            url = reverse('accounts:login')
+            interval = attackers / rate
+            next_at = time.monotonic()
+            while not stop.is_set():
+                status = client.post(url, {'username': 'victim', 'password': 'wrong'}).status_code
+                with lock:
+                    outcomes['throttled' if status == 429 else 'hashed'] += 1
+                # Keep the offered rate; a backlog is sent at once, like queued requests
+                next_at += interval
+                stop.wait(max(0, next_at - time.monotonic()))
+            connection.close()
+
+        threads = [threading.Thread(target=flood, args=(f'10.0.0.{i + 1}',)) for i in range(attackers)]
+        for thread in threads:
+            thread.start()
+
+        latencies = []
+        shopper = Client(REMOTE_ADDR='192.168.0.1')
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            shopper.get('/')
+            latencies.append((time.perf_counter() - started) * 1000)
+            time.sleep(0.02)
+
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return latencies, outcomes
+
+    def report(self, label, result):
+        latencies, outcomes = result
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        self.stdout.write(
+            f'{label:>20}: home p50 {statistics.median(latencies):7.1f} ms  p95 {p95:7.1f} ms  '
+            f'max {latencies[-1]:7.1f} ms  | logins hashed {outcomes["hashed"]:5}  '
+            f'throttled {outcomes["throttled"]:5}'
+        )
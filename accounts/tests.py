@@ -1,3 +1,241 @@
-from django.test import TestCase
+import io
+import json
+import zipfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from ecommerce import ratelimit
+from ecommerce.ratelimit import CacheBuckets, LocalBuckets, RateLimiter
+from ecommerce.session_store import SessionStore
+from orders.archive import archive_chunk
+from orders.models import ArchivedOrder, Order, OrderItem, ShippingAddress
+from payments.models import Payment
+from products.models import Category, Product
+from reviews.models import Review
+from .export import EXCLUDED_FIELDS, EXPORT_FILES
+from .models import User, UserProfile
+
+
+class Clock:
+    """Stands in for time.monotonic/time.time, moved on by hand"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class LocalBucketsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch.object(ratelimit.time, 'monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.buckets = LocalBuckets()
+
+    def test_burst_up_to_capacity(self):
+        self.assertEqual([self.buckets.take('k', 3, 60) for _ in range(3)], [0, 0, 0])
+        self.assertEqual(self.buckets.take('k', 3, 60), 20)
+
+    def test_refills_at_capacity_per_period(self):
+        for _ in range(3):
+            self.buckets.take('k', 3, 60)
+        self.clock.now += 10
+        self.assertAlmostEqual(self.buckets.wait('k', 3, 60), 10)
+        self.clock.now += 10
+        self.assertEqual(self.buckets.take('k', 3, 60), 0)
+        self.assertAlmostEqual(self.buckets.take('k', 3, 60), 20)
+
+    def test_refill_stops_at_capacity(self):
+        self.buckets.take('k', 3, 60)
+        self.clock.now += 3600
+        self.assertEqual([self.buckets.take('k', 3, 60) for _ in range(3)], [0, 0, 0])
+        self.assertGreater(self.buckets.take('k', 3, 60), 0)
+
+    def test_wait_spends_nothing(self):
+        for _ in range(5):
+            self.assertEqual(self.buckets.wait('k', 1, 60), 0)
+        self.assertEqual(self.buckets.take('k', 1, 60), 0)
+        self.assertEqual(self.buckets.wait('k', 1, 60), 60)
+
+    def test_keys_are_independent_and_bounded(self):
+        buckets = LocalBuckets(max_keys=2)
+        buckets.take('a', 1, 60)
+        self.assertEqual(buckets.take('b', 1, 60), 0)
+        buckets.take('c', 1, 60)
+        # 'a' was evicted, so it starts full again
+        self.assertEqual(buckets.take('a', 1, 60), 0)
+
+
+@override_settings(CACHES={'ratelimit': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CacheBucketsTests(SimpleTestCase):
+
+    def setUp(self):
+        caches['ratelimit'].clear()
+        self.clock = Clock(now=6000.0)
+        patcher = mock.patch.object(ratelimit.time, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.buckets = CacheBuckets('ratelimit')
+
+    def test_capacity_per_window_then_wait_until_it_ends(self):
+        self.assertEqual([self.buckets.take('k', 3, 60) for _ in range(3)], [0, 0, 0])
+        self.clock.now += 15
+        self.assertEqual(self.buckets.wait('k', 3, 60), 45)
+        self.assertEqual(self.buckets.take('k', 3, 60), 45)
+        self.clock.now += 45
+        self.assertEqual(self.buckets.take('k', 3, 60), 0)
+
+
+@override_settings(LOGIN_RATE_LIMIT_PER_IP=(3, 60), LOGIN_RATE_LIMIT_PER_USERNAME=(2, 60))
+class LoginThrottleTests(TestCase):
+
+    def setUp(self):
+        ratelimit._local.clear()
+        self.addCleanup(ratelimit._local.clear)
+        User.objects.create_user('alice', email='alice@example.com', password='secret')
+
+    def attempt(self, username='alice', ip='10.0.0.1'):
+        return self.client.post(
+            reverse('accounts:login'), {'username': username, 'password': 'wrong'}, REMOTE_ADDR=ip,
+        )
+
+    def test_username_limit_spans_addresses(self):
+        self.assertEqual(self.attempt(ip='10.0.0.1').status_code, 200)
+        self.assertEqual(self.attempt(ip='10.0.0.2').status_code, 200)
+        response = self.attempt(ip='10.0.0.3')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+
+    def test_refused_attempt_charges_neither_limit(self):
+        for username in ('bob', 'carol', 'dave'):
+            self.attempt(username)
+        self.assertEqual(self.attempt('alice').status_code, 429)
+        # The IP refusal left alice's budget alone
+        limiter = RateLimiter('login-username', 2, 60)
+        self.assertEqual(limiter.wait('alice'), 0)
+        self.assertEqual(self.attempt('alice', ip='10.0.0.9').status_code, 200)
+        self.assertEqual(self.attempt('alice', ip='10.0.0.9').status_code, 200)
+        self.assertEqual(self.attempt('alice', ip='10.0.0.9').status_code, 429)
+
+
+class SessionStoreTests(TestCase):
+
+    def make_session(self, **data):
+        session = SessionStore()
+        session.update(data)
+        session.save()
+        return session.session_key
+
+    def test_unchanged_session_is_not_written(self):
+        key = self.make_session(cart_id=1)
+        session = SessionStore(key)
+        session['cart_id'] = 1
+        with self.assertNumQueries(0):
+            session.save()
+
+    def test_changed_session_is_written(self):
+        key = self.make_session(cart_id=1)
+        session = SessionStore(key)
+        session['cart_id'] = 2
+        session.save()
+        self.assertEqual(SessionStore(key)['cart_id'], 2)
+
+    @override_settings(SESSION_CLEANUP_BATCH_SIZE=2, SESSION_CLEANUP_PAUSE=0)
+    def test_cleanup_deletes_expired_sessions_in_batches(self):
+        live = self.make_session(cart_id=1)
+        for n in range(5):
+            self.make_session(cart_id=n)
+        expired = Session.objects.exclude(session_key=live)
+        expired.update(expire_date=timezone.now() - timedelta(days=1))
+        with CaptureQueriesContext(connection) as queries:
+            call_command('clearsessions')
+        deletes = [q for q in queries if q['sql'].startswith('DELETE FROM "django_session"')]
+        self.assertEqual(len(deletes), 3)
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), [live])
+
+
+class DataExportTests(TestCase):
+
+    def setUp(self):
+        ratelimit._local.clear()
+        self.addCleanup(ratelimit._local.clear)
+        category = Category.objects.create(name='Phones')
+        self.product = Product.objects.create(
+            name='Phone', description='A phone', category=category, price=100, stock_quantity=10,
+        )
+        self.alice = self.make_customer('alice')
+        self.bob = self.make_customer('bob')
+        # One of alice's orders has been archived
+        archived = self.place_order(self.alice, status='delivered')
+        archive_chunk([archived.id])
+        self.place_order(self.alice)
+
+    def make_customer(self, username):
+        user = User.objects.create_user(username, email=f'{username}@example.com', password='secret')
+        UserProfile.objects.create(user=user)
+        ShippingAddress.objects.create(
+            user=user, full_name=username, phone='9999999999', address_line1='1 Main Road',
+            city='Pune', state='Maharashtra', pincode='411001',
+        )
+        Review.objects.create(product=self.product, user=user, rating=5, comment=f'Good, says {username}')
+        self.place_order(user)
+        return user
+
+    def place_order(self, user, **kwargs):
+        order = Order.objects.create(
+            user=user, subtotal=100, total_amount=100, payment_method='razorpay',
+            full_name=user.username, phone='9999999999', email=user.email,
+            address_line1='1 Main Road', city='Pune', state='Maharashtra', pincode='411001', **kwargs,
+        )
+        OrderItem.objects.create(order=order, product=self.product, quantity=1, price=100)
+        Payment.objects.create(order=order, user=user, amount=100, payment_method='razorpay',
+                               status='completed', razorpay_signature='secret-signature')
+        return order
+
+    def export(self, user):
+        self.client.force_login(user)
+        response = self.client.get(reverse('accounts:export_data'))
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        return {
+            name: [json.loads(line) for line in archive.read(name).splitlines()]
+            for name in archive.namelist()
+        }
+
+    def test_each_file_holds_only_the_users_rows(self):
+        files = self.export(self.alice)
+        self.assertEqual(list(files), [name for name, _ in EXPORT_FILES])
+        self.assertEqual([row['id'] for row in files['account.jsonl']], [self.alice.id])
+        for name in ('profile.jsonl', 'addresses.jsonl', 'orders.jsonl', 'payments.jsonl', 'reviews.jsonl'):
+            self.assertTrue(files[name], name)
+            self.assertEqual({row['user_id'] for row in files[name]}, {self.alice.id}, name)
+        orders = {row['id']: row.get('archived', False) for row in files['orders.jsonl']}
+        self.assertEqual(orders, {
+            **{pk: False for pk in Order.objects.filter(user=self.alice).values_list('id', flat=True)},
+            **{pk: True for pk in ArchivedOrder.objects.filter(user=self.alice).values_list('id', flat=True)},
+        })
+        self.assertEqual(len(orders), 3)
+        self.assertEqual({row['order_id'] for row in files['order_items.jsonl']}, set(orders))
+        self.assertEqual(files['refunds.jsonl'], [])
+
+    def test_excluded_fields_are_left_out(self):
+        files = self.export(self.alice)
+        excluded = set().union(*EXCLUDED_FIELDS.values())
+        for name, rows in files.items():
+            for row in rows:
+                self.assertFalse(excluded & set(row), name)
+                # Foreign keys are exported by attname
+                self.assertFalse({f'{field}_id' for field in excluded} & set(row), name)
+        self.assertNotIn('secret-signature', json.dumps(files))
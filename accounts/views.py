@@ -1,14 +1,20 @@
 from django.shortcuts import render
 
 # Create your views here.
+import math
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.shortcuts import render, redirect
-from django.contrib.auth import login, logout, authenticate
+from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.views.generic import CreateView
 from django.urls import reverse_lazy
 from .forms import UserRegistrationForm, UserLoginForm, UserProfileForm, UserUpdateForm
+from .export import ExportBusy, UserDataExport
 from .models import User, UserProfile
+from ecommerce.ratelimit import RateLimiter, client_ip
 
 def register_view(request):
     """User Registration View"""
@@ -32,17 +38,41 @@ def register_view(request):
     return render(request, 'accounts/register.html', {'form': form})
 
 
+def login_throttle_wait(request):
+    """Seconds the client must wait before another login attempt; 0 if it may try now.
+
+    Both limits are checked before either is charged, so attempts refused by
+    the IP limit do not also use up the username's budget (and vice versa).
+    """
+    username = (request.POST.get('username') or '').strip().casefold()
+    limits = [
+        (RateLimiter('login-ip', *settings.LOGIN_RATE_LIMIT_PER_IP), client_ip(request)),
+        (RateLimiter('login-username', *settings.LOGIN_RATE_LIMIT_PER_USERNAME), username),
+    ]
+    wait = max(limiter.wait(key) for limiter, key in limits)
+    if wait:
+        return wait
+    return max(limiter.take(key) for limiter, key in limits)
+
+
 def login_view(request):
     """User Login View"""
     if request.user.is_authenticated:
         return redirect('home')
     
     if request.method == 'POST':
+        # Refuse over-limit attempts before the password is hashed
+        wait = login_throttle_wait(request)
+        if wait:
+            messages.error(request, f'Too many login attempts. Please try again in {math.ceil(wait)} seconds.')
+            response = render(request, 'accounts/login.html', {'form': UserLoginForm()}, status=429)
+            response['Retry-After'] = str(math.ceil(wait))
+            return response
+        
         form = UserLoginForm(request, data=request.POST)
+        # The form authenticates the credentials itself
         if form.is_valid():
-            username = form.cleaned_data.get('username')
-            password = form.cleaned_data.get('password')
-            user = authenticate(username=username, password=password)
+            user = form.get_user()
             
             if user is not None:
                 login(request, user)
@@ -95,4 +125,21 @@ def profile_view(request):
         'user_form': user_form,
         'profile_form': profile_form
     }
-    return render(request, 'accounts/profile.html', context)
\ No newline at end of file
+    return render(request, 'accounts/profile.html', context)
+
+
+@login_required
+def export_data(request):
+    """Download everything stored about the user as a ZIP of JSONL files"""
+    if RateLimiter('data-export', *settings.DATA_EXPORT_RATE_LIMIT).take(request.user.id):
+        messages.error(request, 'You have requested several exports recently. Please try again later.')
+        return redirect('accounts:profile')
+    try:
+        export = UserDataExport(request.user.id)
+    except ExportBusy:
+        messages.error(request, 'Data exports are busy right now. Please try again in a few minutes.')
+        return redirect('accounts:profile')
+    
+    response = StreamingHttpResponse(export, content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{request.user.username}-data.zip"'
+    return response
@@ -1,44 +1,91 @@
-
 # Register your models here.
 from django.contrib import admin
-from .models import Cart, CartItem
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from products.models import final_price_expression
+from .models import Cart, CartItem, StockReservation
+
+PRICE_FIELD = DecimalField(max_digits=12, decimal_places=2)
+
 
 class CartItemInline(admin.TabularInline):
     model = CartItem
     extra = 0
-    readonly_fields = ['added_at']
+    readonly_fields = ['added_at', 'get_total_price']
     fields = ['product', 'quantity', 'get_total_price', 'added_at']
-    
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+
     def get_total_price(self, obj):
         return f"₹{obj.get_total_price()}"
     get_total_price.short_description = 'Total Price'
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user', 'session_key', 'get_total_items', 'get_total_price', 'created_at']
+    list_display = ['id', 'user', 'session_key', 'get_line_count', 'get_total_items',
+                    'get_total_price', 'created_at']
     list_filter = ['created_at', 'updated_at']
+    list_select_related = ['user']
     search_fields = ['user__username', 'session_key']
     readonly_fields = ['created_at', 'updated_at']
     inlines = [CartItemInline]
-    
+
+    def get_queryset(self, request):
+        # Totals are computed in the changelist query so rendering a page
+        # never touches cart items or products row by row.
+        return super().get_queryset(request).annotate(
+            line_count=Count('items'),
+            total_items=Sum('items__quantity'),
+            total_price=Sum(
+                ExpressionWrapper(
+                    final_price_expression('items__product__') * F('items__quantity'),
+                    output_field=PRICE_FIELD,
+                )
+            ),
+        )
+
+    def get_line_count(self, obj):
+        return obj.line_count
+    get_line_count.short_description = 'Lines'
+    get_line_count.admin_order_field = 'line_count'
+
     def get_total_items(self, obj):
-        return obj.get_total_items()
+        return obj.total_items or 0
     get_total_items.short_description = 'Total Items'
-    
+    get_total_items.admin_order_field = 'total_items'
+
     def get_total_price(self, obj):
-        return f"₹{obj.get_total_price()}"
+        return f"₹{obj.total_price or 0}"
     get_total_price.short_description = 'Total Price'
+    get_total_price.admin_order_field = 'total_price'
 
 @admin.register(CartItem)
 class CartItemAdmin(admin.ModelAdmin):
     list_display = ['cart', 'product', 'quantity', 'get_unit_price', 'get_total_price', 'added_at']
     list_filter = ['added_at']
+    list_select_related = ['cart__user', 'product']
     search_fields = ['product__name', 'cart__user__username']
-    
+
+    def get_queryset(self, request):
+        unit_price = final_price_expression('product__')
+        return super().get_queryset(request).annotate(
+            unit_price=unit_price,
+            line_total=ExpressionWrapper(unit_price * F('quantity'), output_field=PRICE_FIELD),
+        )
+
     def get_unit_price(self, obj):
-        return f"₹{obj.get_unit_price()}"
+        return f"₹{obj.unit_price}"
     get_unit_price.short_description = 'Unit Price'
-    
+    get_unit_price.admin_order_field = 'unit_price'
+
     def get_total_price(self, obj):
-        return f"₹{obj.get_total_price()}"
-    get_total_price.short_description = 'Total Price'
\ No newline at end of file
+        return f"₹{obj.line_total}"
+    get_total_price.short_description = 'Total Price'
+    get_total_price.admin_order_field = 'line_total'
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['cart', 'product', 'quantity', 'expires_at', 'created_at']
+    list_filter = ['expires_at']
+    list_select_related = ['cart__user', 'product']
+    search_fields = ['product__name', 'cart__user__username']
@@ -7,11 +7,10 @@ def cart_count(request):
         cart = Cart.objects.filter(user=request.user).first()
         if cart:
             count = cart.get_total_items()
-    else:
-        if not request.session.session_key:
-            request.session.create()
-        session_key = request.session.session_key
-        cart = Cart.objects.filter(session_key=session_key).first()
+    elif request.session.session_key:
+        # Visitors without a session have no cart; creating a session here
+        # would write one for every anonymous page view
+        cart = Cart.objects.filter(session_key=request.session.session_key).first()
         if cart:
             count = cart.get_total_items()
 
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cart.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete expired checkout stock reservations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Keep running and sweep every N seconds (0 sweeps once)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired(batch_size=options['batch_size'])
+            self.stdout.write(f'Released {released} expired reservation(s)')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
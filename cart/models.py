@@ -1,6 +1,7 @@
 
 # Create your models here.
 from django.db import models
+from django.utils import timezone
 from accounts.models import User
 from products.models import Product
 
@@ -22,11 +23,11 @@ class Cart(models.Model):
     
     def get_total_price(self):
         """Calculate total cart price"""
-        return sum(item.get_total_price() for item in self.items.all())
+        return sum(item.get_total_price() for item in self.items.select_related('product'))
     
     def get_total_items(self):
         """Get total number of items in cart"""
-        return sum(item.quantity for item in self.items.all())
+        return self.items.aggregate(total=models.Sum('quantity'))['total'] or 0
 
 
 class CartItem(models.Model):
@@ -50,4 +51,30 @@ class CartItem(models.Model):
     
     def get_unit_price(self):
         """Get unit price"""
-        return self.product.get_final_price()
\ No newline at end of file
+        return self.product.get_final_price()
+
+class StockReservation(models.Model):
+    """Time-limited hold on product stock for a cart line during checkout"""
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Stock Reservation'
+        verbose_name_plural = 'Stock Reservations'
+        unique_together = ['cart', 'product']
+        indexes = [
+            # Available-to-sell sums the active holds of a product
+            models.Index(fields=['product', 'expires_at'], name='cart_reservation_active_idx'),
+            # The sweeper scans for expired holds
+            models.Index(fields=['expires_at'], name='cart_reservation_expiry_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} held by cart {self.cart_id}"
+    
+    def is_active(self):
+        """Check if the hold still counts against stock"""
+        return self.expires_at > timezone.now()
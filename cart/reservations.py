@@ -0,0 +1,96 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from products.models import Product
+from products.stock import InsufficientStock
+from .models import StockReservation
+
+
+def get_reservation_ttl():
+    """Lifetime of a checkout hold, in seconds"""
+    return getattr(settings, 'STOCK_RESERVATION_TTL', 15 * 60)
+
+
+def available_quantities(product_ids, exclude_cart=None, now=None):
+    """Map product id -> units available to sell (stock minus active holds).
+
+    Holds owned by ``exclude_cart`` are not subtracted, so a cart never
+    competes with its own reservation.
+    """
+    now = now or timezone.now()
+    product_ids = list(product_ids)
+    holds = StockReservation.objects.filter(product_id__in=product_ids, expires_at__gt=now)
+    if exclude_cart is not None:
+        holds = holds.exclude(cart=exclude_cart)
+    held = dict(
+        holds.order_by().values('product_id').annotate(held=Sum('quantity')).values_list('product_id', 'held')
+    )
+    stock = Product.objects.filter(id__in=product_ids).values_list('id', 'stock_quantity')
+    return {pid: max(quantity - held.get(pid, 0), 0) for pid, quantity in stock}
+
+
+def available_quantity(product, exclude_cart=None):
+    """Units of a single product available to sell"""
+    return available_quantities([product.id], exclude_cart=exclude_cart).get(product.id, 0)
+
+
+def reserve_cart(cart, ttl=None):
+    """Hold stock for every line of ``cart`` until the TTL runs out.
+
+    Existing holds of the cart are replaced, so calling this again refreshes
+    the expiry and follows quantity changes. Raises InsufficientStock, without
+    changing any hold, if a line cannot be covered.
+    """
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=ttl or get_reservation_ttl())
+
+    with transaction.atomic():
+        lines = dict(cart.items.values_list('product_id', 'quantity'))
+        product_ids = sorted(lines)
+
+        # Lock the product rows (in id order to avoid deadlocks) so concurrent
+        # checkouts for the same product reserve one after another
+        names = dict(
+            Product.objects.select_for_update()
+            .filter(id__in=product_ids).order_by('id').values_list('id', 'name')
+        )
+
+        available = available_quantities(product_ids, exclude_cart=cart, now=now)
+        short = [
+            (pid, names.get(pid, ''), available.get(pid, 0))
+            for pid in product_ids if lines[pid] > available.get(pid, 0)
+        ]
+        if short:
+            raise InsufficientStock(short)
+
+        StockReservation.objects.filter(cart=cart).delete()
+        StockReservation.objects.bulk_create([
+            StockReservation(cart=cart, product_id=pid, quantity=lines[pid], expires_at=expires_at)
+            for pid in product_ids
+        ])
+
+
+def release_cart(cart, product_ids=None):
+    """Drop the holds of a cart, optionally only for some products"""
+    holds = StockReservation.objects.filter(cart=cart)
+    if product_ids is not None:
+        holds = holds.filter(product_id__in=product_ids)
+    return holds.delete()[0]
+
+
+def release_expired(batch_size=1000, now=None):
+    """Delete expired holds in batches and return how many were removed"""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        ids = list(
+            StockReservation.objects.filter(expires_at__lte=now)
+            .order_by('expires_at').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return released
+        released += StockReservation.objects.filter(id__in=ids).delete()[0]
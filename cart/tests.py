@@ -1,3 +1,161 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
 
-# Create your tests here.
+from django.db import DatabaseError, connection
+from django.contrib import admin
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from products.models import Category, Product
+from .admin import CartAdmin, CartItemAdmin
+from .models import Cart, CartItem, StockReservation
+from .reservations import (
+    InsufficientStock, available_quantity, release_cart, release_expired, reserve_cart,
+)
+
+
+def make_cart(product, quantity, username):
+    user = User.objects.create(username=username, email=f'{username}@example.com')
+    cart = Cart.objects.create(user=user)
+    CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+    return cart
+
+
+class StockReservationTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Phones')
+        self.product = Product.objects.create(
+            name='Phone', description='A phone', category=category, price=100, stock_quantity=3,
+        )
+
+    def test_hold_reduces_stock_for_other_carts_only(self):
+        cart = make_cart(self.product, 2, 'alice')
+        reserve_cart(cart)
+
+        self.assertEqual(available_quantity(self.product), 1)
+        self.assertEqual(available_quantity(self.product, exclude_cart=cart), 3)
+
+    def test_reservation_fails_when_stock_is_held(self):
+        reserve_cart(make_cart(self.product, 3, 'alice'))
+
+        with self.assertRaises(InsufficientStock) as raised:
+            reserve_cart(make_cart(self.product, 1, 'bob'))
+        self.assertEqual(raised.exception.available, {self.product.id: 0})
+        self.assertEqual(StockReservation.objects.count(), 1)
+
+    def test_rereserving_refreshes_the_same_hold(self):
+        cart = make_cart(self.product, 1, 'alice')
+        reserve_cart(cart, ttl=60)
+        first_expiry = StockReservation.objects.get(cart=cart).expires_at
+
+        cart.items.update(quantity=2)
+        reserve_cart(cart, ttl=600)
+
+        hold = StockReservation.objects.get(cart=cart)
+        self.assertEqual(hold.quantity, 2)
+        self.assertGreater(hold.expires_at, first_expiry)
+
+    def test_released_hold_frees_stock(self):
+        cart = make_cart(self.product, 3, 'alice')
+        reserve_cart(cart)
+        release_cart(cart)
+
+        self.assertEqual(available_quantity(self.product), 3)
+
+    def test_expired_holds_stop_counting_and_are_swept(self):
+        cart = make_cart(self.product, 3, 'alice')
+        reserve_cart(cart)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(available_quantity(self.product), 3)
+        bob_cart = make_cart(self.product, 3, 'bob')
+        reserve_cart(bob_cart)
+
+        self.assertEqual(release_expired(batch_size=1), 1)
+        self.assertEqual(list(StockReservation.objects.values_list('cart', flat=True)), [bob_cart.id])
+
+
+class ConcurrentReservationTests(TransactionTestCase):
+
+    def test_concurrent_checkouts_never_hold_more_than_stock(self):
+        category = Category.objects.create(name='Phones')
+        product = Product.objects.create(
+            name='Phone', description='A phone', category=category, price=100, stock_quantity=2,
+        )
+        carts = [make_cart(product, 1, f'user{i}') for i in range(8)]
+        barrier = threading.Barrier(len(carts))
+        outcomes = []
+
+        def checkout(cart):
+            barrier.wait()
+            try:
+                reserve_cart(cart)
+                outcomes.append('held')
+            except (InsufficientStock, DatabaseError):
+                # Losing the race (or the database lock) is a clean refusal
+                outcomes.append('refused')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(cart,)) for cart in carts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        held = StockReservation.objects.filter(product=product)
+        self.assertEqual(outcomes.count('held'), held.count())
+        self.assertLessEqual(sum(held.values_list('quantity', flat=True)), product.stock_quantity)
+        self.assertEqual(available_quantity(product), product.stock_quantity - held.count())
+
+
+class CartAdminTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Phones')
+        self.products = [
+            Product.objects.create(name='Phone', description='A phone', category=category, price=100,
+                                   discount_price=80, stock_quantity=5),
+            # A "discount" above the price is ignored, as get_final_price does
+            Product.objects.create(name='Case', description='A case', category=category, price=10,
+                                   discount_price=12, stock_quantity=5),
+            Product.objects.create(name='Cable', description='A cable', category=category, price=5,
+                                   stock_quantity=5),
+        ]
+        self.client.force_login(User.objects.create_superuser('admin', email='admin@example.com', password='x'))
+
+    def add_cart(self, username):
+        cart = Cart.objects.create(user=User.objects.create(username=username, email=f'{username}@example.com'))
+        for quantity, product in enumerate(self.products, start=1):
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+        return cart
+
+    def queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_changelists_take_the_same_queries_for_more_carts(self):
+        self.add_cart('alice')
+        counts = [self.queries(reverse(f'admin:cart_{name}_changelist')) for name in ['cart', 'cartitem']]
+        for i in range(4):
+            self.add_cart(f'user{i}')
+        with self.assertNumQueries(counts[0]):
+            self.client.get(reverse('admin:cart_cart_changelist'))
+        with self.assertNumQueries(counts[1]):
+            self.client.get(reverse('admin:cart_cartitem_changelist'))
+
+    def test_annotated_totals_match_get_final_price(self):
+        cart = self.add_cart('alice')
+        request = RequestFactory().get('/')
+        annotated = CartAdmin(Cart, admin.site).get_queryset(request).get(id=cart.id)
+        self.assertEqual(annotated.total_price, cart.get_total_price())
+        self.assertEqual(annotated.total_price, 80 * 1 + 10 * 2 + 5 * 3)
+        self.assertEqual(annotated.total_items, 6)
+        for item in CartItemAdmin(CartItem, admin.site).get_queryset(request).select_related('product'):
+            self.assertEqual(item.unit_price, item.product.get_final_price())
+            self.assertEqual(item.line_total, item.get_total_price())
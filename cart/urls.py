@@ -10,6 +10,8 @@ urlpatterns = [
     path('update/<int:item_id>/', views.update_cart_item, name='update_cart_item'),
     path('remove/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
     path('clear/', views.clear_cart, name='clear_cart'),
+    path('coupon/apply/', views.apply_coupon, name='apply_coupon'),
+    path('coupon/remove/', views.remove_coupon, name='remove_coupon'),
 
     # AJAX URLs
     path('ajax/add/<int:product_id>/', views.add_to_cart_ajax, name='add_to_cart_ajax'),
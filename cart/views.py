@@ -5,7 +5,10 @@ from django.contrib import messages
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 from .models import Cart, CartItem
+from .reservations import available_quantity, release_cart
 from products.models import Product
+from orders.charges import default_destination, quote_cart
+from promotions.engine import apply_to_cart
 
 def get_or_create_cart(request):
     """Get or create cart for user or session"""
@@ -22,11 +25,19 @@ def get_or_create_cart(request):
 def cart_detail(request):
     """Display cart contents"""
     cart = get_or_create_cart(request)
-    cart_items = cart.items.select_related('product').prefetch_related('product__images')
+    cart_items = list(cart.items.select_related('product').prefetch_related('product__images'))
+    
+    promotions = apply_to_cart(cart_items, request.user, request.session.get('coupon_code'))
+    
+    # Estimated for the default address; checkout re-quotes for the real one
+    charges = quote_cart(cart_items, *default_destination(request.user), promotions=promotions)
     
     context = {
         'cart': cart,
         'cart_items': cart_items,
+        'charges': charges,
+        'promotions': promotions,
+        'coupon_code': request.session.get('coupon_code', ''),
     }
     return render(request, 'cart/cart_detail.html', context)
 
@@ -36,14 +47,14 @@ def add_to_cart(request, product_id):
     """Add product to cart"""
     product = get_object_or_404(Product, id=product_id, is_available=True)
     quantity = int(request.POST.get('quantity', 1))
+    cart = get_or_create_cart(request)
     
-    # Check stock
-    if quantity > product.stock_quantity:
-        messages.error(request, f'Only {product.stock_quantity} items available in stock.')
+    # Check stock that is not held by other checkouts
+    available = available_quantity(product, exclude_cart=cart)
+    if quantity > available:
+        messages.error(request, f'Only {available} items available in stock.')
         return redirect('products:product_detail', slug=product.slug)
     
-    cart = get_or_create_cart(request)
-    
     # Get or create cart item
     cart_item, created = CartItem.objects.get_or_create(
         cart=cart,
@@ -54,8 +65,8 @@ def add_to_cart(request, product_id):
     if not created:
         # Update quantity if item already exists
         new_quantity = cart_item.quantity + quantity
-        if new_quantity > product.stock_quantity:
-            messages.error(request, f'Only {product.stock_quantity} items available in stock.')
+        if new_quantity > available:
+            messages.error(request, f'Only {available} items available in stock.')
             return redirect('cart:cart_detail')
         cart_item.quantity = new_quantity
         cart_item.save()
@@ -73,13 +84,15 @@ def update_cart_item(request, item_id):
     quantity = int(request.POST.get('quantity', 1))
     
     if quantity > 0:
-        if quantity > cart_item.product.stock_quantity:
-            messages.error(request, f'Only {cart_item.product.stock_quantity} items available.')
+        available = available_quantity(cart_item.product, exclude_cart=cart_item.cart)
+        if quantity > available:
+            messages.error(request, f'Only {available} items available.')
         else:
             cart_item.quantity = quantity
             cart_item.save()
             messages.success(request, 'Cart updated successfully!')
     else:
+        release_cart(cart_item.cart, [cart_item.product_id])
         cart_item.delete()
         messages.success(request, 'Item removed from cart.')
     
@@ -90,6 +103,7 @@ def remove_from_cart(request, item_id):
     """Remove item from cart"""
     cart_item = get_object_or_404(CartItem, id=item_id)
     product_name = cart_item.product.name
+    release_cart(cart_item.cart, [cart_item.product_id])
     cart_item.delete()
     messages.success(request, f'{product_name} removed from cart.')
     return redirect('cart:cart_detail')
@@ -98,25 +112,50 @@ def remove_from_cart(request, item_id):
 def clear_cart(request):
     """Clear all items from cart"""
     cart = get_or_create_cart(request)
+    release_cart(cart)
     cart.items.all().delete()
     messages.success(request, 'Cart cleared successfully!')
     return redirect('cart:cart_detail')
 
 
+@require_POST
+def apply_coupon(request):
+    """Apply a coupon code to the cart"""
+    code = request.POST.get('code', '').strip().upper()
+    cart = get_or_create_cart(request)
+    cart_items = list(cart.items.select_related('product'))
+    promotions = apply_to_cart(cart_items, request.user, code)
+    if promotions.coupon is None:
+        messages.error(request, promotions.coupon_error or 'This coupon cannot be applied.')
+    else:
+        request.session['coupon_code'] = code
+        messages.success(request, f'Coupon {code} applied!')
+    return redirect('cart:cart_detail')
+
+
+@require_POST
+def remove_coupon(request):
+    """Remove the applied coupon"""
+    request.session.pop('coupon_code', None)
+    messages.success(request, 'Coupon removed.')
+    return redirect('cart:cart_detail')
+
+
 # AJAX Views for dynamic cart updates
 @require_POST
 def add_to_cart_ajax(request, product_id):
     """Add to cart via AJAX"""
     product = get_object_or_404(Product, id=product_id, is_available=True)
     quantity = int(request.POST.get('quantity', 1))
+    cart = get_or_create_cart(request)
+    available = available_quantity(product, exclude_cart=cart)
     
-    if quantity > product.stock_quantity:
+    if quantity > available:
         return JsonResponse({
             'success': False,
-            'message': f'Only {product.stock_quantity} items available.'
+            'message': f'Only {available} items available.'
         })
     
-    cart = get_or_create_cart(request)
     cart_item, created = CartItem.objects.get_or_create(
         cart=cart,
         product=product,
@@ -125,10 +164,10 @@ def add_to_cart_ajax(request, product_id):
     
     if not created:
         new_quantity = cart_item.quantity + quantity
-        if new_quantity > product.stock_quantity:
+        if new_quantity > available:
             return JsonResponse({
                 'success': False,
-                'message': f'Only {product.stock_quantity} items available.'
+                'message': f'Only {available} items available.'
             })
         cart_item.quantity = new_quantity
         cart_item.save()
@@ -0,0 +1,6 @@
+import random
+
+
+def retry_delay(attempts, base=5, cap=3600):
+    """Exponential backoff with full jitter, in seconds"""
+    return random.uniform(0, min(cap, base * 2 ** attempts))
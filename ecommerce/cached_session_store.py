@@ -0,0 +1,27 @@
+"""``ecommerce.session_store`` with reads served from a shared cache.
+
+Use with ``SESSION_ENGINE = 'ecommerce.cached_session_store'`` and a cache
+shared by every worker (Redis or Memcached) as ``SESSION_CACHE_ALIAS``. With
+a per-process cache a logout in one worker would leave the session alive in
+the others until it expired, so local-memory and dummy caches are refused.
+"""
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+
+from .session_store import SessionStore as DBStore
+
+
+class SessionStore(DBStore, CachedDBStore):
+    """Reads come from the cache; unchanged sessions are neither saved nor re-cached"""
+
+    def __init__(self, session_key=None):
+        if isinstance(caches[settings.SESSION_CACHE_ALIAS], (LocMemCache, DummyCache)):
+            raise ImproperlyConfigured(
+                'ecommerce.cached_session_store needs a cache shared by all workers; '
+                f'the {settings.SESSION_CACHE_ALIAS!r} cache is local to each process.'
+            )
+        super().__init__(session_key)
@@ -0,0 +1,113 @@
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+class CursorPage:
+    """One page of a keyset-paginated queryset"""
+
+    def __init__(self, items, next_cursor):
+        self.object_list = items
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(values):
+    raw = json.dumps([_encode_value(value) for value in values]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, queryset, fields):
+    """Turn a cursor back into typed field values; None if it is malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(values, list) or len(values) != len(fields):
+        return None
+
+    typed = []
+    for name, value in zip(fields, values):
+        try:
+            value = queryset.model._meta.get_field(name).to_python(value)
+        except FieldDoesNotExist:
+            pass  # annotation; JSON already gives the right type
+        except ValidationError:
+            return None
+        typed.append(value)
+    return typed
+
+
+def _page_query(queryset, values, fields):
+    """``queryset`` newest first by ``fields``, after the decoded cursor ``values``"""
+    queryset = queryset.order_by(*[f'-{name}' for name in fields])
+    if values:
+        after = Q()
+        for i, name in enumerate(fields):
+            step = Q(**{f'{name}__lt': values[i]})
+            for prev_name, prev_value in zip(fields[:i], values[:i]):
+                step &= Q(**{prev_name: prev_value})
+            after |= step
+        queryset = queryset.filter(after)
+    return queryset
+
+
+def _page(items, fields, per_page):
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, name) for name in fields])
+    return CursorPage(items, next_cursor)
+
+
+def paginate_by_cursor(queryset, cursor=None, fields=('created_at', 'id'), per_page=10):
+    """Return the page after ``cursor``, newest first by ``fields``.
+
+    Pages are fetched with ``WHERE (f1, f2) < (v1, v2)`` style filters on an
+    ordered index instead of OFFSET, so every page costs the same however
+    deep it is. The last field must be unique (normally ``id``).
+    """
+    values = decode_cursor(cursor, queryset, fields) if cursor else None
+    items = list(_page_query(queryset, values, fields)[:per_page + 1])
+    return _page(items, fields, per_page)
+
+
+def paginate_merged(querysets, cursor=None, fields=('created_at', 'id'), per_page=10):
+    """paginate_by_cursor over several querysets read as one list.
+
+    Each is read up to a page past the cursor and the rows are merged, so
+    the models only need ``fields`` in common, and unique across them (as
+    archived rows keep their live ids).
+    """
+    values = decode_cursor(cursor, querysets[0], fields) if cursor else None
+    items = []
+    for queryset in querysets:
+        items.extend(_page_query(queryset, values, fields)[:per_page + 1])
+    items.sort(key=lambda item: [getattr(item, name) for name in fields], reverse=True)
+    return _page(items[:per_page + 1], fields, per_page)
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class LocalBuckets:
+    """Token buckets held in this process.
+
+    Each key gets ``capacity`` tokens, refilled continuously at
+    ``capacity / period`` per second. Only the ``max_keys`` most recently
+    used keys are kept, so a flood of distinct keys cannot grow memory.
+    """
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, period):
+        """Spend a token. Returns 0 when allowed, else seconds until one is available."""
+        rate = capacity / period
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def wait(self, key, capacity, period):
+        """Seconds until ``take`` would be allowed, without spending a token"""
+        rate = capacity / period
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * rate)
+        return 0 if tokens >= 1 else (1 - tokens) / rate
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBuckets:
+    """Attempt counters in a shared Django cache, for limits across processes.
+
+    A shared token bucket needs compare-and-swap, which the cache API lacks,
+    so this counts attempts per fixed window of ``period`` seconds with the
+    atomic ``add``/``incr``: the same budget, with bursts of up to twice
+    ``capacity`` at window edges.
+    """
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def _window(self, key, period):
+        window = int(time.time() // period)
+        return f'ratelimit:{key}:{window}', (window + 1) * period
+
+    def take(self, key, capacity, period):
+        cache = caches[self.alias]
+        cache_key, window_end = self._window(key, period)
+        if cache.add(cache_key, 1, timeout=period + 1):
+            return 0
+        try:
+            count = cache.incr(cache_key)
+        except ValueError:  # expired between add and incr
+            cache.add(cache_key, 1, timeout=period + 1)
+            return 0
+        if count <= capacity:
+            return 0
+        return window_end - time.time()
+
+    def wait(self, key, capacity, period):
+        cache_key, window_end = self._window(key, period)
+        if caches[self.alias].get(cache_key, 0) < capacity:
+            return 0
+        return window_end - time.time()
+
+    def clear(self):
+        pass
+
+
+_local = LocalBuckets()
+
+
+def get_buckets():
+    """The configured backend: RATELIMIT_CACHE names a shared cache, else in process"""
+    alias = getattr(settings, 'RATELIMIT_CACHE', None)
+    return CacheBuckets(alias) if alias else _local
+
+
+class RateLimiter:
+    """A named limit of ``capacity`` attempts per ``period`` seconds per key"""
+
+    def __init__(self, name, capacity, period):
+        self.name = name
+        self.capacity = capacity
+        self.period = period
+
+    def take(self, key):
+        """Count an attempt for ``key``; returns seconds to wait, 0 if allowed"""
+        if not key:
+            return 0
+        return get_buckets().take(f'{self.name}:{key}', self.capacity, self.period)
+
+    def wait(self, key):
+        """Seconds to wait before an attempt for ``key`` is allowed, without counting one"""
+        if not key:
+            return 0
+        return get_buckets().wait(f'{self.name}:{key}', self.capacity, self.period)
+
+
+def client_ip(request):
+    """The address the request came from.
+
+    Behind a reverse proxy, set RATELIMIT_IP_HEADER to the header it writes
+    the client address to (e.g. HTTP_X_REAL_IP); never trust one a client
+    could set itself.
+    """
+    header = getattr(settings, 'RATELIMIT_IP_HEADER', None)
+    if header and request.META.get(header):
+        return request.META[header].split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
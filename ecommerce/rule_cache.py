@@ -0,0 +1,50 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.db.models.signals import post_delete, post_save
+
+
+class CompiledRules:
+    """An object compiled from the rows of some models, rebuilt when they change.
+
+    Saves and deletes in this process drop it at once; changes made by other
+    processes are noticed by a count/last-modified check run at most every
+    RULES_CHECK_INTERVAL seconds. The models need an ``auto_now`` updated_at.
+    """
+
+    def __init__(self, build, *models):
+        self.build = build
+        self.models = models
+        self._lock = threading.Lock()
+        self._compiled = None
+        self._stamp = None
+        self._checked_at = 0.0
+        for model in models:
+            post_save.connect(self.invalidate, sender=model, weak=False)
+            post_delete.connect(self.invalidate, sender=model, weak=False)
+
+    def invalidate(self, **kwargs):
+        self._compiled = None
+
+    def _current_stamp(self):
+        return tuple(
+            tuple(model.objects.aggregate(count=Count('pk'), changed=Max('updated_at')).values())
+            for model in self.models
+        )
+
+    def get(self):
+        interval = getattr(settings, 'RULES_CHECK_INTERVAL', 30)
+        compiled = self._compiled
+        if compiled is not None and time.monotonic() - self._checked_at < interval:
+            return compiled
+        with self._lock:
+            compiled = self._compiled
+            if compiled is None or time.monotonic() - self._checked_at >= interval:
+                stamp = self._current_stamp()
+                if compiled is None or stamp != self._stamp:
+                    compiled = self._compiled = self.build()
+                    self._stamp = stamp
+                self._checked_at = time.monotonic()
+            return compiled
@@ -0,0 +1,63 @@
+"""Database-backed sessions that are only written when their data changes.
+
+Use with ``SESSION_ENGINE = 'ecommerce.session_store'``. Nothing is cached,
+so any number of workers can share it as is. Expired sessions are deleted a
+batch at a time by ``manage.py clearsessions``. For cached reads on top, see
+``ecommerce.cached_session_store``.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.utils import timezone
+
+
+class SessionStore(DBStore):
+    """Saves that would store identical data are skipped.
+
+    Django marks a session modified on every assignment, even of the value
+    it already holds, and each save is a database UPDATE. The data loaded
+    for a key is fingerprinted, and a save is only passed on when the
+    fingerprint or the key has changed.
+    """
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._stored = None  # (session_key, fingerprint) as last loaded or saved
+
+    def _fingerprint(self, data):
+        return hashlib.blake2b(self.serializer().dumps(data), digest_size=16).digest()
+
+    def load(self):
+        data = super().load()
+        if self.session_key is not None:
+            self._stored = (self.session_key, self._fingerprint(data))
+        return data
+
+    def save(self, must_create=False):
+        if not must_create and self._stored == (self.session_key, self._fingerprint(self._session)):
+            return
+        super().save(must_create)
+        self._stored = (self.session_key, self._fingerprint(self._session))
+
+    @classmethod
+    def clear_expired(cls, batch_size=None, pause=None):
+        """Delete expired sessions a batch at a time, so no long lock is held.
+
+        Used by ``manage.py clearsessions``. Returns the number deleted.
+        """
+        batch_size = batch_size or settings.SESSION_CLEANUP_BATCH_SIZE
+        pause = settings.SESSION_CLEANUP_PAUSE if pause is None else pause
+        sessions = cls.get_model_class().objects
+        now = timezone.now()
+        deleted = 0
+        while True:
+            keys = list(
+                sessions.filter(expire_date__lt=now).values_list('session_key', flat=True)[:batch_size]
+            )
+            if not keys:
+                return deleted
+            deleted += sessions.filter(session_key__in=keys, expire_date__lt=now).delete()[0]
+            if pause:
+                time.sleep(pause)
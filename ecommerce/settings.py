@@ -23,6 +23,7 @@ INSTALLED_APPS = [
     'cart',
     'payments',
     'reviews',
+    'promotions',
 ]
 
 MIDDLEWARE = [
@@ -89,3 +90,72 @@ AUTH_USER_MODEL = 'accounts.User'
 LOGIN_URL = 'accounts:login'
 LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'home'
+
+# Checkout stock holds expire after this many seconds
+STOCK_RESERVATION_TTL = 15 * 60
+
+# Invoices
+INVOICE_SELLER_NAME = 'ShopHub'
+INVOICE_UPI_ID = ''  # UPI VPA encoded in the invoice payment QR code
+
+# Delivered and cancelled orders move to the archive tables after this many days
+ORDER_ARCHIVE_AFTER_DAYS = 365
+
+# Seconds between checks for shipping, tax and promotion rule changes made by
+# other processes
+RULES_CHECK_INTERVAL = 30
+
+# Shared secret for verifying payment gateway webhook signatures
+RAZORPAY_WEBHOOK_SECRET = os.environ.get('RAZORPAY_WEBHOOK_SECRET', '')
+
+# Payment gateway API credentials; online payments are offered only when set
+RAZORPAY_KEY_ID = os.environ.get('RAZORPAY_KEY_ID', '')
+RAZORPAY_KEY_SECRET = os.environ.get('RAZORPAY_KEY_SECRET', '')
+PAYMENT_GATEWAY_URL = os.environ.get('PAYMENT_GATEWAY_URL', 'https://api.razorpay.com')
+
+# (connect, read) timeouts in seconds and retries of idempotent gateway calls
+PAYMENT_GATEWAY_TIMEOUT = (3.05, 10)
+PAYMENT_GATEWAY_RETRIES = 2
+
+# Consecutive gateway failures that open the circuit, and seconds before a retry
+PAYMENT_GATEWAY_BREAKER_THRESHOLD = 5
+PAYMENT_GATEWAY_BREAKER_RESET = 30
+
+# Seconds a user's payment history totals stay cached; payment changes bump a
+# version stored in the database, which retires them in every process
+PAYMENT_SUMMARY_CACHE_TIMEOUT = 60 * 60
+
+# Login attempts allowed as (attempts, per seconds), checked before any
+# password hashing
+LOGIN_RATE_LIMIT_PER_IP = (20, 60)
+# The per-username limit stops password guessing spread over many IPs, at a
+# cost: anyone can spend a username's budget and keep its owner from logging
+# in until it refills. Keep the period short so such a lockout stays brief.
+LOGIN_RATE_LIMIT_PER_USERNAME = (10, 60)
+
+# Cache alias shared by all workers for rate limits; None keeps them per process
+RATELIMIT_CACHE = None
+
+# request.META key holding the client address written by a trusted reverse
+# proxy (e.g. 'HTTP_X_REAL_IP'); None uses REMOTE_ADDR
+RATELIMIT_IP_HEADER = None
+
+# Sessions live in the database and are only written when they change.
+# 'ecommerce.cached_session_store' also reads them from the cache, but needs a
+# CACHES backend shared by all workers (Redis or Memcached) and refuses the
+# default local-memory cache
+SESSION_ENGINE = 'ecommerce.session_store'
+
+# clearsessions deletes expired sessions this many at a time, pausing
+# between batches (seconds)
+SESSION_CLEANUP_BATCH_SIZE = 1000
+SESSION_CLEANUP_PAUSE = 0.1
+
+# Personal data exports streamed at once by each process, and exports each
+# user may start as (exports, per seconds)
+DATA_EXPORT_MAX_CONCURRENT = 4
+DATA_EXPORT_RATE_LIMIT = (3, 60 * 60)
+
+# Estimated share of character shingles two review comments must have in
+# common to be flagged as near-duplicates
+REVIEW_DUPLICATE_THRESHOLD = 0.75
@@ -34,6 +34,7 @@ urlpatterns = [
     path('cart/', include('cart.urls')),
     path('orders/', include('orders.urls')),
     path('payments/', include('payments.urls')),
+    path('reviews/', include('reviews.urls')),
 ]
 
 if settings.DEBUG:
@@ -1,13 +1,30 @@
 
 # Register your models here.
+from datetime import timedelta
+
 from django.contrib import admin
-from .models import Order, OrderItem, ShippingAddress
+from django.core.exceptions import PermissionDenied
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum
+from django.template.response import TemplateResponse
+from django.shortcuts import redirect
+from django.urls import path, reverse
+from django.utils import timezone
+from .cancellation import cancel_orders
+from .forms import TrackingImportForm
+from .fulfilment import advance_orders, import_tracking_csv
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, DailyOrderRollup, DailySalesRollup, Invoice, Order, OrderItem, OutboxEvent,
+    ShippingAddress, ShippingRule, TaxRule,
+)
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
     readonly_fields = ['product', 'quantity', 'price', 'get_total_price']
     can_delete = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
     
     def get_total_price(self, obj):
         return f"₹{obj.get_total_price()}"
@@ -18,12 +35,14 @@ class OrderAdmin(admin.ModelAdmin):
     list_display = ['order_number', 'user', 'total_amount', 'status', 'payment_status', 
                     'payment_method', 'created_at']
     list_filter = ['status', 'payment_status', 'payment_method', 'created_at']
+    list_select_related = ['user']
     search_fields = ['order_number', 'user__username', 'user__email', 'phone', 'email']
-    readonly_fields = ['order_number', 'created_at', 'updated_at']
+    # State changes go through the transition actions, never the form
+    readonly_fields = ['order_number', 'status', 'payment_status', 'version', 'created_at', 'updated_at']
     
     fieldsets = (
         ('Order Information', {
-            'fields': ('order_number', 'user', 'status', 'created_at', 'updated_at')
+            'fields': ('order_number', 'user', 'status', 'version', 'created_at', 'updated_at')
         }),
         ('Pricing', {
             'fields': ('subtotal', 'shipping_cost', 'tax', 'total_amount')
@@ -42,22 +61,210 @@ class OrderAdmin(admin.ModelAdmin):
     )
     
     inlines = [OrderItemInline]
+    actions = ['mark_processing', 'mark_shipped', 'mark_delivered', 'cancel_selected_orders']
     
-    def get_queryset(self, request):
-        return super().get_queryset(request).select_related('user')
+    def _advance(self, request, queryset, status):
+        changed = advance_orders(queryset, status)
+        skipped = queryset.count() - changed
+        self.message_user(request, f'{changed} order(s) marked {status}, {skipped} skipped.')
+    
+    @admin.action(description='Mark selected pending orders as processing')
+    def mark_processing(self, request, queryset):
+        self._advance(request, queryset, 'processing')
+    
+    @admin.action(description='Mark selected processing orders as shipped')
+    def mark_shipped(self, request, queryset):
+        self._advance(request, queryset, 'shipped')
+    
+    @admin.action(description='Mark selected shipped orders as delivered')
+    def mark_delivered(self, request, queryset):
+        self._advance(request, queryset, 'delivered')
+    
+    @admin.action(description='Cancel selected orders and restock items')
+    def cancel_selected_orders(self, request, queryset):
+        cancelled = cancel_orders(queryset)
+        skipped = queryset.count() - len(cancelled)
+        self.message_user(request, f'{len(cancelled)} order(s) cancelled, {skipped} not cancellable.')
+    
+    def save_model(self, request, obj, form, change):
+        if change:
+            # Write only the edited columns so a concurrent transition is not undone
+            obj.save(update_fields=[*form.changed_data, 'updated_at'])
+        else:
+            super().save_model(request, obj, form, change)
+    
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        # Archived orders keep their id, so old links land on the archive copy
+        if (not Order.objects.filter(pk=object_id).exists()
+                and ArchivedOrder.objects.filter(pk=object_id).exists()):
+            return redirect(reverse('admin:orders_archivedorder_change', args=[object_id]))
+        return super().change_view(request, object_id, form_url, extra_context)
+    
+    def get_urls(self):
+        return [
+            path('import-tracking/', self.admin_site.admin_view(self.import_tracking_view),
+                 name='orders_order_import_tracking'),
+        ] + super().get_urls()
+    
+    def import_tracking_view(self, request):
+        """Upload an order_number,tracking_number,status CSV"""
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        result = None
+        if request.method == 'POST':
+            form = TrackingImportForm(request.POST, request.FILES)
+            if form.is_valid():
+                result = import_tracking_csv(form.cleaned_data['file'].file)
+        else:
+            form = TrackingImportForm()
+        
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Import Tracking Numbers',
+            'opts': self.model._meta,
+            'form': form,
+            'result': result,
+        }
+        return TemplateResponse(request, 'admin/orders/import_tracking.html', context)
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = ['order', 'product', 'quantity', 'price', 'get_total_price', 'created_at']
     list_filter = ['created_at']
+    list_select_related = ['order__user', 'product']
     search_fields = ['order__order_number', 'product__name']
-    
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            line_total=ExpressionWrapper(
+                F('price') * F('quantity'),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            )
+        )
+
     def get_total_price(self, obj):
-        return f"₹{obj.get_total_price()}"
+        return f"₹{obj.line_total}"
     get_total_price.short_description = 'Total Price'
+    get_total_price.admin_order_field = 'line_total'
 
 @admin.register(ShippingAddress)
 class ShippingAddressAdmin(admin.ModelAdmin):
     list_display = ['user', 'full_name', 'city', 'state', 'is_default', 'created_at']
     list_filter = ['is_default', 'state', 'created_at']
-    search_fields = ['user__username', 'full_name', 'phone', 'city']
\ No newline at end of file
+    list_select_related = ['user']
+    search_fields = ['user__username', 'full_name', 'phone', 'city']
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'event_type', 'order', 'status', 'attempts', 'available_at',
+                    'created_at', 'processed_at']
+    list_filter = ['status', 'event_type']
+    list_select_related = ['order__user']
+    search_fields = ['order__order_number', 'event_type']
+    readonly_fields = ['created_at', 'processed_at', 'locked_by', 'locked_at', 'last_error', 'completed_handlers']
+
+@admin.register(Invoice)
+class InvoiceAdmin(admin.ModelAdmin):
+    list_display = ['invoice_number', 'order', 'generated_at']
+    list_select_related = ['order__user']
+    search_fields = ['invoice_number', 'order__order_number']
+    readonly_fields = ['content_hash', 'generated_at']
+
+@admin.register(DailySalesRollup)
+class DailySalesRollupAdmin(admin.ModelAdmin):
+    list_display = ['date', 'category', 'brand', 'payment_method', 'orders', 'units', 'gross',
+                    'discounts', 'cancellations', 'cancelled_gross']
+    list_filter = ['payment_method', 'date', 'category', 'brand']
+    list_select_related = ['category', 'brand']
+    date_hierarchy = 'date'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def get_urls(self):
+        return [
+            path('dashboard/', self.admin_site.admin_view(self.dashboard_view), name='orders_sales_dashboard'),
+        ] + super().get_urls()
+    
+    def dashboard_view(self, request):
+        """Sales dashboard; reads only the rollup table"""
+        try:
+            days = max(1, min(int(request.GET.get('days', 30)), 366))
+        except ValueError:
+            days = 30
+        since = timezone.localdate() - timedelta(days=days - 1)
+        rollups = DailySalesRollup.objects.filter(date__gte=since).order_by()
+        sums = {f'total_{name}': Sum(name) for name in ['units', 'gross', 'discounts', 'cancelled_gross']}
+        # Order counts only add up at the day x payment method grain, where each order is one row
+        order_rollups = DailyOrderRollup.objects.filter(date__gte=since).order_by()
+        order_sums = {'total_orders': Sum('orders'), 'total_cancellations': Sum('cancellations')}
+        
+        def breakdown(field, counts_orders=False):
+            rows = list(rollups.values(label=F(field)).annotate(**sums).order_by('label'))
+            if counts_orders:
+                counts = {row.pop('label'): row for row in order_rollups.values(label=F(field)).annotate(**order_sums)}
+                for row in rows:
+                    row.update(counts.get(row['label'], {}))
+            return rows
+        
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Sales Dashboard',
+            'opts': self.model._meta,
+            'days': days,
+            'since': since,
+            'summary': {**rollups.aggregate(**sums), **order_rollups.aggregate(**order_sums)},
+            'sections': [
+                ('By Day', breakdown('date', counts_orders=True), True),
+                ('By Category', breakdown('category__name'), False),
+                ('By Brand', breakdown('brand__name'), False),
+                ('By Payment Method', breakdown('payment_method', counts_orders=True), True),
+            ],
+        }
+        return TemplateResponse(request, 'admin/orders/sales_dashboard.html', context)
+
+class ArchivedOrderItemInline(admin.TabularInline):
+    model = ArchivedOrderItem
+    extra = 0
+    can_delete = False
+    fields = ['product', 'quantity', 'price', 'created_at']
+    readonly_fields = fields
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+    
+    def has_add_permission(self, request, obj=None):
+        return False
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ['order_number', 'user', 'total_amount', 'status', 'payment_method',
+                    'created_at', 'archived_at']
+    list_filter = ['status', 'payment_method', 'archived_at']
+    list_select_related = ['user']
+    search_fields = ['order_number', 'user__username', 'user__email', 'phone', 'email']
+    inlines = [ArchivedOrderItemInline]
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(ShippingRule)
+class ShippingRuleAdmin(admin.ModelAdmin):
+    list_display = ['name', 'state', 'pincode_from', 'pincode_to', 'category', 'charge',
+                    'free_above', 'priority', 'is_active']
+    list_filter = ['is_active', 'category']
+    list_select_related = ['category']
+    search_fields = ['name', 'state']
+
+@admin.register(TaxRule)
+class TaxRuleAdmin(admin.ModelAdmin):
+    list_display = ['name', 'state', 'category', 'rate', 'priority', 'is_active']
+    list_filter = ['is_active', 'category']
+    list_select_related = ['category']
+    search_fields = ['name', 'state']
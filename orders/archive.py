@@ -0,0 +1,106 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
+from django.utils import timezone
+
+from payments.models import ArchivedPayment, ArchivedRefund, Payment, Refund
+from .models import ArchivedOrder, ArchivedOrderItem, Invoice, Order, OrderItem
+
+ARCHIVABLE_STATUSES = ('delivered', 'cancelled')
+
+# Orders with outbox events still to run stay live; deleting them would drop the events
+UNFINISHED_EVENT_STATUSES = ('pending', 'processing')
+
+
+def get_archive_age():
+    """Days after which delivered/cancelled orders are archived"""
+    return getattr(settings, 'ORDER_ARCHIVE_AFTER_DAYS', 365)
+
+
+def _copy(obj, model, **extra):
+    """Build an archive row from ``obj``, copying every column both models share"""
+    names = {field.attname for field in obj._meta.concrete_fields}
+    values = {
+        field.attname: getattr(obj, field.attname)
+        for field in model._meta.concrete_fields
+        if field.attname in names
+    }
+    return model(**values, **extra)
+
+
+def archivable_orders():
+    """Delivered or cancelled orders with no outbox event left to run"""
+    return Order.objects.filter(status__in=ARCHIVABLE_STATUSES).exclude(
+        outbox_events__status__in=UNFINISHED_EVENT_STATUSES
+    )
+
+
+def archive_chunk(order_ids, now=None):
+    """Move the given orders with their items, payments and refunds to the archive.
+
+    Runs in one transaction; rows keep their ids so references stay readable.
+    Orders that are not archivable (see archivable_orders) are skipped.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        # Locked, so no event can be enqueued for them until they are gone
+        orders = list(archivable_orders().select_for_update().filter(id__in=order_ids).order_by('id'))
+        if not orders:
+            return 0
+        ids = [order.id for order in orders]
+        invoices = dict(Invoice.objects.filter(order_id__in=ids).values_list('order_id', 'file'))
+        payments = list(Payment.objects.filter(order_id__in=ids))
+
+        ArchivedOrder.objects.bulk_create([
+            _copy(order, ArchivedOrder, archived_at=now, invoice_file=invoices.get(order.id) or '')
+            for order in orders
+        ])
+        ArchivedOrderItem.objects.bulk_create([
+            _copy(item, ArchivedOrderItem) for item in OrderItem.objects.filter(order_id__in=ids)
+        ])
+        ArchivedPayment.objects.bulk_create([
+            _copy(payment, ArchivedPayment, archived_at=now) for payment in payments
+        ])
+        ArchivedRefund.objects.bulk_create([
+            _copy(refund, ArchivedRefund)
+            for refund in Refund.objects.filter(payment__in=[payment.id for payment in payments])
+        ])
+
+        # Cascades to items, payments, refunds, invoice rows and finished outbox events.
+        # Invoice files stay in storage and are referenced by invoice_file.
+        Order.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+def archive_orders(older_than_days=None, chunk_size=500):
+    """Archive delivered/cancelled orders older than the cutoff, one chunk per transaction"""
+    if older_than_days is None:
+        older_than_days = get_archive_age()
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    archived = 0
+    last_id = 0
+    while True:
+        ids = list(
+            archivable_orders().filter(created_at__lt=cutoff, id__gt=last_id)
+            .order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return archived
+        last_id = ids[-1]
+        archived += archive_chunk(ids)
+
+
+def get_user_order(user, order_number):
+    """Look an order up in the live tables, falling back to the archive.
+
+    Returns ``(order, order_items)``; raises Http404 if neither has it.
+    """
+    order = Order.objects.filter(order_number=order_number, user=user).first()
+    if order is None:
+        order = ArchivedOrder.objects.filter(order_number=order_number, user=user).first()
+    if order is None:
+        raise Http404('No order matches the given query.')
+    order_items = order.items.select_related('product').prefetch_related('product__images')
+    return order, order_items
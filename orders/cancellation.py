@@ -0,0 +1,47 @@
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from products.stock import restore_stock
+from promotions.engine import release_redemptions
+from .models import Order, OrderItem
+from .outbox import enqueue_many
+from .transitions import ORDER_TRANSITIONS
+
+CANCELLABLE_STATUSES = ORDER_TRANSITIONS['cancelled']
+
+
+def cancel_orders(orders):
+    """Cancel the given orders that are still cancellable and restock their items.
+
+    ``orders`` may be a queryset or an iterable of ids. The status change is a
+    guarded ``UPDATE ... WHERE status IN ('pending', 'processing')`` and the
+    restock a single batched F() update, both in one transaction, so a repeated
+    or concurrent cancel of the same order restores stock (and coupon uses)
+    only once. Returns the ids of the orders this call cancelled.
+    """
+    if not hasattr(orders, 'values_list'):
+        orders = Order.objects.filter(id__in=list(orders))
+
+    with transaction.atomic():
+        # Row locks make a concurrent cancel wait and then skip these orders
+        order_ids = list(
+            orders.select_for_update()
+            .filter(status__in=CANCELLABLE_STATUSES)
+            .order_by('id').values_list('id', flat=True)
+        )
+        if not order_ids:
+            return []
+
+        Order.objects.filter(id__in=order_ids, status__in=CANCELLABLE_STATUSES).update(
+            status='cancelled', updated_at=timezone.now(), version=F('version') + 1,
+        )
+
+        quantities = (
+            OrderItem.objects.filter(order_id__in=order_ids)
+            .order_by().values('product_id').annotate(quantity=Sum('quantity'))
+        )
+        restore_stock({row['product_id']: row['quantity'] for row in quantities})
+        release_redemptions(order_ids)
+        enqueue_many('order.cancelled', order_ids, payload={'to': 'cancelled'})
+    return order_ids
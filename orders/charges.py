@@ -0,0 +1,193 @@
+from bisect import bisect_right
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+
+from ecommerce.rule_cache import CompiledRules
+from .models import ShippingAddress, ShippingRule, TaxRule
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+
+def _normalize_state(state):
+    return (state or '').strip().casefold()
+
+
+def _parse_pincode(pincode):
+    try:
+        return int(str(pincode).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _better(rule, other):
+    """Higher priority wins; the older rule wins a tie"""
+    return other is None or (rule.priority, -rule.pk) > (other.priority, -other.pk)
+
+
+class _Scope:
+    """The rules of one category scope, indexed by destination.
+
+    Pincode ranges may overlap, so the pincode axis is cut at every range
+    boundary into segments that each map to the best rule covering them;
+    a lookup is then a single bisect over the sorted segment starts.
+    """
+
+    def __init__(self, rules):
+        self.default = None
+        self.by_state = {}
+        ranged = []
+        for rule in rules:
+            if getattr(rule, 'pincode_from', None) is not None:
+                ranged.append(rule)
+            elif rule.state:
+                key = _normalize_state(rule.state)
+                if _better(rule, self.by_state.get(key)):
+                    self.by_state[key] = rule
+            elif _better(rule, self.default):
+                self.default = rule
+
+        self.starts = sorted(
+            {rule.pincode_from for rule in ranged} | {rule.pincode_to + 1 for rule in ranged}
+        )
+        self.segments = []
+        for start in self.starts:
+            best = None
+            for rule in ranged:
+                if rule.pincode_from <= start <= rule.pincode_to and _better(rule, best):
+                    best = rule
+            self.segments.append(best)
+
+    def match(self, state, pincode):
+        """Most specific rule: pincode range, then state, then the default"""
+        if pincode is not None and self.starts:
+            i = bisect_right(self.starts, pincode) - 1
+            if i >= 0 and self.segments[i] is not None:
+                return self.segments[i]
+        return self.by_state.get(state) or self.default
+
+
+class RuleTable:
+    """Rules of one kind compiled for lookups by category and destination.
+
+    A rule for the line's category beats a rule for all categories, however
+    specific the latter's destination is.
+    """
+
+    def __init__(self, rules):
+        scoped = defaultdict(list)
+        for rule in rules:
+            scoped[rule.category_id].append(rule)
+        self.scopes = {category_id: _Scope(rules) for category_id, rules in scoped.items()}
+        self.generic = self.scopes.get(None)
+
+    def lookup(self, category_id, state, pincode):
+        scope = self.scopes.get(category_id)
+        rule = scope.match(state, pincode) if scope is not None else None
+        if rule is None and self.generic is not None:
+            rule = self.generic.match(state, pincode)
+        return rule
+
+
+class Charges:
+    """Shipping and tax quoted for a set of cart lines"""
+
+    def __init__(self, subtotal, shipping, tax, free_shipping_gap=None, discount=ZERO):
+        self.subtotal = subtotal
+        self.discount = discount
+        self.shipping = shipping
+        self.tax = tax
+        self.total = subtotal - discount + shipping + tax
+        # Amount to add to make shipping free, when one more purchase can do it
+        self.free_shipping_gap = free_shipping_gap
+
+
+class ChargeEngine:
+    """Evaluates shipping and tax rules without touching the database"""
+
+    def __init__(self, shipping_rules, tax_rules):
+        self.shipping = RuleTable(shipping_rules)
+        self.tax = RuleTable(tax_rules)
+
+    def quote(self, lines, state=None, pincode=None, discounts=None):
+        """Price ``(category_id, unit_price, quantity)`` lines for a destination.
+
+        ``discounts`` maps category ids to promotion discounts on their lines.
+        Each shipping rule is charged once for all the lines it covers, unless
+        their discounted subtotal reaches its ``free_above``; tax is charged
+        per category on the discounted amount, at the rate of the rule
+        covering it.
+        """
+        state = _normalize_state(state)
+        pincode = _parse_pincode(pincode)
+        discounts = discounts or {}
+
+        by_category = defaultdict(lambda: ZERO)
+        for category_id, price, quantity in lines:
+            by_category[category_id] += price * quantity
+
+        subtotal = ZERO
+        discount = ZERO
+        tax = ZERO
+        covered = {}  # shipping rule -> subtotal of the lines it covers
+        for category_id, amount in by_category.items():
+            subtotal += amount
+            category_discount = min(discounts.get(category_id, ZERO), amount)
+            discount += category_discount
+            amount -= category_discount
+            rule = self.shipping.lookup(category_id, state, pincode)
+            if rule is not None:
+                covered[rule] = covered.get(rule, ZERO) + amount
+            rule = self.tax.lookup(category_id, state, pincode)
+            if rule is not None:
+                tax += (amount * rule.rate / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+
+        shipping = ZERO
+        charged = []
+        for rule, amount in covered.items():
+            if rule.free_above is not None and amount >= rule.free_above:
+                continue
+            shipping += rule.charge
+            charged.append((rule, amount))
+
+        gap = None
+        if len(charged) == 1 and charged[0][0].free_above is not None:
+            rule, amount = charged[0]
+            gap = rule.free_above - amount
+        return Charges(subtotal, shipping, tax, gap, discount)
+
+
+def _build_engine():
+    return ChargeEngine(
+        ShippingRule.objects.filter(is_active=True),
+        TaxRule.objects.filter(is_active=True),
+    )
+
+
+_rules = CompiledRules(_build_engine, ShippingRule, TaxRule)
+
+
+def get_engine():
+    """The compiled engine, rebuilt when shipping or tax rules change"""
+    return _rules.get()
+
+
+def quote_cart(items, state=None, pincode=None, promotions=None):
+    """Charges for cart items (with their products loaded) shipped to a destination.
+
+    ``promotions`` is the AppliedPromotions result for the same items.
+    """
+    return get_engine().quote(
+        ((item.product.category_id, item.product.get_final_price(), item.quantity) for item in items),
+        state, pincode, promotions.by_category if promotions else None,
+    )
+
+
+def default_destination(user):
+    """(state, pincode) of the user's default address, for estimates before checkout"""
+    if not user.is_authenticated:
+        return None, None
+    address = ShippingAddress.objects.filter(user=user, is_default=True).first()
+    if address is None:
+        return None, None
+    return address.state, address.pincode
@@ -1,3 +1,5 @@
+import uuid
+
 from django import forms
 from .models import ShippingAddress
 
@@ -46,9 +48,25 @@ class CheckoutForm(forms.Form):
         widget=forms.Textarea(attrs={'class': 'form-control', 'rows': 3, 'placeholder': 'Order notes (optional)'})
     )
     
+    # Fresh token per render so a double-submitted form places one order
+    idempotency_key = forms.CharField(
+        required=False,
+        max_length=64,
+        widget=forms.HiddenInput,
+        initial=lambda: uuid.uuid4().hex
+    )
+    
     # Save Address
     save_address = forms.BooleanField(
         required=False,
         widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}),
         label='Save this address for future orders'
-    )
\ No newline at end of file
+    )
+
+
+class TrackingImportForm(forms.Form):
+    """Admin upload of order_number,tracking_number,status rows"""
+    file = forms.FileField(
+        label='CSV file',
+        help_text='Columns: order_number, tracking_number, status (status may be blank)'
+    )
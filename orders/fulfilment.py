@@ -0,0 +1,129 @@
+import csv
+import io
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Order
+from .outbox import enqueue_many
+from .transitions import ORDER_TRANSITIONS, event_type_for
+
+# Warehouse transitions: target status -> statuses it may be reached from
+FULFILMENT_TRANSITIONS = {
+    status: ORDER_TRANSITIONS[status] for status in ('processing', 'shipped', 'delivered')
+}
+
+IMPORT_COLUMNS = ('order_number', 'tracking_number', 'status')
+
+
+def advance_orders(orders, status):
+    """Move every order in ``orders`` that may reach ``status`` there with one UPDATE.
+
+    Returns the number of orders changed; orders in any other status are left alone.
+    """
+    now = timezone.now()
+    changes = {'status': status, 'updated_at': now, 'version': F('version') + 1}
+    if status == 'delivered':
+        changes['delivered_at'] = now
+    with transaction.atomic():
+        order_ids = list(
+            Order.objects.select_for_update()
+            .filter(id__in=orders.values('id'), status__in=FULFILMENT_TRANSITIONS[status])
+            .order_by('id').values_list('id', flat=True)
+        )
+        Order.objects.filter(id__in=order_ids).update(**changes)
+        enqueue_many(event_type_for(status), order_ids, payload={'to': status})
+    return len(order_ids)
+
+
+class ImportResult:
+    """Outcome of a tracking number import"""
+
+    def __init__(self):
+        self.updated = 0
+        self.errors = []  # (line number, order number, message)
+
+    def error(self, line, order_number, message):
+        self.errors.append((line, order_number, message))
+
+
+def _apply_batch(rows, result):
+    """Validate and apply one batch of (line, row) pairs in a single transaction"""
+    numbers = [row['order_number'] for _, row in rows]
+    with transaction.atomic():
+        orders = Order.objects.select_for_update().only(
+            'id', 'order_number', 'status', 'tracking_number', 'delivered_at', 'updated_at',
+        ).in_bulk(numbers, field_name='order_number')
+
+        now = timezone.now()
+        changed = {}
+        moved = {}  # target status -> ids of orders moved there
+        for line, row in rows:
+            order = orders.get(row['order_number'])
+            status = row['status']
+            if order is None:
+                result.error(line, row['order_number'], 'Unknown order number')
+                continue
+            if status and status != order.status:
+                if status not in FULFILMENT_TRANSITIONS:
+                    result.error(line, order.order_number, f'Unsupported status {status!r}')
+                    continue
+                if order.status not in FULFILMENT_TRANSITIONS[status]:
+                    result.error(line, order.order_number, f'Cannot move from {order.status} to {status}')
+                    continue
+                order.status = status
+                moved.setdefault(status, []).append(order.id)
+                if status == 'delivered':
+                    order.delivered_at = now
+            if row['tracking_number']:
+                order.tracking_number = row['tracking_number']
+            order.updated_at = now
+            changed[order.id] = order
+
+        _save_fulfilment(changed.values())
+        for status, order_ids in moved.items():
+            enqueue_many(event_type_for(status), order_ids, payload={'to': status})
+        result.updated += len(changed)
+
+
+def _save_fulfilment(orders):
+    """Write the fulfilment fields of many orders, bumping their versions, in one UPDATE"""
+    orders = list(orders)
+    for order in orders:
+        order.version = F('version') + 1
+    Order.objects.bulk_update(orders, ['status', 'tracking_number', 'delivered_at', 'updated_at', 'version'])
+
+
+def import_tracking_csv(file, batch_size=1000):
+    """Apply an ``order_number,tracking_number,status`` CSV, streaming it in batches.
+
+    ``file`` is a binary file object; it is read row by row, so memory use does
+    not grow with the file. Each batch commits on its own, and bad rows are
+    reported without stopping the import.
+    """
+    result = ImportResult()
+    reader = csv.DictReader(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''))
+    missing = set(IMPORT_COLUMNS) - set(reader.fieldnames or [])
+    if missing:
+        result.error(1, '', f"Missing column(s): {', '.join(sorted(missing))}")
+        return result
+
+    # Line 1 is the header
+    rows = (
+        (line, {name: (row.get(name) or '').strip() for name in IMPORT_COLUMNS})
+        for line, row in enumerate(reader, start=2)
+    )
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return result
+        valid = []
+        for line, row in batch:
+            if not row['order_number']:
+                result.error(line, '', 'Missing order number')
+            else:
+                valid.append((line, row))
+        if valid:
+            _apply_batch(valid, result)
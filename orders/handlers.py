@@ -0,0 +1,83 @@
+import logging
+
+from django.conf import settings
+from django.core.mail import send_mail
+
+from .invoices import generate_invoices
+from .models import Order
+from .outbox import register
+from .rollups import record_order_cancelled, record_order_placed
+
+logger = logging.getLogger(__name__)
+
+
+@register('order.placed')
+def send_order_confirmation(event):
+    """Email the customer their order summary"""
+    order = event.order
+    lines = [
+        f"{item.quantity} x {item.product.name} - ₹{item.get_total_price()}"
+        for item in order.items.select_related('product')
+    ]
+    send_mail(
+        subject=f'Order {order.order_number} confirmed',
+        message='\n'.join([
+            f'Hi {order.full_name},',
+            '',
+            f'Thank you for your order {order.order_number}.',
+            '',
+            *lines,
+            '',
+            f'Total: ₹{order.total_amount}',
+        ]),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        recipient_list=[order.email],
+    )
+
+
+@register('order.status_changed')
+def send_status_update(event):
+    """Tell the customer their order has shipped or arrived"""
+    order = event.order
+    status = event.payload.get('to')
+    if order is None or status not in ('shipped', 'delivered'):
+        return
+    lines = [f'Hi {order.full_name},', '', f'Your order {order.order_number} has been {status}.']
+    if status == 'shipped' and order.tracking_number:
+        lines.append(f'Tracking number: {order.tracking_number}')
+    send_mail(
+        subject=f'Order {order.order_number} {status}',
+        message='\n'.join(lines),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        recipient_list=[order.email],
+    )
+
+
+@register('order.placed')
+@register('order.paid')
+@register('order.status_changed')
+def record_order_analytics(event):
+    """Emit an analytics record for the order event"""
+    order = event.order
+    logger.info(
+        'order_event type=%s order=%s total=%s payment_method=%s',
+        event.event_type, order.order_number, order.total_amount, order.payment_method,
+    )
+
+
+@register('order.placed')
+@register('order.paid')
+@register('invoice.requested')
+def render_invoice(event):
+    """(Re)render the order's invoice; unchanged invoices are skipped"""
+    generate_invoices(Order.objects.filter(id=event.order_id), processes=0)
+
+
+@register('order.placed')
+def add_to_sales_rollups(event):
+    record_order_placed(event.order_id)
+
+
+@register('order.cancelled')
+def add_cancellation_to_sales_rollups(event):
+    record_order_cancelled(event.order_id)
@@ -0,0 +1,96 @@
+# Invoice rendering runs in worker processes, so this module deliberately
+# depends only on Pillow and qrcode (no Django imports).
+import io
+from urllib.parse import urlencode
+
+import qrcode
+from PIL import Image, ImageDraw, ImageFont
+
+DPI = 150
+PAGE_SIZE = (1240, 1754)  # A4 at 150 dpi
+MARGIN = 90
+
+
+def payment_qr_payload(data):
+    """UPI deep link for the order amount, or a plain reference without a VPA"""
+    if data['upi_id']:
+        return 'upi://pay?' + urlencode({
+            'pa': data['upi_id'],
+            'pn': data['seller_name'],
+            'am': data['total_amount'],
+            'cu': 'INR',
+            'tn': data['order_number'],
+        })
+    return f"{data['seller_name']} {data['invoice_number']} INR {data['total_amount']}"
+
+
+def _font(size):
+    return ImageFont.load_default(size=size)
+
+
+def render_invoice_pdf(data):
+    """Render the invoice described by ``data`` (see invoices.invoice_data) to PDF bytes"""
+    page = Image.new('RGB', PAGE_SIZE, 'white')
+    draw = ImageDraw.Draw(page)
+    title, heading, body = _font(44), _font(26), _font(22)
+    width = PAGE_SIZE[0]
+    y = MARGIN
+
+    draw.text((MARGIN, y), data['seller_name'], font=title, fill='black')
+    draw.text((width - MARGIN, y), 'TAX INVOICE', font=heading, fill='black', anchor='ra')
+    y += 80
+    for label, value in [
+        ('Invoice', data['invoice_number']),
+        ('Order', data['order_number']),
+        ('Date', data['order_date']),
+        ('Payment', data['payment_method']),
+    ]:
+        draw.text((MARGIN, y), f'{label}: {value}', font=body, fill='black')
+        y += 32
+
+    y += 20
+    draw.text((MARGIN, y), 'Bill to', font=heading, fill='black')
+    y += 38
+    for line in data['address']:
+        draw.text((MARGIN, y), line, font=body, fill='black')
+        y += 30
+
+    # Line items
+    y += 30
+    columns = [MARGIN, 760, 880, width - MARGIN]
+    draw.line((MARGIN, y, width - MARGIN, y), fill='black', width=2)
+    y += 12
+    for x, text, anchor in [(columns[0], 'Item', 'la'), (columns[1], 'Qty', 'ra'),
+                            (columns[2] + 120, 'Price', 'ra'), (columns[3], 'Amount', 'ra')]:
+        draw.text((x, y), text, font=heading, fill='black', anchor=anchor)
+    y += 42
+    for item in data['items']:
+        draw.text((columns[0], y), item['name'][:48], font=body, fill='black')
+        draw.text((columns[1], y), str(item['quantity']), font=body, fill='black', anchor='ra')
+        draw.text((columns[2] + 120, y), item['price'], font=body, fill='black', anchor='ra')
+        draw.text((columns[3], y), item['total'], font=body, fill='black', anchor='ra')
+        y += 34
+    draw.line((MARGIN, y, width - MARGIN, y), fill='black', width=2)
+
+    # Totals
+    y += 20
+    totals = [('Subtotal', data['subtotal'])]
+    if data.get('discount'):
+        totals.append(('Discount', '-' + data['discount']))
+    totals += [('Shipping', data['shipping_cost']), ('Tax', data['tax']),
+               ('Total (INR)', data['total_amount'])]
+    for label, value in totals:
+        draw.text((columns[2], y), label, font=body, fill='black')
+        draw.text((columns[3], y), value, font=body, fill='black', anchor='ra')
+        y += 34
+
+    # Payment QR code
+    qr = qrcode.QRCode(box_size=6, border=2)
+    qr.add_data(payment_qr_payload(data))
+    qr_image = qr.make_image(fill_color='black', back_color='white').get_image().convert('RGB')
+    page.paste(qr_image, (MARGIN, y + 20))
+    draw.text((MARGIN + qr_image.width + 30, y + 40), 'Scan to pay / verify', font=body, fill='black')
+
+    buffer = io.BytesIO()
+    page.save(buffer, 'PDF', resolution=DPI)
+    return buffer.getvalue()
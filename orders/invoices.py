@@ -0,0 +1,140 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+from .invoice_render import render_invoice_pdf
+from .models import Invoice
+
+
+def invoice_number_for(order):
+    """INV-YYYYMMDD-XXXXXX, mirroring the order number"""
+    return 'INV-' + order.order_number.split('-', 1)[-1]
+
+
+def invoice_data(order):
+    """Everything printed on the invoice, as plain picklable values.
+
+    Expects ``order.items`` to be prefetched with their products.
+    """
+    address = [
+        order.full_name,
+        order.address_line1,
+        order.address_line2,
+        f'{order.city}, {order.state} - {order.pincode}',
+        order.country,
+        f'Phone: {order.phone}',
+    ]
+    data = {
+        'seller_name': getattr(settings, 'INVOICE_SELLER_NAME', 'ShopHub'),
+        'upi_id': getattr(settings, 'INVOICE_UPI_ID', ''),
+        'invoice_number': invoice_number_for(order),
+        'order_number': order.order_number,
+        'order_date': timezone.localtime(order.created_at).strftime('%d %b %Y'),
+        'payment_method': order.get_payment_method_display(),
+        'payment_status': order.get_payment_status_display(),
+        'address': [line for line in address if line],
+        'items': [
+            {
+                'name': item.product.name,
+                'quantity': item.quantity,
+                'price': str(item.price),
+                'total': str(item.get_total_price()),
+            }
+            for item in order.items.all()
+        ],
+        'subtotal': str(order.subtotal),
+        'shipping_cost': str(order.shipping_cost),
+        'tax': str(order.tax),
+        'total_amount': str(order.total_amount),
+    }
+    if order.discount:
+        # Only set when present, so invoices of earlier orders keep their hash
+        data['discount'] = str(order.discount)
+    return data
+
+
+def content_hash(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def _save_invoices(rendered, existing):
+    """Write rendered PDFs and upsert their Invoice rows in two statements"""
+    created, updated = [], []
+    for order, data, digest, pdf in rendered:
+        invoice = existing.get(order.id) or Invoice(order=order, invoice_number=data['invoice_number'])
+        if invoice.pk and invoice.file:
+            invoice.file.delete(save=False)
+        invoice.file.save(f"{data['invoice_number']}.pdf", ContentFile(pdf), save=False)
+        invoice.content_hash = digest
+        invoice.generated_at = timezone.now()
+        (updated if invoice.pk else created).append(invoice)
+    Invoice.objects.bulk_create(created)
+    Invoice.objects.bulk_update(updated, ['file', 'content_hash', 'generated_at'])
+
+
+def generate_invoices(orders, processes=None, force=False, chunk_size=200):
+    """Render invoices for ``orders`` (a queryset), skipping unchanged ones.
+
+    PDFs are rendered on a process pool of ``processes`` workers (default: one
+    per core); ``processes=0`` renders in the calling process, which is what a
+    single-order job wants. Returns counts and throughput.
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    # Spawned workers only import invoice_render, never Django or the DB connection
+    executor = ProcessPoolExecutor(
+        max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+    ) if processes else None
+    render = executor.map if executor else map
+
+    stats = {'generated': 0, 'skipped': 0}
+    started = time.perf_counter()
+    try:
+        orders = orders.prefetch_related('items__product').order_by('id')
+        chunk = []
+        for order in orders.iterator(chunk_size=chunk_size):
+            chunk.append(order)
+            if len(chunk) == chunk_size:
+                _generate_chunk(chunk, render, force, stats)
+                chunk = []
+        if chunk:
+            _generate_chunk(chunk, render, force, stats)
+    finally:
+        if executor:
+            executor.shutdown()
+
+    elapsed = time.perf_counter() - started
+    stats['seconds'] = elapsed
+    stats['per_second'] = stats['generated'] / elapsed if elapsed else 0.0
+    stats['per_core_second'] = stats['per_second'] / max(processes, 1)
+    return stats
+
+
+def _generate_chunk(orders, render, force, stats):
+    existing = {
+        invoice.order_id: invoice
+        for invoice in Invoice.objects.filter(order__in=orders)
+    }
+    pending = []
+    for order in orders:
+        data = invoice_data(order)
+        digest = content_hash(data)
+        invoice = existing.get(order.id)
+        if not force and invoice and invoice.content_hash == digest and invoice.file:
+            stats['skipped'] += 1
+            continue
+        pending.append((order, data, digest))
+
+    pdfs = render(render_invoice_pdf, [data for _, data, _ in pending])
+    _save_invoices(
+        [(order, data, digest, pdf) for (order, data, digest), pdf in zip(pending, pdfs)],
+        existing,
+    )
+    stats['generated'] += len(pending)
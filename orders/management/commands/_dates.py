@@ -0,0 +1,11 @@
+from datetime import datetime
+
+from django.core.management.base import CommandError
+
+
+def parse_date(value):
+    """Parse a YYYY-MM-DD command option"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f'Invalid date {value!r}, expected YYYY-MM-DD')
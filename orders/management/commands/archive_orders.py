@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from orders.archive import archive_orders, get_archive_age
+
+
+class Command(BaseCommand):
+    help = 'Move old delivered and cancelled orders into the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=None,
+                            help='Default: settings.ORDER_ARCHIVE_AFTER_DAYS')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Orders per transaction')
+
+    def handle(self, *args, **options):
+        days = options['older_than_days']
+        if days is None:
+            days = get_archive_age()
+        archived = archive_orders(older_than_days=days, chunk_size=options['chunk_size'])
+        self.stdout.write(f'Archived {archived} order(s) older than {days} days')
@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from orders.models import ArchivedOrder, Order
+from orders.rollups import backfill
+from ._dates import parse_date
+
+
+class Command(BaseCommand):
+    help = 'Rebuild daily sales rollups from live and archived orders, one day per transaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', help='First day (YYYY-MM-DD, default: first order)')
+        parser.add_argument('--to', dest='date_to', help='Last day, inclusive (YYYY-MM-DD, default: today)')
+
+    def handle(self, *args, **options):
+        if options['date_from']:
+            day = parse_date(options['date_from'])
+        else:
+            firsts = [
+                model.objects.order_by('created_at').values_list('created_at', flat=True).first()
+                for model in (Order, ArchivedOrder)
+            ]
+            firsts = [first for first in firsts if first is not None]
+            if not firsts:
+                self.stdout.write('No orders to roll up')
+                return
+            day = timezone.localdate(min(firsts))
+        last = parse_date(options['date_to']) if options['date_to'] else timezone.localdate()
+
+        rows = 0
+        while day <= last:
+            rows += backfill(day, day)
+            day += timedelta(days=1)
+        self.stdout.write(f'Rebuilt {rows} rollup row(s)')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from orders.fulfilment import import_tracking_csv
+
+
+class Command(BaseCommand):
+    help = 'Apply an order_number,tracking_number,status CSV to orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with open(options['path'], 'rb') as file:
+            result = import_tracking_csv(file, batch_size=options['batch_size'])
+        for line, order_number, message in result.errors:
+            self.stderr.write(f'line {line}: {order_number} {message}')
+        self.stdout.write(f'Updated {result.updated} order(s), {len(result.errors)} error(s)')
@@ -0,0 +1,32 @@
+import os
+import socket
+
+from django.core.management.base import BaseCommand
+
+from orders.outbox import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Process post-order outbox events (emails, invoices, analytics)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help='Handler thread pool size')
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--max-attempts', type=int, default=5)
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when idle')
+        parser.add_argument('--lease', type=int, default=300,
+                            help='Seconds before an unfinished claim is handed to another worker')
+        parser.add_argument('--once', action='store_true', help='Exit once nothing is due')
+
+    def handle(self, *args, **options):
+        worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self.stdout.write(f'Outbox worker {worker_id} started')
+        run_worker(
+            worker_id,
+            threads=options['threads'],
+            batch_size=options['batch_size'],
+            max_attempts=options['max_attempts'],
+            once=options['once'],
+            poll_interval=options['poll_interval'],
+            lease_seconds=options['lease'],
+        )
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_outbox_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Invoice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('invoice_number', models.CharField(max_length=30, unique=True)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('file', models.FileField(upload_to='invoices/%Y/%m/')),
+                ('generated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='invoice', to='orders.order')),
+            ],
+            options={
+                'verbose_name': 'Invoice',
+                'verbose_name_plural': 'Invoices',
+                'ordering': ['-generated_at'],
+            },
+        ),
+    ]
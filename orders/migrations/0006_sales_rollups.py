@@ -0,0 +1,50 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+        ('orders', '0005_order_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='rollup_state',
+            field=models.CharField(blank=True, default='', editable=False, max_length=10),
+        ),
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('payment_method', models.CharField(choices=[('cod', 'Cash on Delivery'), ('razorpay', 'Razorpay'), ('stripe', 'Stripe')], max_length=20)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('gross', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('discounts', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cancellations', models.PositiveIntegerField(default=0)),
+                ('cancelled_units', models.PositiveIntegerField(default=0)),
+                ('cancelled_gross', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('brand', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='products.brand')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.category')),
+            ],
+            options={
+                'verbose_name': 'Daily Sales Rollup',
+                'verbose_name_plural': 'Daily Sales Rollups',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailysalesrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('brand__isnull', False)), fields=('date', 'category', 'brand', 'payment_method'), name='orders_rollup_unique_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailysalesrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('brand__isnull', True)), fields=('date', 'category', 'payment_method'), name='orders_rollup_unique_key_no_brand'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import orders.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('orders', '0006_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('order_number', models.CharField(max_length=20, unique=True)),
+                ('subtotal', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('shipping_cost', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('tax', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('shipped', 'Shipped'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('payment_method', models.CharField(choices=[('cod', 'Cash on Delivery'), ('razorpay', 'Razorpay'), ('stripe', 'Stripe')], max_length=20)),
+                ('payment_status', models.CharField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed')], max_length=20)),
+                ('payment_id', models.CharField(blank=True, max_length=200, null=True)),
+                ('full_name', models.CharField(max_length=200)),
+                ('phone', models.CharField(max_length=15)),
+                ('email', models.EmailField(max_length=254)),
+                ('address_line1', models.CharField(max_length=255)),
+                ('address_line2', models.CharField(blank=True, max_length=255)),
+                ('city', models.CharField(max_length=100)),
+                ('state', models.CharField(max_length=100)),
+                ('pincode', models.CharField(max_length=10)),
+                ('country', models.CharField(default='India', max_length=100)),
+                ('order_notes', models.TextField(blank=True)),
+                ('tracking_number', models.CharField(blank=True, max_length=100, null=True)),
+                ('invoice_file', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('delivered_at', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_orders', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Archived Order',
+                'verbose_name_plural': 'Archived Orders',
+                'ordering': ['-created_at'],
+            },
+            bases=(orders.models.OrderDisplayMixin, models.Model),
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderItem',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='orders.archivedorder')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.product')),
+            ],
+            options={
+                'verbose_name': 'Archived Order Item',
+                'verbose_name_plural': 'Archived Order Items',
+            },
+        ),
+    ]
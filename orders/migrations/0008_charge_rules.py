@@ -0,0 +1,63 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def add_standard_shipping(apps, schema_editor):
+    # The flat rate checkout used before rules existed
+    ShippingRule = apps.get_model('orders', 'ShippingRule')
+    ShippingRule.objects.create(name='Standard shipping', charge=50, free_above=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+        ('orders', '0007_archivedorder_archivedorderitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaxRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('state', models.CharField(blank=True, help_text='Leave blank for all states', max_length=100)),
+                ('priority', models.IntegerField(default=0)),
+                ('is_active', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('rate', models.DecimalField(decimal_places=2, help_text='Percent, e.g. 18.00', max_digits=5)),
+                ('category', models.ForeignKey(blank=True, help_text='Leave blank for all categories', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.category')),
+            ],
+            options={
+                'verbose_name': 'Tax Rule',
+                'verbose_name_plural': 'Tax Rules',
+                'ordering': ['-priority', 'name'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ShippingRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('state', models.CharField(blank=True, help_text='Leave blank for all states', max_length=100)),
+                ('priority', models.IntegerField(default=0)),
+                ('is_active', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('pincode_from', models.PositiveIntegerField(blank=True, null=True)),
+                ('pincode_to', models.PositiveIntegerField(blank=True, null=True)),
+                ('charge', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('free_above', models.DecimalField(blank=True, decimal_places=2, help_text='Subtotal at which shipping becomes free', max_digits=10, null=True)),
+                ('category', models.ForeignKey(blank=True, help_text='Leave blank for all categories', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.category')),
+            ],
+            options={
+                'verbose_name': 'Shipping Rule',
+                'verbose_name_plural': 'Shipping Rules',
+                'ordering': ['-priority', 'name'],
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(add_standard_shipping, migrations.RunPython.noop),
+    ]
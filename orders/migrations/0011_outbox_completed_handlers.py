@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0010_order_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxevent',
+            name='completed_handlers',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
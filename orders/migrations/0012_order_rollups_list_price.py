@@ -0,0 +1,75 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
+
+
+def count_rolled_up_orders(apps, schema_editor):
+    # Orders already in the sales rollups, plus archived ones (all rolled up before archiving)
+    Order = apps.get_model('orders', 'Order')
+    ArchivedOrder = apps.get_model('orders', 'ArchivedOrder')
+    DailyOrderRollup = apps.get_model('orders', 'DailyOrderRollup')
+    rollups = {}
+    for orders, cancelled in (
+        (Order.objects.exclude(rollup_state=''), Q(rollup_state='cancelled')),
+        (ArchivedOrder.objects.all(), Q(status='cancelled')),
+    ):
+        for row in (
+            orders.order_by().annotate(date=TruncDate('created_at')).values('date', 'payment_method')
+            .annotate(orders=Count('id'), cancellations=Count('id', filter=cancelled))
+        ):
+            rollup = rollups.setdefault(
+                (row['date'], row['payment_method']),
+                DailyOrderRollup(date=row['date'], payment_method=row['payment_method']),
+            )
+            rollup.orders += row['orders']
+            rollup.cancellations += row['cancellations']
+    DailyOrderRollup.objects.bulk_create(rollups.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+        ('orders', '0011_outbox_completed_handlers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyOrderRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('payment_method', models.CharField(choices=[('cod', 'Cash on Delivery'), ('razorpay', 'Razorpay'), ('stripe', 'Stripe')], max_length=20)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('cancellations', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Daily Order Rollup',
+                'verbose_name_plural': 'Daily Order Rollups',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='list_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='list_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='dailysalesrollup',
+            name='brand',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='products.brand'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyorderrollup',
+            constraint=models.UniqueConstraint(fields=('date', 'payment_method'), name='orders_order_rollup_unique_key'),
+        ),
+        migrations.RunPython(count_rolled_up_orders, migrations.RunPython.noop),
+    ]
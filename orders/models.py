@@ -1,11 +1,28 @@
 
 # Create your models here.
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
 from accounts.models import User
-from products.models import Product
+from products.models import Brand, Category, Product
 import uuid
 
-class Order(models.Model):
+class OrderDisplayMixin:
+    """Presentation helpers shared by live and archived orders"""
+    
+    def get_status_badge_class(self):
+        """Return Bootstrap badge class based on status"""
+        status_classes = {
+            'pending': 'bg-warning',
+            'processing': 'bg-info',
+            'shipped': 'bg-primary',
+            'delivered': 'bg-success',
+            'cancelled': 'bg-danger',
+        }
+        return status_classes.get(self.status, 'bg-secondary')
+
+
+class Order(OrderDisplayMixin, models.Model):
     """Order Model"""
     
     STATUS_CHOICES = [
@@ -36,7 +53,9 @@ class Order(models.Model):
     subtotal = models.DecimalField(max_digits=10, decimal_places=2)
     shipping_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     tax = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    coupon_code = models.CharField(max_length=50, blank=True)
     
     # Status
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
@@ -60,9 +79,18 @@ class Order(models.Model):
     # Additional Info
     order_notes = models.TextField(blank=True)
     
+    # Checkout form token; a resubmitted form maps back to this order
+    idempotency_key = models.CharField(max_length=64, unique=True, blank=True, null=True, editable=False)
+    
+    # What the sales rollups already count for this order ('', 'placed', 'cancelled')
+    rollup_state = models.CharField(max_length=10, blank=True, default='', editable=False)
+    
     # Tracking
     tracking_number = models.CharField(max_length=100, blank=True, null=True)
     
+    # Bumped by every state transition (see orders.transitions)
+    version = models.PositiveIntegerField(default=0, editable=False)
+    
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -72,6 +100,10 @@ class Order(models.Model):
         verbose_name = 'Order'
         verbose_name_plural = 'Orders'
         ordering = ['-created_at']
+        indexes = [
+            # Order history pages walk (created_at, id) per user
+            models.Index(fields=['user', '-created_at', '-id'], name='orders_user_history_idx'),
+        ]
     
     def save(self, *args, **kwargs):
         if not self.order_number:
@@ -84,17 +116,6 @@ class Order(models.Model):
     
     def __str__(self):
         return f"Order {self.order_number} - {self.user.username}"
-    
-    def get_status_badge_class(self):
-        """Return Bootstrap badge class based on status"""
-        status_classes = {
-            'pending': 'bg-warning',
-            'processing': 'bg-info',
-            'shipped': 'bg-primary',
-            'delivered': 'bg-success',
-            'cancelled': 'bg-danger',
-        }
-        return status_classes.get(self.status, 'bg-secondary')
 
 
 class OrderItem(models.Model):
@@ -103,6 +124,8 @@ class OrderItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     price = models.DecimalField(max_digits=10, decimal_places=2)  # Price at time of order
+    # Product list price at time of order, for discount reporting; unknown for older orders
+    list_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -146,4 +169,248 @@ class ShippingAddress(models.Model):
         super().save(*args, **kwargs)
     
     def __str__(self):
-        return f"{self.full_name} - {self.city}, {self.state}"
\ No newline at end of file
+        return f"{self.full_name} - {self.city}, {self.state}"
+
+class OutboxEvent(models.Model):
+    """Post-order side effect, written in the same transaction as the order"""
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    event_type = models.CharField(max_length=50)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='outbox_events', null=True, blank=True)
+    payload = models.JSONField(default=dict, blank=True)
+    
+    # Delivery state
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)  # Not claimed before this (retry backoff)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    # Handlers that already succeeded, skipped when a failed event is retried
+    completed_handlers = models.JSONField(default=list, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        verbose_name = 'Outbox Event'
+        verbose_name_plural = 'Outbox Events'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='orders_outbox_claim_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.event_type} #{self.id} ({self.status})"
+
+
+class Invoice(models.Model):
+    """Rendered invoice PDF for an order"""
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='invoice')
+    invoice_number = models.CharField(max_length=30, unique=True)
+    content_hash = models.CharField(max_length=64)  # sha256 of the data the PDF was rendered from
+    file = models.FileField(upload_to='invoices/%Y/%m/')
+    generated_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name = 'Invoice'
+        verbose_name_plural = 'Invoices'
+        ordering = ['-generated_at']
+    
+    def __str__(self):
+        return f"Invoice {self.invoice_number}"
+
+
+class DailySalesRollup(models.Model):
+    """Sales totals per day x category x brand x payment method.
+
+    Maintained incrementally from order events (see orders.rollups) so the
+    sales dashboard never scans orders or order items. An order with lines in
+    several categories counts once in each of them, so ``orders`` must not be
+    summed across rows; DailyOrderRollup holds the order counts.
+    """
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    # Brands that have sold cannot be deleted: their rows would collide with the no-brand ones
+    brand = models.ForeignKey(Brand, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+    payment_method = models.CharField(max_length=20, choices=Order.PAYMENT_METHOD_CHOICES)
+    
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    gross = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    discounts = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cancellations = models.PositiveIntegerField(default=0)
+    cancelled_units = models.PositiveIntegerField(default=0)
+    cancelled_gross = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        verbose_name = 'Daily Sales Rollup'
+        verbose_name_plural = 'Daily Sales Rollups'
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'category', 'brand', 'payment_method'],
+                condition=models.Q(brand__isnull=False),
+                name='orders_rollup_unique_key',
+            ),
+            models.UniqueConstraint(
+                fields=['date', 'category', 'payment_method'],
+                condition=models.Q(brand__isnull=True),
+                name='orders_rollup_unique_key_no_brand',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.date} {self.category_id}/{self.brand_id}/{self.payment_method}"
+
+
+class DailyOrderRollup(models.Model):
+    """Orders placed and cancelled per day x payment method, each order counted once"""
+    date = models.DateField()
+    payment_method = models.CharField(max_length=20, choices=Order.PAYMENT_METHOD_CHOICES)
+    orders = models.PositiveIntegerField(default=0)
+    cancellations = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = 'Daily Order Rollup'
+        verbose_name_plural = 'Daily Order Rollups'
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'payment_method'], name='orders_order_rollup_unique_key'),
+        ]
+    
+    def __str__(self):
+        return f"{self.date} {self.payment_method}"
+
+
+class ArchivedOrder(OrderDisplayMixin, models.Model):
+    """Delivered or cancelled order moved out of the live tables (same id as the original)"""
+    id = models.BigIntegerField(primary_key=True)
+    order_number = models.CharField(max_length=20, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_orders')
+    
+    # Pricing
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2)
+    shipping_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    tax = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    coupon_code = models.CharField(max_length=50, blank=True)
+    
+    # Status & Payment
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    payment_method = models.CharField(max_length=20, choices=Order.PAYMENT_METHOD_CHOICES)
+    payment_status = models.CharField(max_length=20, choices=Order.PAYMENT_STATUS_CHOICES)
+    payment_id = models.CharField(max_length=200, blank=True, null=True)
+    
+    # Shipping Address
+    full_name = models.CharField(max_length=200)
+    phone = models.CharField(max_length=15)
+    email = models.EmailField()
+    address_line1 = models.CharField(max_length=255)
+    address_line2 = models.CharField(max_length=255, blank=True)
+    city = models.CharField(max_length=100)
+    state = models.CharField(max_length=100)
+    pincode = models.CharField(max_length=10)
+    country = models.CharField(max_length=100, default='India')
+    
+    order_notes = models.TextField(blank=True)
+    tracking_number = models.CharField(max_length=100, blank=True, null=True)
+    invoice_file = models.CharField(max_length=255, blank=True)  # Storage name of the rendered invoice
+    
+    # Timestamps (copied from the live order)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    delivered_at = models.DateTimeField(blank=True, null=True)
+    archived_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name = 'Archived Order'
+        verbose_name_plural = 'Archived Orders'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Archived order {self.order_number}"
+
+
+class ArchivedOrderItem(models.Model):
+    """Line of an archived order"""
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    quantity = models.PositiveIntegerField(default=1)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    list_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    created_at = models.DateTimeField()
+    
+    class Meta:
+        verbose_name = 'Archived Order Item'
+        verbose_name_plural = 'Archived Order Items'
+    
+    def __str__(self):
+        return f"{self.quantity} x {self.product.name}"
+    
+    def get_total_price(self):
+        """Calculate total price for this item"""
+        return self.price * self.quantity
+
+
+class ChargeRule(models.Model):
+    """Fields shared by shipping and tax rules.
+
+    A rule applies to a destination (any, a state or, for shipping, a pincode
+    range) and optionally to one product category. The most specific matching
+    rule wins; ``priority`` breaks ties between equally specific rules.
+    """
+    name = models.CharField(max_length=100)
+    state = models.CharField(max_length=100, blank=True, help_text='Leave blank for all states')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True,
+                                 related_name='+', help_text='Leave blank for all categories')
+    priority = models.IntegerField(default=0)
+    is_active = models.BooleanField(default=True)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        abstract = True
+        ordering = ['-priority', 'name']
+    
+    def __str__(self):
+        return self.name
+
+
+class ShippingRule(ChargeRule):
+    """Flat shipping charge, waived when the lines it covers reach ``free_above``"""
+    pincode_from = models.PositiveIntegerField(null=True, blank=True)
+    pincode_to = models.PositiveIntegerField(null=True, blank=True)
+    charge = models.DecimalField(max_digits=10, decimal_places=2)
+    free_above = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                     help_text='Subtotal at which shipping becomes free')
+    
+    class Meta(ChargeRule.Meta):
+        verbose_name = 'Shipping Rule'
+        verbose_name_plural = 'Shipping Rules'
+    
+    def clean(self):
+        if (self.pincode_from is None) != (self.pincode_to is None):
+            raise ValidationError('Set both ends of the pincode range, or neither.')
+        if self.pincode_from is not None:
+            if self.pincode_from > self.pincode_to:
+                raise ValidationError('The pincode range is reversed.')
+            if self.state:
+                raise ValidationError('A rule matches either a state or a pincode range, not both.')
+
+
+class TaxRule(ChargeRule):
+    """GST rate applied to the lines it covers"""
+    rate = models.DecimalField(max_digits=5, decimal_places=2, help_text='Percent, e.g. 18.00')
+    
+    class Meta(ChargeRule.Meta):
+        verbose_name = 'Tax Rule'
+        verbose_name_plural = 'Tax Rules'
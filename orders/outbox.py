@@ -0,0 +1,160 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ecommerce.backoff import retry_delay
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+# event_type -> list of handler callables taking an OutboxEvent
+_handlers = {}
+
+
+def register(event_type):
+    """Decorator registering a handler for an outbox event type"""
+    def decorator(func):
+        _handlers.setdefault(event_type, []).append(func)
+        return func
+    return decorator
+
+
+def get_handlers(event_type):
+    return list(_handlers.get(event_type, []))
+
+
+def handler_name(handler):
+    """Stable name recorded for a handler once it has run for an event"""
+    return f'{handler.__module__}.{handler.__qualname__}'
+
+
+def enqueue(event_type, order=None, payload=None):
+    """Record a side effect to run after the surrounding transaction commits.
+
+    Call this inside the transaction that writes the order: the event is only
+    visible to workers if the order is, and checkout pays for one INSERT.
+    """
+    return OutboxEvent.objects.create(event_type=event_type, order=order, payload=payload or {})
+
+
+def enqueue_many(event_type, order_ids, payload=None):
+    """Record the same event for many orders with one INSERT"""
+    return OutboxEvent.objects.bulk_create([
+        OutboxEvent(event_type=event_type, order_id=order_id, payload=payload or {})
+        for order_id in order_ids
+    ])
+
+
+def claim_batch(worker_id, batch_size=50):
+    """Lease up to ``batch_size`` due events to ``worker_id``.
+
+    Rows are picked with SELECT ... FOR UPDATE SKIP LOCKED where the database
+    supports it; the conditional ``status='pending'`` UPDATE is what makes the
+    claim exclusive, so it is also safe on SQLite.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        due = OutboxEvent.objects.filter(status='pending', available_at__lte=now).order_by('id')
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return []
+        OutboxEvent.objects.filter(id__in=ids, status='pending').update(
+            status='processing', locked_by=worker_id, locked_at=now,
+        )
+    return list(
+        OutboxEvent.objects.filter(id__in=ids, status='processing', locked_by=worker_id)
+        .select_related('order')
+    )
+
+
+def requeue_stale(lease_seconds=300):
+    """Return events whose worker died mid-batch to the queue"""
+    cutoff = timezone.now() - timedelta(seconds=lease_seconds)
+    return OutboxEvent.objects.filter(status='processing', locked_at__lt=cutoff).update(
+        status='pending', locked_by='', locked_at=None,
+    )
+
+
+class LeaseLost(Exception):
+    """The event was handed to another worker while this one was running it"""
+
+
+def process_event(event, worker_id, max_attempts=5):
+    """Run the handlers of ``event`` and record the outcome. Returns True on success.
+
+    Each handler that succeeds is recorded on the event in the same
+    transaction as its own writes, so a retry after a later handler fails
+    does not send the email or count the sale again. Every write is
+    conditional on ``worker_id`` still holding the lease: once
+    requeue_stale has given the event to another worker, a late handler's
+    writes are rolled back and the event is left to that worker.
+    """
+    leased = OutboxEvent.objects.filter(id=event.id, locked_by=worker_id)
+    try:
+        handlers = get_handlers(event.event_type)
+        if not handlers:
+            raise LookupError(f'No handler registered for {event.event_type!r}')
+        completed = list(event.completed_handlers)
+        for handler in handlers:
+            name = handler_name(handler)
+            if name in completed:
+                continue
+            with transaction.atomic():
+                handler(event)
+                if not leased.update(completed_handlers=completed + [name]):
+                    raise LeaseLost(f'Outbox event {event.id} is no longer leased to {worker_id}')
+            completed.append(name)
+    except LeaseLost as e:
+        logger.warning('%s', e)
+        return False
+    except Exception as e:
+        attempts = event.attempts + 1
+        logger.warning('Outbox event %s failed (attempt %s): %s', event.id, attempts, e)
+        fields = {'attempts': attempts, 'last_error': repr(e), 'locked_by': '', 'locked_at': None}
+        if attempts >= max_attempts:
+            fields['status'] = 'failed'
+        else:
+            fields['status'] = 'pending'
+            fields['available_at'] = timezone.now() + timedelta(seconds=retry_delay(attempts))
+        leased.update(**fields)
+        return False
+
+    return bool(leased.update(
+        status='done', attempts=event.attempts + 1, processed_at=timezone.now(),
+        locked_by='', locked_at=None, last_error='',
+    ))
+
+
+def _run_in_thread(event, worker_id, max_attempts):
+    try:
+        return process_event(event, worker_id, max_attempts=max_attempts)
+    finally:
+        connection.close()
+
+
+def process_batch(executor, worker_id, batch_size=50, max_attempts=5):
+    """Claim one batch and run it on ``executor``. Returns (succeeded, failed)."""
+    events = claim_batch(worker_id, batch_size=batch_size)
+    results = list(executor.map(lambda event: _run_in_thread(event, worker_id, max_attempts), events))
+    return results.count(True), results.count(False)
+
+
+def run_worker(worker_id, threads=4, batch_size=50, max_attempts=5, once=False, poll_interval=1.0,
+               lease_seconds=300):
+    """Poll the outbox forever, or until it has nothing due when ``once`` is set"""
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='outbox') as executor:
+        while True:
+            requeue_stale(lease_seconds)
+            succeeded, failed = process_batch(executor, worker_id, batch_size, max_attempts)
+            if succeeded or failed:
+                logger.info('Outbox batch: %s done, %s failed', succeeded, failed)
+                continue
+            if once:
+                return
+            time.sleep(poll_interval)
@@ -0,0 +1,156 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, NullIf, TruncDate
+
+from .models import ArchivedOrder, ArchivedOrderItem, DailyOrderRollup, DailySalesRollup, Order, OrderItem
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+KEY_FIELDS = ('date', 'category_id', 'brand_id', 'payment_method')
+
+
+def aggregate_lines(items):
+    """Group order lines by rollup key, computing the counters in SQL.
+
+    Discounts are the list price recorded on the line at order time minus
+    the price paid (lines from before list prices were recorded count none),
+    plus the line's share of the order's promotion discount, split over the
+    lines by value. Gross is what the lines sold for after that share.
+    """
+    line_total = ExpressionWrapper(F('price') * F('quantity'), output_field=MONEY)
+    order_discount_share = Coalesce(
+        ExpressionWrapper(
+            F('order__discount') * F('price') * F('quantity') / NullIf(F('order__subtotal'), 0),
+            output_field=MONEY,
+        ),
+        Value(0),
+        output_field=MONEY,
+    )
+    return (
+        items.order_by()
+        .annotate(
+            date=TruncDate('order__created_at'),
+            category_id=F('product__category_id'),
+            brand_id=F('product__brand_id'),
+            payment_method=F('order__payment_method'),
+        )
+        .values(*KEY_FIELDS)
+        .annotate(
+            order_count=Count('order', distinct=True),
+            unit_count=Sum('quantity'),
+            line_gross=Sum(line_total - order_discount_share, output_field=MONEY),
+            line_discounts=Sum(
+                Greatest(Coalesce(F('list_price'), F('price')) - F('price'), Value(0), output_field=MONEY)
+                * F('quantity') + order_discount_share,
+                output_field=MONEY,
+            ),
+        )
+    )
+
+
+def _placed_deltas(row):
+    return {
+        'orders': row['order_count'],
+        'units': row['unit_count'],
+        'gross': row['line_gross'],
+        'discounts': row['line_discounts'],
+    }
+
+
+def _cancelled_deltas(row):
+    return {
+        'cancellations': row['order_count'],
+        'cancelled_units': row['unit_count'],
+        'cancelled_gross': row['line_gross'],
+    }
+
+
+def _add(model, key, deltas):
+    """Increment one rollup row, creating it on first use"""
+    increments = {field: F(field) + value for field, value in deltas.items()}
+    if model.objects.filter(**key).update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, **deltas)
+    except IntegrityError:
+        # Another worker created the row first
+        model.objects.filter(**key).update(**increments)
+
+
+def _add_lines(order_id, deltas):
+    for row in aggregate_lines(OrderItem.objects.filter(order_id=order_id)):
+        _add(DailySalesRollup, {name: row[name] for name in KEY_FIELDS}, deltas(row))
+
+
+def _add_order(order_id, deltas):
+    order = Order.objects.annotate(date=TruncDate('created_at')).values('date', 'payment_method').get(id=order_id)
+    _add(DailyOrderRollup, order, deltas)
+
+
+def _claim(order_id, from_states, to_state):
+    return Order.objects.filter(id=order_id, rollup_state__in=from_states).update(rollup_state=to_state)
+
+
+def record_order_placed(order_id):
+    """Add an order to the rollups; a no-op if it is already counted"""
+    with transaction.atomic():
+        if not _claim(order_id, [''], 'placed'):
+            return
+        _add_lines(order_id, _placed_deltas)
+        _add_order(order_id, {'orders': 1})
+
+
+def record_order_cancelled(order_id):
+    """Count an order's cancellation; a no-op if it is already counted"""
+    with transaction.atomic():
+        # Events may be processed out of order: count the sale first if needed
+        record_order_placed(order_id)
+        if not _claim(order_id, ['placed'], 'cancelled'):
+            return
+        _add_lines(order_id, _cancelled_deltas)
+        _add_order(order_id, {'cancellations': 1})
+
+
+def _merge(rollups, model, key, deltas):
+    """Add ``deltas`` to the unsaved ``model`` row for ``key`` held in ``rollups``"""
+    rollup = rollups.get(tuple(key.items()))
+    if rollup is None:
+        rollup = rollups[tuple(key.items())] = model(**key)
+    for field, value in deltas.items():
+        setattr(rollup, field, getattr(rollup, field) + value)
+
+
+def backfill(date_from, date_to):
+    """Rebuild the rollups of a date range from orders with grouped queries.
+
+    Live and archived orders are both read, so days already moved to the
+    archive keep their sales. Run it while the outbox worker is stopped
+    (or for days it no longer touches): live orders in the range are marked
+    as counted afterwards.
+    """
+    with transaction.atomic():
+        rollups, order_rollups = {}, {}
+        for order_model, item_model in [(Order, OrderItem), (ArchivedOrder, ArchivedOrderItem)]:
+            in_range = item_model.objects.filter(order__created_at__date__range=(date_from, date_to))
+            for row in aggregate_lines(in_range):
+                _merge(rollups, DailySalesRollup, {name: row[name] for name in KEY_FIELDS}, _placed_deltas(row))
+            for row in aggregate_lines(in_range.filter(order__status='cancelled')):
+                _merge(rollups, DailySalesRollup, {name: row[name] for name in KEY_FIELDS}, _cancelled_deltas(row))
+
+            for row in (
+                order_model.objects.filter(created_at__date__range=(date_from, date_to)).order_by()
+                .annotate(date=TruncDate('created_at')).values('date', 'payment_method')
+                .annotate(orders=Count('id'), cancellations=Count('id', filter=Q(status='cancelled')))
+            ):
+                key = {'date': row.pop('date'), 'payment_method': row.pop('payment_method')}
+                _merge(order_rollups, DailyOrderRollup, key, row)
+
+        DailySalesRollup.objects.filter(date__range=(date_from, date_to)).delete()
+        DailySalesRollup.objects.bulk_create(rollups.values(), batch_size=1000)
+        DailyOrderRollup.objects.filter(date__range=(date_from, date_to)).delete()
+        DailyOrderRollup.objects.bulk_create(order_rollups.values(), batch_size=1000)
+
+        orders = Order.objects.filter(created_at__date__range=(date_from, date_to))
+        orders.filter(status='cancelled').update(rollup_state='cancelled')
+        orders.exclude(status='cancelled').update(rollup_state='placed')
+    return len(rollups)
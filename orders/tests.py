@@ -1,3 +1,852 @@
-from django.test import TestCase
+import shutil
+import tempfile
+import threading
+from io import StringIO
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.messages import get_messages
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from cart.models import Cart, CartItem
+from ecommerce.backoff import retry_delay
+from products.models import Brand, Category, Product
+from payments.models import ArchivedPayment, ArchivedRefund, Payment, Refund
+from products.stock import InsufficientStock, decrement_stock
+from . import outbox
+from .archive import archive_chunk, archive_orders
+from .cancellation import cancel_orders
+from .charges import ChargeEngine
+from .fulfilment import advance_orders
+from .admin import OrderItemAdmin
+from .invoices import generate_invoices
+from .rollups import backfill, record_order_cancelled, record_order_placed
+from .transitions import InvalidTransition, transition
+from .views import ORDERS_PER_PAGE
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, DailyOrderRollup, DailySalesRollup, Invoice, Order, OrderItem, OutboxEvent,
+    ShippingRule, TaxRule,
+)
+
+ADDRESS = {
+    'full_name': 'Alice', 'phone': '9999999999', 'address_line1': '1 Main Road',
+    'city': 'Pune', 'state': 'Maharashtra', 'pincode': '411001',
+}
+
+
+def make_user(username, **kwargs):
+    return User.objects.create_user(username, email=f'{username}@example.com', password='secret', **kwargs)
+
+
+def make_product(name='Phone', price=100, stock_quantity=10, category=None, **kwargs):
+    category = category or Category.objects.get_or_create(name='Phones')[0]
+    return Product.objects.create(
+        name=name, description=f'A {name.lower()}', category=category, price=price,
+        stock_quantity=stock_quantity, **kwargs,
+    )
+
+
+def make_cart(user, lines):
+    cart = Cart.objects.create(user=user)
+    for product, quantity in lines:
+        CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+    return cart
+
+
+def checkout_data(**kwargs):
+    return {**ADDRESS, 'email': 'alice@example.com', 'country': 'India', 'payment_method': 'cod', **kwargs}
+
+
+def last_message(response):
+    return [str(message) for message in get_messages(response.wsgi_request)][-1]
+
+
+def make_order(user, lines=(), **kwargs):
+    """An order of ``(product, quantity)`` lines at the products' current prices"""
+    subtotal = sum((product.get_final_price() * quantity for product, quantity in lines), Decimal('0'))
+    fields = {
+        **ADDRESS, 'email': user.email, 'subtotal': subtotal, 'total_amount': subtotal,
+        'payment_method': 'cod', **kwargs,
+    }
+    order = Order.objects.create(user=user, **fields)
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=product, quantity=quantity, price=product.get_final_price(),
+                  list_price=product.price)
+        for product, quantity in lines
+    ])
+    return order
+
+
+class OrderAdminTests(TestCase):
+
+    def setUp(self):
+        self.products = [make_product('Phone', price=100, discount_price=80), make_product('Case', price=10)]
+        self.client.force_login(make_user('admin', is_staff=True, is_superuser=True))
+
+    def add_order(self, username):
+        return make_order(make_user(username), [(self.products[0], 1), (self.products[1], 3)])
+
+    def queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_changelists_take_the_same_queries_for_more_orders(self):
+        self.add_order('alice')
+        urls = [reverse('admin:orders_order_changelist'), reverse('admin:orders_orderitem_changelist')]
+        counts = [self.queries(url) for url in urls]
+        for i in range(4):
+            self.add_order(f'user{i}')
+        for url, count in zip(urls, counts):
+            with self.assertNumQueries(count):
+                self.client.get(url)
+
+    def test_annotated_line_totals_match_the_items(self):
+        self.add_order('alice')
+        items = OrderItemAdmin(OrderItem, admin.site).get_queryset(RequestFactory().get('/'))
+        self.assertEqual(
+            {item.product.name: item.line_total for item in items},
+            {'Phone': Decimal('80.00'), 'Case': Decimal('30.00')},
+        )
+        for item in items:
+            self.assertEqual(item.line_total, item.get_total_price())
+            self.assertEqual(item.price, item.product.get_final_price())
+
+
+class StockDecrementTests(TestCase):
+
+    def test_short_product_changes_nothing(self):
+        phone, case = make_product('Phone', stock_quantity=5), make_product('Case', stock_quantity=1)
+        with self.assertRaises(InsufficientStock) as raised:
+            decrement_stock({phone.id: 2, case.id: 2})
+        self.assertEqual(raised.exception.available, {case.id: 1})
+        self.assertIn('Case (1 left)', str(raised.exception))
+        phone.refresh_from_db()
+        case.refresh_from_db()
+        self.assertEqual((phone.stock_quantity, case.stock_quantity), (5, 1))
+
+    def test_exact_stock_is_sold(self):
+        phone = make_product('Phone', stock_quantity=2)
+        decrement_stock({phone.id: 2})
+        phone.refresh_from_db()
+        self.assertEqual(phone.stock_quantity, 0)
+
+
+class CheckoutStockTests(TestCase):
+
+    def setUp(self):
+        self.phone = make_product('Phone', stock_quantity=1)
+        self.case = make_product('Case', stock_quantity=5)
+
+    def checkout(self, user):
+        self.client.force_login(user)
+        return self.client.post(reverse('orders:checkout'), checkout_data())
+
+    # Both carts got past their holds, e.g. the first hold lapsed while its
+    # customer was paying, so only the conditional decrement is left to decide
+    @mock.patch('orders.views.reserve_cart')
+    def test_last_unit_is_sold_once_and_the_loser_rolls_back(self, reserve_cart):
+        alice, bob = make_user('alice'), make_user('bob')
+        make_cart(alice, [(self.phone, 1)])
+        make_cart(bob, [(self.case, 2), (self.phone, 1)])
+
+        won = self.checkout(alice)
+        self.assertRedirects(won, reverse('orders:order_confirmation', args=[Order.objects.get().order_number]),
+                             fetch_redirect_response=False)
+
+        lost = self.checkout(bob)
+        self.assertRedirects(lost, reverse('cart:cart_detail'), fetch_redirect_response=False)
+        self.assertEqual(last_message(lost), 'Not enough stock for: Phone (0 left)')
+        self.assertFalse(Order.objects.filter(user=bob).exists())
+        self.assertEqual(OrderItem.objects.count(), 1)
+        self.phone.refresh_from_db()
+        self.case.refresh_from_db()
+        self.assertEqual((self.phone.stock_quantity, self.case.stock_quantity), (0, 5))
+        # Bob keeps his cart to change it
+        self.assertEqual(CartItem.objects.filter(cart__user=bob).count(), 2)
+
+    def test_checkout_refuses_a_cart_whose_stock_is_held(self):
+        make_cart(make_user('alice'), [(self.phone, 1)])
+        self.client.force_login(User.objects.get(username='alice'))
+        self.client.get(reverse('orders:checkout'))  # holds the last phone
+        bob = make_user('bob')
+        make_cart(bob, [(self.phone, 1)])
+
+        response = self.checkout(bob)
+        self.assertRedirects(response, reverse('cart:cart_detail'), fetch_redirect_response=False)
+        self.assertIn('Phone', last_message(response))
+        self.assertFalse(Order.objects.exists())
+
+
+class ConcurrentStockDecrementTests(TransactionTestCase):
+
+    def test_concurrent_decrements_never_oversell(self):
+        phone = make_product('Phone', stock_quantity=2)
+        barrier = threading.Barrier(6)
+        outcomes = []
+
+        def buy():
+            barrier.wait()
+            try:
+                decrement_stock({phone.id: 1})
+                outcomes.append('sold')
+            except (InsufficientStock, DatabaseError):
+                outcomes.append('refused')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        phone.refresh_from_db()
+        self.assertLessEqual(outcomes.count('sold'), 2)
+        self.assertEqual(phone.stock_quantity, 2 - outcomes.count('sold'))
+
+
+class CheckoutReplayTests(TestCase):
+
+    def setUp(self):
+        self.phone = make_product('Phone', stock_quantity=5)
+        self.alice = make_user('alice')
+        make_cart(self.alice, [(self.phone, 2)])
+        self.client.force_login(self.alice)
+
+    def checkout(self):
+        return self.client.post(reverse('orders:checkout'), checkout_data(idempotency_key='key-1'))
+
+    def test_resubmitted_form_gets_the_same_order(self):
+        first = self.checkout()
+        second = self.checkout()
+
+        order = Order.objects.get()
+        self.assertEqual(order.idempotency_key, 'key-1')
+        url = reverse('orders:order_confirmation', args=[order.order_number])
+        self.assertRedirects(first, url, fetch_redirect_response=False)
+        self.assertRedirects(second, url, fetch_redirect_response=False)
+        self.assertEqual(OrderItem.objects.count(), 1)
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.stock_quantity, 3)
+
+    def test_submission_losing_the_insert_race_gets_the_winners_order(self):
+        # The winner committed after the loser looked for it, so the loser's insert hits the unique key
+        winner = make_order(self.alice, [(self.phone, 2)], idempotency_key='key-1')
+        with mock.patch('orders.views.get_replayed_order', side_effect=[None, winner]) as replayed:
+            response = self.checkout()
+
+        self.assertEqual(replayed.call_count, 2)
+        self.assertRedirects(response, reverse('orders:order_confirmation', args=[winner.order_number]),
+                             fetch_redirect_response=False)
+        self.assertEqual(list(Order.objects.all()), [winner])
+        self.assertEqual(OrderItem.objects.filter(order=winner).count(), 1)
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.stock_quantity, 5)
+
+
+class OutboxTests(TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.failing = set()
+        handlers = mock.patch.dict(outbox._handlers, {'test.event': [self.send_email, self.count_sale]})
+        handlers.start()
+        self.addCleanup(handlers.stop)
+
+    def send_email(self, event):
+        self.handle('email')
+
+    def count_sale(self, event):
+        self.handle('sale')
+
+    def handle(self, name):
+        self.calls.append(name)
+        if name in self.failing:
+            raise RuntimeError(f'{name} is down')
+
+    def claim_one(self, worker_id='w1'):
+        events = outbox.claim_batch(worker_id)
+        self.assertEqual(len(events), 1)
+        return events[0]
+
+    def test_claim_leases_due_events_once(self):
+        due = outbox.enqueue('test.event')
+        later = outbox.enqueue('test.event')
+        OutboxEvent.objects.filter(id=later.id).update(available_at=timezone.now() + timedelta(minutes=5))
+
+        self.assertEqual([event.id for event in outbox.claim_batch('w1')], [due.id])
+        self.assertEqual(outbox.claim_batch('w2'), [])
+        due.refresh_from_db()
+        self.assertEqual((due.status, due.locked_by), ('processing', 'w1'))
+
+    def test_success_marks_the_event_done(self):
+        event = outbox.enqueue('test.event')
+        self.assertTrue(outbox.process_event(self.claim_one(), 'w1'))
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts, event.locked_by), ('done', 1, ''))
+        self.assertEqual(self.calls, ['email', 'sale'])
+
+    def test_failure_is_retried_later_without_rerunning_handlers_that_ran(self):
+        event = outbox.enqueue('test.event')
+        self.failing.add('sale')
+        with mock.patch.object(outbox, 'retry_delay', return_value=60), self.assertLogs('orders.outbox', 'WARNING'):
+            self.assertFalse(outbox.process_event(self.claim_one(), 'w1'))
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('pending', 1))
+        self.assertIn('sale is down', event.last_error)
+        self.assertGreater(event.available_at, timezone.now() + timedelta(seconds=55))
+        self.assertEqual(event.completed_handlers, [outbox.handler_name(self.send_email)])
+
+        self.failing.clear()
+        OutboxEvent.objects.filter(id=event.id).update(available_at=timezone.now())
+        self.assertTrue(outbox.process_event(self.claim_one(), 'w1'))
+        self.assertEqual(self.calls, ['email', 'sale', 'sale'])
+
+    def test_backoff_grows_with_attempts(self):
+        with mock.patch('random.uniform', side_effect=lambda low, high: high):
+            self.assertEqual([retry_delay(n) for n in range(4)], [5, 10, 20, 40])
+            self.assertEqual(retry_delay(20), 3600)
+
+    def test_event_fails_for_good_after_max_attempts(self):
+        event = outbox.enqueue('test.event')
+        self.failing.add('email')
+        OutboxEvent.objects.filter(id=event.id).update(attempts=2)
+        with self.assertLogs('orders.outbox', 'WARNING'):
+            self.assertFalse(outbox.process_event(self.claim_one(), 'w1', max_attempts=3))
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('failed', 3))
+        self.assertEqual(outbox.claim_batch('w1'), [])
+
+    def test_late_worker_does_not_overwrite_the_new_lease(self):
+        event = outbox.enqueue('test.event')
+        stale = self.claim_one('w1')
+        # w1 stalls past its lease; the event is requeued and taken by w2
+        OutboxEvent.objects.filter(id=event.id).update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(outbox.requeue_stale(lease_seconds=60), 1)
+        self.claim_one('w2')
+
+        with self.assertLogs('orders.outbox', 'WARNING') as logs:
+            self.assertFalse(outbox.process_event(stale, 'w1'))
+        self.assertIn('no longer leased', logs.output[0])
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.locked_by, event.attempts), ('processing', 'w2', 0))
+        # The late handler's writes were rolled back with it
+        self.assertEqual(event.completed_handlers, [])
+
+
+class InvoiceTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.alice = make_user('alice')
+        self.order = make_order(self.alice, [(make_product('Phone'), 2)])
+
+    def generate(self):
+        return generate_invoices(Order.objects.filter(id=self.order.id), processes=0)
+
+    def test_pdf_is_rendered_and_reused_while_unchanged(self):
+        self.assertEqual(self.generate()['generated'], 1)
+        invoice = Invoice.objects.get(order=self.order)
+        self.assertTrue(invoice.file.open('rb').read().startswith(b'%PDF'))
+
+        stats = self.generate()
+        self.assertEqual((stats['generated'], stats['skipped']), (0, 1))
+        reused = Invoice.objects.get(order=self.order)
+        self.assertEqual((reused.file.name, reused.generated_at), (invoice.file.name, invoice.generated_at))
+
+        Order.objects.filter(id=self.order.id).update(payment_status='completed')
+        self.assertEqual(self.generate()['generated'], 1)
+        self.assertNotEqual(Invoice.objects.get(order=self.order).content_hash, invoice.content_hash)
+
+    def test_owner_downloads_the_pdf(self):
+        self.generate()
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse('orders:download_invoice', args=[self.order.order_number]))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+    def test_other_users_order_is_not_found(self):
+        self.generate()
+        self.client.force_login(make_user('bob'))
+        response = self.client.get(reverse('orders:download_invoice', args=[self.order.order_number]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_missing_invoice_is_queued_once(self):
+        self.client.force_login(self.alice)
+        url = reverse('orders:download_invoice', args=[self.order.order_number])
+        for _ in range(3):
+            response = self.client.get(url)
+            self.assertRedirects(response, reverse('orders:order_detail', args=[self.order.order_number]),
+                                 fetch_redirect_response=False)
+        self.assertEqual(OutboxEvent.objects.filter(order=self.order, event_type='invoice.requested').count(), 1)
+
+
+class OrderHistoryTests(TestCase):
+
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.products = [make_product('Phone'), make_product('Case'), make_product('Cable')]
+        self.client.force_login(self.alice)
+        self.placed = 0
+
+    def add_orders(self, count, archived=False):
+        """``count`` orders, each older than the ones before, with items"""
+        start = timezone.now() - timedelta(days=1)
+        orders = []
+        for _ in range(count):
+            self.placed += 1
+            order = make_order(self.alice, [(product, 1) for product in self.products], status='delivered')
+            Order.objects.filter(id=order.id).update(created_at=start - timedelta(hours=self.placed))
+            orders.append(order)
+        if archived:
+            archive_chunk([order.id for order in orders])
+        return orders
+
+    def walk(self):
+        """Order numbers of every page, following the cursors"""
+        numbers, url = [], reverse('orders:order_list')
+        while url:
+            page = self.client.get(url).context['page']
+            numbers.extend(order.order_number for order in page)
+            url = f"{reverse('orders:order_list')}?cursor={page.next_cursor}" if page.has_next() else None
+        return numbers
+
+    def first_page_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('orders:order_list')).status_code, 200)
+        return len(queries)
+
+    def test_pages_run_the_same_queries_however_long_the_history(self):
+        self.add_orders(2)
+        self.add_orders(2, archived=True)
+        small = self.first_page_queries()
+        self.add_orders(ORDERS_PER_PAGE * 2)
+        self.add_orders(ORDERS_PER_PAGE * 2, archived=True)
+        with self.assertNumQueries(small):
+            self.client.get(reverse('orders:order_list'))
+
+    def test_cursor_walks_across_live_and_archived_orders(self):
+        live = self.add_orders(ORDERS_PER_PAGE + 3)
+        archived = self.add_orders(ORDERS_PER_PAGE + 2, archived=True)
+        self.assertEqual(ArchivedOrder.objects.count(), len(archived))
+        self.add_orders(1)  # older than every archived order
+        rows = [
+            row for model in [Order, ArchivedOrder]
+            for row in model.objects.filter(user=self.alice).values_list('created_at', 'id', 'order_number')
+        ]
+        expected = [number for _, _, number in sorted(rows, reverse=True)]
+        self.assertEqual(len(expected), len(live) + len(archived) + 1)
+
+        self.assertEqual(self.walk(), expected)
+
+
+class CancellationTests(TestCase):
+
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.phone = make_product('Phone', stock_quantity=5)
+        self.order = make_order(self.alice, [(self.phone, 2)], status='processing')
+
+    def stock(self):
+        self.phone.refresh_from_db()
+        return self.phone.stock_quantity
+
+    def test_cancelling_twice_restocks_once(self):
+        self.assertEqual(cancel_orders([self.order.id]), [self.order.id])
+        self.assertEqual(cancel_orders([self.order.id]), [])
+        self.assertEqual(self.stock(), 7)
+        self.assertEqual(OutboxEvent.objects.filter(event_type='order.cancelled').count(), 1)
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.version), ('cancelled', 1))
+
+    def test_shipped_order_cannot_be_cancelled(self):
+        advance_orders(Order.objects.filter(id=self.order.id), 'shipped')
+        self.assertEqual(cancel_orders(Order.objects.filter(id=self.order.id)), [])
+        self.assertEqual(self.stock(), 5)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'shipped')
+
+    def test_customer_is_told_a_shipped_order_cannot_be_cancelled(self):
+        advance_orders(Order.objects.filter(id=self.order.id), 'shipped')
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse('orders:cancel_order', args=[self.order.order_number]))
+        self.assertEqual(last_message(response), 'This order cannot be cancelled.')
+        self.assertEqual(self.stock(), 5)
+
+    def test_cancelled_order_is_not_shipped(self):
+        cancel_orders([self.order.id])
+        self.assertEqual(advance_orders(Order.objects.filter(id=self.order.id), 'shipped'), 0)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'cancelled')
+
+
+class TransitionTests(TestCase):
+
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.order = make_order(self.alice, [(make_product(), 1)])
+
+    def current(self):
+        return Order.objects.values_list('status', 'payment_status', 'version').get(id=self.order.id)
+
+    def test_allowed_transition_bumps_the_version_and_emits_an_event(self):
+        transition(self.order, status='processing', payment_status='completed')
+        self.assertEqual(self.current(), ('processing', 'completed', 1))
+        self.assertEqual(self.order.version, 1)
+        event = OutboxEvent.objects.get(order=self.order)
+        self.assertEqual(event.event_type, 'order.paid')
+        self.assertEqual(event.payload['version'], 1)
+
+    def test_delivery_stamps_delivered_at(self):
+        for status in ('processing', 'shipped', 'delivered'):
+            transition(self.order, status=status)
+        self.assertEqual(self.current(), ('delivered', 'pending', 3))
+        self.assertIsNotNone(Order.objects.get(id=self.order.id).delivered_at)
+
+    def test_rejected_transition_leaves_the_order_alone(self):
+        with self.assertRaises(InvalidTransition):
+            transition(self.order, status='delivered')
+        self.assertEqual(self.current(), ('pending', 'pending', 0))
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_payment_cannot_complete_on_a_cancelled_order(self):
+        transition(self.order, status='cancelled')
+        with self.assertRaises(InvalidTransition):
+            transition(self.order, payment_status='completed')
+        self.assertEqual(self.current(), ('cancelled', 'pending', 1))
+
+    def test_stale_copy_is_refreshed_before_deciding(self):
+        stale = Order.objects.get(id=self.order.id)
+        transition(self.order, status='processing')
+        transition(stale, status='shipped')
+        self.assertEqual(self.current(), ('shipped', 'pending', 2))
+        stale = Order.objects.get(id=self.order.id)
+        transition(self.order, status='delivered')
+        with self.assertRaises(InvalidTransition):
+            transition(stale, status='cancelled')
+        self.assertEqual(self.current(), ('delivered', 'pending', 3))
+
+    def test_unchanged_state_is_a_no_op(self):
+        transition(self.order, status='pending', payment_status='pending')
+        self.assertEqual(self.current(), ('pending', 'pending', 0))
+
+    def test_cod_retry_on_a_shipped_order_is_refused_with_a_message(self):
+        Order.objects.filter(id=self.order.id).update(status='shipped', payment_status='failed')
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse('payments:initiate_payment', args=[self.order.order_number]))
+        self.assertRedirects(response, reverse('orders:order_detail', args=[self.order.order_number]),
+                             fetch_redirect_response=False)
+        self.assertEqual(last_message(response), 'This order can no longer be paid.')
+        self.assertEqual(self.current()[:2], ('shipped', 'failed'))
+
+
+class ConcurrentCancellationTests(TransactionTestCase):
+
+    def test_cancel_racing_a_shipment_restocks_only_if_it_wins(self):
+        phone = make_product('Phone', stock_quantity=5)
+        orders = [make_order(make_user(f'user{i}'), [(phone, 1)], status='processing') for i in range(4)]
+        for order in orders:
+            barrier = threading.Barrier(2)
+
+            def run(action):
+                barrier.wait()
+                try:
+                    action()
+                except DatabaseError:
+                    pass  # lost the database lock; the other side went ahead
+                finally:
+                    connection.close()
+
+            threads = [
+                threading.Thread(target=run, args=(lambda: cancel_orders([order.id]),)),
+                threading.Thread(target=run, args=(
+                    lambda: advance_orders(Order.objects.filter(id=order.id), 'shipped'),
+                )),
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        statuses = list(Order.objects.values_list('status', flat=True))
+        self.assertTrue(set(statuses) <= {'cancelled', 'shipped', 'processing'})
+        phone.refresh_from_db()
+        # make_order takes no stock, so each cancel that won put one unit back
+        self.assertEqual(phone.stock_quantity, 5 + statuses.count('cancelled'))
+        self.assertEqual(
+            OutboxEvent.objects.filter(event_type='order.cancelled').count(), statuses.count('cancelled'),
+        )
+
+
+class FulfilmentTests(TestCase):
+
+    def setUp(self):
+        alice = make_user('alice')
+        phone = make_product('Phone')
+        self.pending, self.processing, self.shipped = [
+            make_order(alice, [(phone, 1)], status=status) for status in ['pending', 'processing', 'shipped']
+        ]
+
+    def status(self, order):
+        order.refresh_from_db()
+        return order.status
+
+    def test_advance_moves_only_orders_that_may_move(self):
+        changed = advance_orders(Order.objects.all(), 'shipped')
+        self.assertEqual(changed, 1)
+        self.assertEqual(
+            [self.status(order) for order in [self.pending, self.processing, self.shipped]],
+            ['pending', 'shipped', 'shipped'],
+        )
+        self.assertEqual(self.processing.version, 1)
+        event = OutboxEvent.objects.get(event_type='order.status_changed')
+        self.assertEqual((event.order_id, event.payload), (self.processing.id, {'to': 'shipped'}))
+
+    def test_delivery_records_the_time(self):
+        advance_orders(Order.objects.filter(id=self.shipped.id), 'delivered')
+        self.shipped.refresh_from_db()
+        self.assertEqual(self.shipped.status, 'delivered')
+        self.assertIsNotNone(self.shipped.delivered_at)
+
+    def test_tracking_import_applies_good_rows_and_reports_bad_ones(self):
+        self.client.force_login(make_user('admin', is_staff=True, is_superuser=True))
+        rows = [
+            'order_number,tracking_number,status',
+            f'{self.processing.order_number},TRK-1,shipped',
+            f'{self.shipped.order_number},TRK-2,delivered',
+            f'{self.pending.order_number},TRK-3,delivered',
+            'ORD-MISSING,TRK-4,shipped',
+            f'{self.pending.order_number},,returned',
+            ',TRK-5,shipped',
+        ]
+        upload = SimpleUploadedFile('tracking.csv', '\n'.join(rows).encode(), content_type='text/csv')
+        response = self.client.post(reverse('admin:orders_order_import_tracking'), {'file': upload})
+
+        self.assertContains(response, 'Updated 2 order(s), 4 error(s).')
+        errors = [(line, message) for line, _, message in response.context['result'].errors]
+        self.assertEqual(sorted(errors), [
+            (4, 'Cannot move from pending to delivered'),
+            (5, 'Unknown order number'),
+            (6, "Unsupported status 'returned'"),
+            (7, 'Missing order number'),
+        ])
+        self.processing.refresh_from_db()
+        self.shipped.refresh_from_db()
+        self.pending.refresh_from_db()
+        self.assertEqual((self.processing.status, self.processing.tracking_number, self.processing.version),
+                         ('shipped', 'TRK-1', 1))
+        self.assertEqual((self.shipped.status, self.shipped.tracking_number), ('delivered', 'TRK-2'))
+        self.assertIsNotNone(self.shipped.delivered_at)
+        self.assertEqual((self.pending.status, self.pending.tracking_number, self.pending.version), ('pending', None, 0))
+
+    def test_tracking_import_needs_every_column(self):
+        self.client.force_login(make_user('admin', is_staff=True, is_superuser=True))
+        upload = SimpleUploadedFile('tracking.csv', b'order_number,status\nORD-1,shipped\n')
+        response = self.client.post(reverse('admin:orders_order_import_tracking'), {'file': upload})
+        self.assertContains(response, 'Missing column(s): tracking_number')
+        self.assertEqual(response.context['result'].updated, 0)
+
+
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.alice = make_user('alice')
+        phone, case = make_product('Phone'), make_product('Case')
+        self.old = make_order(self.alice, [(phone, 1), (case, 2)], status='delivered', payment_method='razorpay')
+        self.recent = make_order(self.alice, [(phone, 1)], status='delivered')
+        self.old_pending = make_order(self.alice, [(case, 1)])
+        Order.objects.exclude(id=self.recent.id).update(created_at=timezone.now() - timedelta(days=400))
+        payment = Payment.objects.create(
+            order=self.old, user=self.alice, amount=self.old.total_amount, payment_method='razorpay',
+            status='refunded', razorpay_payment_id='pay_old',
+        )
+        Refund.objects.create(payment=payment, amount=payment.amount, reason='Damaged', status='completed')
+        generate_invoices(Order.objects.filter(id=self.old.id), processes=0)
+
+    def test_old_finished_orders_move_with_their_rows(self):
+        self.assertEqual(archive_orders(older_than_days=365, chunk_size=1), 1)
+
+        self.assertEqual(set(Order.objects.values_list('id', flat=True)), {self.recent.id, self.old_pending.id})
+        archived = ArchivedOrder.objects.get()
+        self.assertEqual((archived.id, archived.order_number), (self.old.id, self.old.order_number))
+        self.assertTrue(archived.invoice_file)
+        self.assertEqual(ArchivedOrderItem.objects.filter(order=archived).count(), 2)
+        self.assertFalse(OrderItem.objects.filter(order_id=self.old.id).exists())
+        self.assertEqual(ArchivedPayment.objects.get().razorpay_payment_id, 'pay_old')
+        self.assertEqual(ArchivedRefund.objects.get().reason, 'Damaged')
+        self.assertFalse(Payment.objects.exists())
+        self.assertFalse(Refund.objects.exists())
+        self.assertFalse(Invoice.objects.exists())
+
+    def test_orders_with_unfinished_events_stay_live(self):
+        outbox.enqueue('order.status_changed', order=self.old)
+        self.assertEqual(archive_orders(older_than_days=365), 0)
+        self.assertFalse(ArchivedOrder.objects.exists())
+
+    def test_archived_order_pages_still_work(self):
+        archive_orders(older_than_days=365)
+        self.client.force_login(self.alice)
+
+        detail = self.client.get(reverse('orders:order_detail', args=[self.old.order_number]))
+        self.assertEqual(detail.status_code, 200)
+        self.assertEqual(detail.context['order'].id, self.old.id)
+        self.assertEqual(len(detail.context['order_items']), 2)
+
+        listed = self.client.get(reverse('orders:order_list')).context['page']
+        self.assertIn(self.old.order_number, [order.order_number for order in listed])
+
+        invoice = self.client.get(reverse('orders:download_invoice', args=[self.old.order_number]))
+        self.assertEqual(invoice['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(invoice.streaming_content).startswith(b'%PDF'))
+
+        self.client.force_login(make_user('bob'))
+        other = self.client.get(reverse('orders:order_detail', args=[self.old.order_number]))
+        self.assertEqual(other.status_code, 404)
+
+
+class SalesRollupTests(TestCase):
+
+    def setUp(self):
+        alice, bob = make_user('alice'), make_user('bob')
+        brand = Brand.objects.create(name='Acme')
+        phone = make_product('Phone', price=100, discount_price=90, brand=brand)
+        case = make_product('Case', price=20, category=Category.objects.create(name='Accessories'))
+        self.orders = [
+            make_order(alice, [(phone, 1), (case, 2)], status='delivered', discount=Decimal('13.00')),
+            make_order(bob, [(phone, 2)], status='cancelled', payment_method='razorpay'),
+            make_order(bob, [(case, 1)], status='delivered'),
+        ]
+        # Counted as the outbox worker does, from the order events
+        for order in self.orders:
+            record_order_placed(order.id)
+        record_order_cancelled(self.orders[1].id)
+        self.day = timezone.localdate()
+        self.incremental = self.snapshot()
+
+    def snapshot(self):
+        sales = DailySalesRollup.objects.order_by('category', 'brand', 'payment_method').values(
+            'date', 'category', 'brand', 'payment_method', 'orders', 'units', 'gross', 'discounts',
+            'cancellations', 'cancelled_units', 'cancelled_gross',
+        )
+        orders = DailyOrderRollup.objects.order_by('payment_method').values(
+            'date', 'payment_method', 'orders', 'cancellations',
+        )
+        return list(sales), list(orders)
+
+    def test_incremental_counts(self):
+        sales, orders = self.incremental
+        self.assertEqual(
+            [(row['payment_method'], row['orders'], row['cancellations']) for row in orders],
+            [('cod', 2, 0), ('razorpay', 1, 1)],
+        )
+        phone_cod = next(row for row in sales if row['brand'] and row['payment_method'] == 'cod')
+        # 90 paid less 90/130 of the 13 order discount; 10 list discount plus that share
+        self.assertEqual((phone_cod['gross'], phone_cod['discounts']), (Decimal('81.00'), Decimal('19.00')))
+        self.assertEqual(sum(row['cancelled_units'] for row in sales), 2)
+
+    def test_counting_an_event_twice_changes_nothing(self):
+        record_order_placed(self.orders[0].id)
+        record_order_cancelled(self.orders[1].id)
+        self.assertEqual(self.snapshot(), self.incremental)
+
+    def test_backfill_matches_incremental_counts(self):
+        DailySalesRollup.objects.update(units=999)
+        backfill(self.day, self.day)
+        self.assertEqual(self.snapshot(), self.incremental)
+
+    def test_backfill_counts_archived_orders(self):
+        archive_chunk([order.id for order in self.orders[:2]])
+        self.assertEqual(ArchivedOrder.objects.count(), 2)
+        backfill(self.day, self.day)
+        self.assertEqual(self.snapshot(), self.incremental)
+
+    def test_backfill_command_starts_at_the_first_archived_order(self):
+        archive_chunk([order.id for order in self.orders])
+        ArchivedOrder.objects.filter(id=self.orders[0].id).update(created_at=timezone.now() - timedelta(days=2))
+        DailySalesRollup.objects.all().delete()
+        out = StringIO()
+        call_command('backfill_sales_rollups', stdout=out)
+        self.assertIn('Rebuilt', out.getvalue())
+        self.assertEqual(
+            set(DailySalesRollup.objects.values_list('date', flat=True)),
+            {self.day - timedelta(days=2), self.day},
+        )
+
+
+class ChargeTests(TestCase):
+
+    def setUp(self):
+        self.phones = Category.objects.create(name='Phones')
+        self.books = Category.objects.create(name='Books')
+
+    def quote(self, lines, state='Maharashtra', pincode='411001', discounts=None):
+        """Quote ``(category, amount)`` lines with the rules currently saved"""
+        engine = ChargeEngine(ShippingRule.objects.filter(is_active=True), TaxRule.objects.filter(is_active=True))
+        return engine.quote(
+            [(category.id, Decimal(amount), 1) for category, amount in lines], state, pincode, discounts,
+        )
+
+    def test_default_rule_keeps_the_old_flat_rate(self):
+        charges = self.quote([(self.phones, 200)])
+        self.assertEqual((charges.shipping, charges.tax, charges.total), (Decimal(50), Decimal(0), Decimal(250)))
+        self.assertEqual(charges.free_shipping_gap, Decimal(300))
+        charges = self.quote([(self.phones, 300), (self.books, 200)])
+        self.assertEqual((charges.shipping, charges.free_shipping_gap), (Decimal(0), None))
+
+    def test_free_above_counts_the_discounted_amount(self):
+        charges = self.quote([(self.phones, 520)], discounts={self.phones.id: Decimal(30)})
+        self.assertEqual((charges.discount, charges.shipping, charges.total), (Decimal(30), Decimal(50), Decimal(540)))
+
+    def test_priority_then_age_breaks_ties(self):
+        ShippingRule.objects.create(name='Maharashtra', state='Maharashtra', charge=40)
+        ShippingRule.objects.create(name='Maharashtra later', state='maharashtra', charge=30)
+        self.assertEqual(self.quote([(self.phones, 100)]).shipping, Decimal(40))
+        ShippingRule.objects.create(name='Maharashtra promo', state='Maharashtra', charge=10, priority=5)
+        self.assertEqual(self.quote([(self.phones, 100)]).shipping, Decimal(10))
+
+    def test_most_specific_rule_wins(self):
+        ShippingRule.objects.create(name='Maharashtra', state='Maharashtra', charge=40, priority=10)
+        ShippingRule.objects.create(name='Pune', pincode_from=411000, pincode_to=411099, charge=20)
+        ShippingRule.objects.create(name='Books', category=self.books, charge=5)
+        self.assertEqual(self.quote([(self.phones, 100)]).shipping, Decimal(20))
+        self.assertEqual(self.quote([(self.phones, 100)], pincode='400001').shipping, Decimal(40))
+        self.assertEqual(self.quote([(self.phones, 100)], state='Goa', pincode='403001').shipping, Decimal(50))
+        # Each rule charges once for the lines it covers
+        self.assertEqual(self.quote([(self.phones, 100), (self.books, 100)]).shipping, Decimal(25))
+
+    def test_tax_is_charged_per_category_on_the_discounted_amount(self):
+        TaxRule.objects.create(name='GST', rate=Decimal('18.00'))
+        TaxRule.objects.create(name='Books GST', category=self.books, rate=Decimal('5.00'))
+        charges = self.quote(
+            [(self.phones, '99.99'), (self.books, 200)], discounts={self.books.id: Decimal(20)},
+        )
+        # 18% of 99.99 rounds half up to 18.00; 5% of 180 is 9.00
+        self.assertEqual(charges.tax, Decimal('27.00'))
+        self.assertEqual(charges.total, Decimal('99.99') + 180 + 50 + Decimal('27.00'))
+
+    def test_no_matching_rule_charges_nothing(self):
+        ShippingRule.objects.update(is_active=False)
+        ShippingRule.objects.create(name='Goa', state='Goa', charge=60)
+        TaxRule.objects.create(name='Goa GST', state='Goa', rate=12)
+        charges = self.quote([(self.phones, 100)])
+        self.assertEqual((charges.shipping, charges.tax, charges.total), (Decimal(0), Decimal(0), Decimal(100)))
+        self.assertIsNone(charges.free_shipping_gap)
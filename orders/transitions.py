@@ -0,0 +1,108 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Order
+from .outbox import enqueue
+
+# Target status -> statuses it may be reached from
+ORDER_TRANSITIONS = {
+    'processing': ('pending',),
+    'shipped': ('processing',),
+    'delivered': ('shipped',),
+    'cancelled': ('pending', 'processing'),
+}
+
+# Target payment status -> payment statuses it may be reached from
+PAYMENT_TRANSITIONS = {
+    'pending': ('failed',),
+    'completed': ('pending', 'failed'),
+    'failed': ('pending',),
+}
+
+# Target payment status -> order statuses it may happen in, when the order status stays put
+PAYMENT_ORDER_STATUSES = {
+    'pending': ('pending',),
+    'completed': ('pending', 'processing'),
+    'failed': ('pending',),
+}
+
+
+class InvalidTransition(Exception):
+    """Raised when an order cannot move to the requested state from its current one"""
+
+    def __init__(self, order, status=None, payment_status=None):
+        self.order = order
+        target = ', '.join(
+            f'{name} {value}' for name, value in
+            [('status', status), ('payment', payment_status)] if value is not None
+        )
+        super().__init__(
+            f'Order {order.order_number} is {order.status} (payment {order.payment_status}) '
+            f'and cannot move to {target}.'
+        )
+
+
+def event_type_for(status=None, payment_status=None):
+    """Outbox event emitted by a transition into these states"""
+    if status == 'cancelled':
+        return 'order.cancelled'
+    if payment_status == 'completed':
+        return 'order.paid'
+    return 'order.status_changed'
+
+
+def transition(order, status=None, payment_status=None, retries=3, **fields):
+    """Move ``order`` to ``status`` and/or ``payment_status``.
+
+    Runs ``UPDATE ... WHERE id = ? AND version = ? AND status IN (...)``,
+    writing only the changed columns (plus ``fields``) and bumping the
+    version, so no row lock is held and a concurrent change is never
+    overwritten. If the move looks illegal or another writer got there first,
+    the state is re-read and the move retried while it is legal; otherwise
+    InvalidTransition is raised. The transition event is enqueued in the same transaction.
+    Returns the order, updated in place.
+    """
+    for attempt in range(retries + 1):
+        if attempt:
+            # Someone else changed the order since it was read
+            order.refresh_from_db(fields=['status', 'payment_status', 'version'])
+        changes = dict(fields)
+        conditions = {'id': order.id, 'version': order.version}
+        if status is not None and status != order.status:
+            changes['status'] = status
+            conditions['status__in'] = ORDER_TRANSITIONS.get(status, ())
+        if payment_status is not None and payment_status != order.payment_status:
+            changes['payment_status'] = payment_status
+            conditions['payment_status__in'] = PAYMENT_TRANSITIONS.get(payment_status, ())
+            if 'status' not in changes:
+                conditions['status__in'] = PAYMENT_ORDER_STATUSES.get(payment_status, ())
+        if not changes:
+            return order
+        if (order.status not in conditions.get('status__in', [order.status])
+                or order.payment_status not in conditions.get('payment_status__in', [order.payment_status])):
+            if attempt:
+                raise InvalidTransition(order, status, payment_status)
+            continue  # the copy in hand may be stale; check the current state
+
+        now = timezone.now()
+        changes['updated_at'] = now
+        if changes.get('status') == 'delivered':
+            changes.setdefault('delivered_at', now)
+
+        with transaction.atomic():
+            if Order.objects.filter(**conditions).update(version=F('version') + 1, **changes):
+                payload = {
+                    'from': order.status, 'to': changes.get('status', order.status),
+                    'payment_from': order.payment_status,
+                    'payment_to': changes.get('payment_status', order.payment_status),
+                    'version': order.version + 1,
+                }
+                for name, value in changes.items():
+                    setattr(order, name, value)
+                order.version += 1
+                if 'status' in changes or 'payment_status' in changes:
+                    enqueue(event_type_for(changes.get('status'), changes.get('payment_status')),
+                            order=order, payload=payload)
+                return order
+    raise InvalidTransition(order, status, payment_status)
@@ -12,6 +12,7 @@ urlpatterns = [
     path('', views.order_list, name='order_list'),
     path('<str:order_number>/', views.order_detail, name='order_detail'),
     path('<str:order_number>/cancel/', views.cancel_order, name='cancel_order'),
+    path('<str:order_number>/invoice/', views.download_invoice, name='download_invoice'),
     
     # Address Management
     path('addresses/', views.address_list, name='address_list'),
@@ -3,47 +3,95 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db import transaction
-from .models import Order, OrderItem, ShippingAddress
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Prefetch
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404
+from .archive import get_user_order
+from .invoices import invoice_number_for
+from .models import ArchivedOrder, ArchivedOrderItem, Invoice, Order, OrderItem, OutboxEvent, ShippingAddress
+from .cancellation import cancel_orders
+from .charges import quote_cart
 from .forms import CheckoutForm, ShippingAddressForm
+from .outbox import enqueue
+from .transitions import InvalidTransition, transition
 from cart.models import Cart, CartItem
+from cart.reservations import reserve_cart, release_cart
+from products.models import ProductImage
+from products.stock import InsufficientStock, decrement_stock
+from promotions.engine import PromotionUnavailable, apply_to_cart, redeem
+from ecommerce.pagination import paginate_merged
+
+ORDERS_PER_PAGE = 10
+ORDER_PREVIEW_ITEMS = 3
+
+
+def get_replayed_order(request):
+    """Return the order already placed by this checkout submission, if any"""
+    key = request.POST.get('idempotency_key')
+    if not key:
+        return None
+    return Order.objects.filter(user=request.user, idempotency_key=key).first()
+
+
+def redirect_after_checkout(order):
+    """Send the customer on from a placed order"""
+    if order.payment_method == 'cod':
+        return redirect('orders:order_confirmation', order_number=order.order_number)
+    return redirect('orders:razorpay_dummy', order_number=order.order_number)
+
 
 @login_required
 def checkout(request):
     """Checkout page"""
+    # A resubmitted form (double click, client retry) gets the original order back
+    if request.method == 'POST':
+        replayed_order = get_replayed_order(request)
+        if replayed_order:
+            return redirect_after_checkout(replayed_order)
+    
     # Get user's cart
     try:
         cart = Cart.objects.get(user=request.user)
-        cart_items = cart.items.select_related('product').prefetch_related('product__images')
+        cart_items = list(cart.items.select_related('product').prefetch_related('product__images'))
     except Cart.DoesNotExist:
         messages.error(request, 'Your cart is empty.')
         return redirect('cart:cart_detail')
     
-    if not cart_items.exists():
+    if not cart_items:
         messages.error(request, 'Your cart is empty.')
         return redirect('cart:cart_detail')
     
+    # Hold the stock while the customer completes checkout; re-running this
+    # on submit refreshes the hold or fails if it lapsed and was taken.
+    try:
+        reserve_cart(cart)
+    except InsufficientStock as e:
+        messages.error(request, str(e))
+        return redirect('cart:cart_detail')
+    
     # Get saved addresses
     saved_addresses = ShippingAddress.objects.filter(user=request.user)
     
-    # Calculate totals
-    subtotal = cart.get_total_price()
-    shipping_cost = 0 if subtotal >= 500 else 50
-    tax = 0  # You can add tax calculation here
-    total = subtotal + shipping_cost + tax
+    promotions = apply_to_cart(cart_items, request.user, request.session.get('coupon_code'))
     
     if request.method == 'POST':
         form = CheckoutForm(request.POST)
         if form.is_valid():
+            # Shipping and tax depend on where the order goes
+            charges = quote_cart(cart_items, form.cleaned_data['state'], form.cleaned_data['pincode'],
+                                 promotions=promotions)
             try:
                 with transaction.atomic():
                     # Create order
                     order = Order.objects.create(
                         user=request.user,
-                        subtotal=subtotal,
-                        shipping_cost=shipping_cost,
-                        tax=tax,
-                        total_amount=total,
+                        subtotal=charges.subtotal,
+                        shipping_cost=charges.shipping,
+                        tax=charges.tax,
+                        discount=charges.discount,
+                        total_amount=charges.total,
+                        coupon_code=promotions.coupon.code if promotions.coupon else '',
                         payment_method=form.cleaned_data['payment_method'],
                         full_name=form.cleaned_data['full_name'],
                         phone=form.cleaned_data['phone'],
@@ -55,21 +103,26 @@ def checkout(request):
                         pincode=form.cleaned_data['pincode'],
                         country=form.cleaned_data['country'],
                         order_notes=form.cleaned_data['order_notes'],
+                        idempotency_key=form.cleaned_data['idempotency_key'] or None,
                     )
                     
                     # Create order items
-                    for cart_item in cart_items:
-                        OrderItem.objects.create(
+                    OrderItem.objects.bulk_create([
+                        OrderItem(
                             order=order,
                             product=cart_item.product,
                             quantity=cart_item.quantity,
-                            price=cart_item.product.get_final_price()
+                            price=cart_item.product.get_final_price(),
+                            list_price=cart_item.product.price,
                         )
-                        
-                        # Update product stock
-                        product = cart_item.product
-                        product.stock_quantity -= cart_item.quantity
-                        product.save()
+                        for cart_item in cart_items
+                    ])
+                    
+                    # Update product stock; rolls the order back if any line is short
+                    decrement_stock({item.product_id: item.quantity for item in cart_items})
+                    
+                    # Take the promotion uses; rolls back if a limit was reached meanwhile
+                    redeem(promotions, order)
                     
                     # Save shipping address if requested
                     if form.cleaned_data.get('save_address'):
@@ -85,19 +138,31 @@ def checkout(request):
                             country=form.cleaned_data['country'],
                         )
                     
+                    # Emails, invoices and analytics run in the outbox worker
+                    enqueue('order.placed', order=order)
+                    
+                    # Stock is now decremented, so the holds are consumed
+                    release_cart(cart)
+                    
                     # Clear cart
                     cart.items.all().delete()
+                    request.session.pop('coupon_code', None)
                     
                     # Redirect based on payment method
                     if form.cleaned_data['payment_method'] == 'cod':
-                        order.payment_status = 'pending'
-                        order.save()
                         messages.success(request, 'Order placed successfully!')
-                        return redirect('orders:order_confirmation', order_number=order.order_number)
-                    else:
-                        # Redirect to payment page (we'll implement this later)
-                         return redirect('orders:razorpay_dummy', order_number=order.order_number)
+                    return redirect_after_checkout(order)
                         
+            except IntegrityError:
+                # A concurrent submission with the same key won the race
+                replayed_order = get_replayed_order(request)
+                if replayed_order:
+                    return redirect_after_checkout(replayed_order)
+                messages.error(request, 'Error placing order. Please try again.')
+                return redirect('cart:cart_detail')
+            except (InsufficientStock, PromotionUnavailable) as e:
+                messages.error(request, str(e))
+                return redirect('cart:cart_detail')
             except Exception as e:
                 messages.error(request, f'Error placing order: {str(e)}')
                 return redirect('cart:cart_detail')
@@ -125,14 +190,19 @@ def checkout(request):
         
         form = CheckoutForm(initial=initial_data)
     
+    # Estimate for the address currently in the form
+    charges = quote_cart(cart_items, form['state'].value(), form['pincode'].value(), promotions=promotions)
+    
     context = {
         'form': form,
         'cart_items': cart_items,
         'cart': cart,
-        'subtotal': subtotal,
-        'shipping_cost': shipping_cost,
-        'tax': tax,
-        'total': total,
+        'charges': charges,
+        'promotions': promotions,
+        'subtotal': charges.subtotal,
+        'shipping_cost': charges.shipping,
+        'tax': charges.tax,
+        'total': charges.total,
         'saved_addresses': saved_addresses,
     }
     return render(request, 'orders/checkout.html', context)
@@ -141,8 +211,7 @@ def checkout(request):
 @login_required
 def order_confirmation(request, order_number):
     """Order confirmation page"""
-    order = get_object_or_404(Order, order_number=order_number, user=request.user)
-    order_items = order.items.select_related('product').prefetch_related('product__images')
+    order, order_items = get_user_order(request.user, order_number)
     
     context = {
         'order': order,
@@ -153,11 +222,37 @@ def order_confirmation(request, order_number):
 
 @login_required
 def order_list(request):
-    """User's order history"""
-    orders = Order.objects.filter(user=request.user).prefetch_related('items__product')
+    """User's order history, including orders moved to the archive"""
+    # Four queries per table and page however many orders or items: the
+    # orders with their line counts, the first three lines (with products)
+    # of each order, and one thumbnail per product.
+    def with_previews(orders, item_model):
+        return orders.filter(user=request.user).annotate(
+            item_count=Count('items')
+        ).annotate(
+            more_items=F('item_count') - ORDER_PREVIEW_ITEMS
+        ).prefetch_related(
+            Prefetch(
+                'items',
+                queryset=item_model.objects.select_related('product').order_by('id')[:ORDER_PREVIEW_ITEMS],
+                to_attr='preview_items',
+            ),
+            Prefetch(
+                'preview_items__product__images',
+                queryset=ProductImage.objects.order_by('-is_primary', 'created_at')[:1],
+                to_attr='thumbnails',
+            ),
+        )
+    
+    page = paginate_merged(
+        [with_previews(Order.objects, OrderItem), with_previews(ArchivedOrder.objects, ArchivedOrderItem)],
+        request.GET.get('cursor'), per_page=ORDERS_PER_PAGE,
+    )
     
     context = {
-        'orders': orders,
+        'orders': page,
+        'page': page,
+        'preview_limit': ORDER_PREVIEW_ITEMS,
     }
     return render(request, 'orders/order_list.html', context)
 
@@ -165,8 +260,8 @@ def order_list(request):
 @login_required
 def order_detail(request, order_number):
     """Order detail page"""
-    order = get_object_or_404(Order, order_number=order_number, user=request.user)
-    order_items = order.items.select_related('product').prefetch_related('product__images')
+    # Old delivered/cancelled orders are served from the archive tables
+    order, order_items = get_user_order(request.user, order_number)
     
     context = {
         'order': order,
@@ -175,22 +270,46 @@ def order_detail(request, order_number):
     return render(request, 'orders/order_detail.html', context)
 
 
+@login_required
+def download_invoice(request, order_number):
+    """Stream the invoice PDF; rendering happens in the outbox worker"""
+    order, _ = get_user_order(request.user, order_number)
+    if isinstance(order, ArchivedOrder):
+        if not order.invoice_file:
+            raise Http404('No invoice for this order.')
+        return FileResponse(
+            default_storage.open(order.invoice_file, 'rb'),
+            as_attachment=True,
+            filename=f'{invoice_number_for(order)}.pdf',
+            content_type='application/pdf',
+        )
+    
+    invoice = Invoice.objects.filter(order=order).first()
+    if not invoice or not invoice.file:
+        # One queued render per order, however often the customer clicks
+        queued = OutboxEvent.objects.filter(
+            order=order, event_type='invoice.requested', status__in=('pending', 'processing'),
+        )
+        if not queued.exists():
+            enqueue('invoice.requested', order=order)
+        messages.info(request, 'Your invoice is being prepared. Please try again in a minute.')
+        return redirect('orders:order_detail', order_number=order_number)
+    
+    return FileResponse(
+        invoice.file.open('rb'),
+        as_attachment=True,
+        filename=f'{invoice.invoice_number}.pdf',
+        content_type='application/pdf',
+    )
+
+
 @login_required
 def cancel_order(request, order_number):
     """Cancel order"""
     order = get_object_or_404(Order, order_number=order_number, user=request.user)
     
-    # Only allow cancellation for pending and processing orders
-    if order.status in ['pending', 'processing']:
-        order.status = 'cancelled'
-        order.save()
-        
-        # Restore product stock
-        for item in order.items.all():
-            product = item.product
-            product.stock_quantity += item.quantity
-            product.save()
-        
+    # Only pending and processing orders are cancelled; stock is restored once
+    if cancel_orders([order.id]):
         messages.success(request, 'Order cancelled successfully.')
     else:
         messages.error(request, 'This order cannot be cancelled.')
@@ -272,10 +391,14 @@ def razorpay_dummy(request, order_number):
 def razorpay_success(request, order_number):
     order = get_object_or_404(Order, order_number=order_number, user=request.user)
 
-    order.payment_status = 'completed'
-    order.status = 'processing'
-    order.payment_id = f"rzp_dummy_{order.id}"
-    order.save()
+    if order.payment_status != 'completed':
+        try:
+            # Emits order.paid; refused if the order was cancelled meanwhile
+            transition(order, status='processing', payment_status='completed',
+                       payment_id=f"rzp_dummy_{order.id}")
+        except InvalidTransition:
+            messages.error(request, 'This order can no longer be paid.')
+            return redirect('orders:order_detail', order_number=order.order_number)
 
     messages.success(request, 'Payment successful!')
     return redirect('orders:order_confirmation', order_number=order.order_number)
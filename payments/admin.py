@@ -1,11 +1,15 @@
 from django.contrib import admin
-from .models import Payment, Refund
+from .models import (
+    ArchivedPayment, ArchivedRefund, Payment, ReconciliationIssue, ReconciliationRun, Refund,
+    WebhookEvent,
+)
 
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ['payment_id', 'order', 'user', 'amount', 'payment_method', 
                     'status', 'created_at']
     list_filter = ['status', 'payment_method', 'created_at']
+    list_select_related = ['order__user', 'user']
     search_fields = ['payment_id', 'order__order_number', 'user__username', 
                      'razorpay_payment_id', 'razorpay_order_id']
     readonly_fields = ['payment_id', 'created_at', 'updated_at', 'paid_at']
@@ -18,7 +22,7 @@ class PaymentAdmin(admin.ModelAdmin):
             'fields': ('payment_method', 'status')
         }),
         ('Razorpay Details', {
-            'fields': ('razorpay_order_id', 'razorpay_payment_id', 'razorpay_signature')
+            'fields': ('razorpay_order_id', 'razorpay_payment_id', 'razorpay_signature', 'settlement_id')
         }),
         ('Additional Info', {
             'fields': ('payment_response', 'failure_reason', 'notes')
@@ -30,7 +34,47 @@ class PaymentAdmin(admin.ModelAdmin):
 
 @admin.register(Refund)
 class RefundAdmin(admin.ModelAdmin):
-    list_display = ['refund_id', 'payment', 'amount', 'status', 'created_at']
+    list_display = ['refund_id', 'payment', 'amount', 'status', 'attempts', 'created_at']
     list_filter = ['status', 'created_at']
+    list_select_related = ['payment__order']
     search_fields = ['refund_id', 'payment__payment_id', 'razorpay_refund_id']
-    readonly_fields = ['refund_id', 'created_at', 'processed_at']
\ No newline at end of file
+    readonly_fields = ['refund_id', 'created_at', 'processed_at', 'attempts', 'locked_at', 'last_error']
+
+class ReadOnlyAdmin(admin.ModelAdmin):
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(ArchivedPayment)
+class ArchivedPaymentAdmin(ReadOnlyAdmin):
+    list_display = ['payment_id', 'order', 'user', 'amount', 'payment_method', 'status', 'created_at']
+    list_filter = ['status', 'payment_method']
+    list_select_related = ['order', 'user']
+    search_fields = ['payment_id', 'order__order_number', 'razorpay_payment_id']
+
+@admin.register(ArchivedRefund)
+class ArchivedRefundAdmin(ReadOnlyAdmin):
+    list_display = ['refund_id', 'payment', 'amount', 'status', 'created_at']
+    list_filter = ['status']
+    list_select_related = ['payment']
+    search_fields = ['refund_id', 'payment__payment_id']
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(ReadOnlyAdmin):
+    list_display = ['event_id', 'event_type', 'status', 'received_at', 'processed_at']
+    list_filter = ['status', 'event_type']
+    search_fields = ['event_id', 'error']
+
+@admin.register(ReconciliationRun)
+class ReconciliationRunAdmin(ReadOnlyAdmin):
+    list_display = ['source', 'started_at', 'finished_at', 'lines', 'matched', 'skipped', 'issue_count']
+
+@admin.register(ReconciliationIssue)
+class ReconciliationIssueAdmin(ReadOnlyAdmin):
+    list_display = ['run', 'kind', 'line_number', 'gateway_payment_id', 'payment_ref',
+                    'expected_amount', 'settled_amount', 'detail']
+    list_filter = ['kind', 'run']
+    list_select_related = ['run']
+    search_fields = ['gateway_payment_id', 'payment_ref', 'settlement_id']
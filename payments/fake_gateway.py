@@ -0,0 +1,71 @@
+import json
+import time
+import uuid
+
+from django.urls import reverse
+
+from .webhooks import sign
+
+
+class Delivery:
+    """One signed webhook request as the gateway would send it"""
+
+    def __init__(self, event_id, body, signature):
+        self.event_id = event_id
+        self.body = body
+        self.headers = {'X-Razorpay-Event-Id': event_id, 'X-Razorpay-Signature': signature}
+
+
+class FakeGateway:
+    """Local stand-in for Razorpay's webhooks, for tests and development.
+
+    Builds signed deliveries shaped like the real ones; ``deliver`` posts one
+    to the callback URL with a Django test client.
+    """
+
+    def __init__(self, secret):
+        self.secret = secret
+
+    def event(self, event_type, payload, event_id=None):
+        body = json.dumps({
+            'entity': 'event',
+            'event': event_type,
+            'payload': payload,
+            'created_at': int(time.time()),
+        }).encode()
+        return Delivery(event_id or f'evt_{uuid.uuid4().hex[:14]}', body, sign(body, self.secret))
+
+    def _payment(self, order, status, payment_id=None, amount=None, **extra):
+        entity = {
+            'id': payment_id or f'pay_{uuid.uuid4().hex[:14]}',
+            'entity': 'payment',
+            'amount': int(order.total_amount * 100) if amount is None else amount,
+            'currency': 'INR',
+            'status': status,
+            'order_id': f'order_{order.id}',
+            'notes': {'order_number': order.order_number},
+            **extra,
+        }
+        return {'payment': {'entity': entity}}
+
+    def payment_authorized(self, order, **kwargs):
+        return self.event('payment.authorized', self._payment(order, 'authorized', **kwargs))
+
+    def payment_captured(self, order, **kwargs):
+        return self.event('payment.captured', self._payment(order, 'captured', **kwargs))
+
+    def payment_failed(self, order, reason='Payment declined by bank', **kwargs):
+        return self.event('payment.failed', self._payment(order, 'failed', error_description=reason, **kwargs))
+
+    def refund_processed(self, refund_id, payment_id, amount):
+        return self.event('refund.processed', {'refund': {'entity': {
+            'id': refund_id, 'entity': 'refund', 'payment_id': payment_id,
+            'amount': int(amount * 100), 'status': 'processed',
+        }}})
+
+    def deliver(self, client, delivery, signature=None):
+        headers = dict(delivery.headers)
+        if signature is not None:
+            headers['X-Razorpay-Signature'] = signature
+        return client.post(reverse('payments:payment_callback'), data=delivery.body,
+                           content_type='application/json', headers=headers)
@@ -0,0 +1,203 @@
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from ecommerce.backoff import retry_delay
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class GatewayError(Exception):
+    """A gateway call that did not succeed"""
+
+
+class GatewayUnavailable(GatewayError):
+    """The gateway is down, too slow, or the circuit breaker is open; try again later"""
+
+
+class CircuitOpen(GatewayUnavailable):
+    """The call was refused locally because the gateway has been failing"""
+
+
+class GatewayRejected(GatewayError):
+    """The gateway refused the request (4xx); retrying will not help"""
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        super().__init__(f'Gateway rejected the request ({status_code}): {body}')
+
+
+class CircuitBreaker:
+    """Fails calls fast while the gateway is failing.
+
+    Closed: calls go through. After ``failure_threshold`` consecutive
+    failures it opens and refuses calls for ``reset_timeout`` seconds, then
+    lets a single trial call through (half-open): success closes it again,
+    failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._trial_thread = None
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_running:
+                self._trial_running = True
+                self._trial_thread = threading.get_ident()
+                return True
+            return False
+
+    def release(self):
+        """Give up this thread's trial call without a verdict, so the next call can try"""
+        with self._lock:
+            if self._trial_running and self._trial_thread == threading.get_ident():
+                self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class GatewayClient:
+    """Razorpay-style REST client sharing one pooled session across threads.
+
+    Every call has connect and read timeouts. Idempotent calls (GET, or a
+    POST carrying an idempotency key) are retried with jittered backoff on
+    timeouts, connection errors and 5xx/429. Other calls are only retried
+    when the connection could not be opened, as the request never reached
+    the gateway then.
+    """
+
+    def __init__(self, base_url, key_id='', key_secret='', timeout=(3.05, 10), retries=2,
+                 backoff=0.2, pool_size=20, breaker=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        self.session.auth = (key_id, key_secret)
+        # Retries are ours: urllib3's would bypass the breaker
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount(self.base_url, adapter)
+
+    def request(self, method, path, payload=None, idempotency_key=None):
+        method = method.upper()
+        idempotent = method in IDEMPOTENT_METHODS or idempotency_key is not None
+        headers = {'Idempotency-Key': idempotency_key} if idempotency_key else {}
+
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                raise CircuitOpen('Payment gateway circuit is open')
+            last_try = attempt == self.retries
+            try:
+                response = self.session.request(
+                    method, f'{self.base_url}{path}', json=payload, headers=headers, timeout=self.timeout,
+                )
+            except requests.ConnectionError as e:
+                # Covers connect timeouts; a read timeout is not a ConnectionError
+                self.breaker.record_failure()
+                if last_try or not (idempotent or _never_sent(e)):
+                    raise GatewayUnavailable(f'Payment gateway unreachable: {e}') from e
+            except requests.Timeout as e:
+                self.breaker.record_failure()
+                if last_try or not idempotent:
+                    raise GatewayUnavailable(f'Payment gateway timed out: {e}') from e
+            else:
+                if response.status_code in RETRY_STATUSES:
+                    self.breaker.record_failure()
+                    if last_try or not idempotent:
+                        raise GatewayUnavailable(f'Payment gateway error {response.status_code}')
+                else:
+                    self.breaker.record_success()
+                    if response.status_code >= 400:
+                        raise GatewayRejected(response.status_code, response.text[:500])
+                    return response.json()
+            finally:
+                # An unexpected error must not leave the half-open trial taken for good
+                self.breaker.release()
+            time.sleep(retry_delay(attempt, base=self.backoff, cap=2))
+
+    # Razorpay API
+
+    def create_order(self, amount_paise, receipt, notes=None):
+        # Razorpay keeps one order per receipt, so the receipt doubles as idempotency key
+        return self.request('POST', '/v1/orders', {
+            'amount': amount_paise, 'currency': 'INR', 'receipt': receipt, 'notes': notes or {},
+        }, idempotency_key=receipt)
+
+    def fetch_payment(self, payment_id):
+        return self.request('GET', f'/v1/payments/{payment_id}')
+
+    def refund(self, payment_id, amount_paise, receipt=None):
+        return self.request('POST', f'/v1/payments/{payment_id}/refund', {
+            'amount': amount_paise, 'receipt': receipt,
+        }, idempotency_key=receipt)
+
+
+def _never_sent(error):
+    """True when the connection failed before any of the request was written"""
+    return isinstance(error, requests.ConnectTimeout) or 'NewConnectionError' in repr(error)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def gateway_configured():
+    return bool(getattr(settings, 'RAZORPAY_KEY_ID', ''))
+
+
+def get_client():
+    """The process-wide client, so every request reuses its pooled connections"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GatewayClient(
+                    settings.PAYMENT_GATEWAY_URL,
+                    settings.RAZORPAY_KEY_ID,
+                    settings.RAZORPAY_KEY_SECRET,
+                    timeout=settings.PAYMENT_GATEWAY_TIMEOUT,
+                    retries=settings.PAYMENT_GATEWAY_RETRIES,
+                    breaker=CircuitBreaker(
+                        failure_threshold=settings.PAYMENT_GATEWAY_BREAKER_THRESHOLD,
+                        reset_timeout=settings.PAYMENT_GATEWAY_BREAKER_RESET,
+                    ),
+                )
+    return _client
@@ -0,0 +1,84 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import ArchivedPayment, Payment, PaymentSummaryVersion
+
+ZERO = Decimal('0.00')
+
+# Summary bucket of each payment status
+SUMMARY_BUCKETS = {
+    'completed': 'paid',
+    'refunded': 'refunded',
+    'pending': 'pending',
+    'processing': 'pending',
+    'failed': 'failed',
+}
+
+
+def _cache_key(user_id, version):
+    return f'payments:summary:{user_id}:{version}'
+
+
+def compute_payment_summary(user_id):
+    """Totals of a user's payments, archived ones included, in one grouped query"""
+    def grouped(model):
+        return (
+            model.objects.filter(user_id=user_id).order_by()
+            .values('status').annotate(total=Sum('amount'), count=Count('id'))
+        )
+
+    summary = {'paid': ZERO, 'refunded': ZERO, 'pending': ZERO, 'failed': ZERO, 'count': 0}
+    for row in grouped(Payment).union(grouped(ArchivedPayment), all=True):
+        bucket = SUMMARY_BUCKETS.get(row['status'])
+        if bucket:
+            summary[bucket] += row['total'] or ZERO
+        summary['count'] += row['count']
+    # Refunded payments were paid first
+    summary['paid'] += summary['refunded']
+    summary['net'] = summary['paid'] - summary['refunded']
+    return summary
+
+
+def get_payment_summary(user_id):
+    """The cached summary, recomputed after the user's payments change.
+
+    The key carries the user's PaymentSummaryVersion, read from the
+    database, so a change made by any process (a webhook or refund worker,
+    say) retires summaries cached by every other one.
+    """
+    version = (
+        PaymentSummaryVersion.objects.filter(user_id=user_id).values_list('version', flat=True).first() or 0
+    )
+    key = _cache_key(user_id, version)
+    summary = cache.get(key)
+    if summary is None:
+        summary = compute_payment_summary(user_id)
+        cache.set(key, summary, settings.PAYMENT_SUMMARY_CACHE_TIMEOUT)
+    return summary
+
+
+def invalidate_payment_summaries(user_ids):
+    """Bump the users' summary versions; call after queryset updates, which send no signals.
+
+    Call it in the transaction that changes the payments: the bump commits
+    with them, so no reader can cache the old totals under the new version.
+    """
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids:
+        return
+    # Create missing rows first, so concurrent first bumps both count
+    PaymentSummaryVersion.objects.bulk_create(
+        [PaymentSummaryVersion(user_id=user_id) for user_id in user_ids], ignore_conflicts=True,
+    )
+    PaymentSummaryVersion.objects.filter(user_id__in=user_ids).update(version=F('version') + 1)
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def _payment_changed(sender, instance, **kwargs):
+    invalidate_payment_summaries([instance.user_id])
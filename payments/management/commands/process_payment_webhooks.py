@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payments.webhooks import process_pending
+
+
+class Command(BaseCommand):
+    help = 'Apply stored payment gateway webhooks to payments and orders, in arrival order'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Keep running and poll every N seconds when idle (0 drains once)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            handled = 0
+            while True:
+                count = process_pending(batch_size=options['batch_size'])
+                handled += count
+                if count < options['batch_size']:
+                    break
+            if handled:
+                self.stdout.write(f'Processed {handled} webhook event(s)')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from payments.refunds import run_refunds
+
+
+class Command(BaseCommand):
+    help = 'Send pending refunds to the payment gateway, several at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=8, help='Gateway calls in flight at once')
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--max-attempts', type=int, default=5)
+        parser.add_argument('--once', action='store_true', help='Exit when no refund is due')
+
+    def handle(self, *args, **options):
+        stats = run_refunds(
+            concurrency=options['concurrency'],
+            batch_size=options['batch_size'],
+            max_attempts=options['max_attempts'],
+            once=options['once'],
+        )
+        self.stdout.write(f'Refunds: {stats}')
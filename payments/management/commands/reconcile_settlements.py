@@ -0,0 +1,31 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from payments.reconciliation import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Reconcile a gateway settlement file (CSV or JSON lines) against payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Defaults to jsonl for .jsonl/.ndjson files, csv otherwise')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--paise', action='store_true', help='Amounts in the file are in paise')
+        parser.add_argument('--unsettled-after-days', type=int, default=3,
+                            help='Report completed payments still unsettled after this many days')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        with open(path, 'rb') as file:
+            run = reconcile(
+                file, source=os.path.basename(path), fmt=fmt, batch_size=options['batch_size'],
+                paise=options['paise'], unsettled_after_days=options['unsettled_after_days'],
+            )
+        self.stdout.write(
+            f'Run {run.id}: {run.lines} line(s), {run.matched} matched, '
+            f'{run.skipped} skipped, {run.issue_count} issue(s)'
+        )
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('orders', '0007_archivedorder_archivedorderitem'),
+        ('payments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPayment',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('payment_id', models.CharField(max_length=100, unique=True)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('currency', models.CharField(default='INR', max_length=3)),
+                ('payment_method', models.CharField(choices=[('cod', 'Cash on Delivery'), ('razorpay', 'Razorpay'), ('upi', 'UPI'), ('card', 'Credit/Debit Card'), ('netbanking', 'Net Banking')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed'), ('refunded', 'Refunded')], max_length=20)),
+                ('razorpay_order_id', models.CharField(blank=True, max_length=100, null=True)),
+                ('razorpay_payment_id', models.CharField(blank=True, max_length=100, null=True)),
+                ('razorpay_signature', models.CharField(blank=True, max_length=200, null=True)),
+                ('payment_response', models.JSONField(blank=True, null=True)),
+                ('failure_reason', models.TextField(blank=True, null=True)),
+                ('notes', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('paid_at', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='payment', to='orders.archivedorder')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_payments', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Archived Payment',
+                'verbose_name_plural': 'Archived Payments',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedRefund',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('refund_id', models.CharField(max_length=100, unique=True)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('reason', models.TextField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('rejected', 'Rejected')], max_length=20)),
+                ('razorpay_refund_id', models.CharField(blank=True, max_length=100, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('payment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='refunds', to='payments.archivedpayment')),
+            ],
+            options={
+                'verbose_name': 'Archived Refund',
+                'verbose_name_plural': 'Archived Refunds',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
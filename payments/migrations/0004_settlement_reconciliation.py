@@ -0,0 +1,63 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_webhook_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('lines', models.PositiveIntegerField(default=0)),
+                ('matched', models.PositiveIntegerField(default=0)),
+                ('skipped', models.PositiveIntegerField(default=0)),
+                ('issue_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Reconciliation Run',
+                'verbose_name_plural': 'Reconciliation Runs',
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='archivedpayment',
+            name='settlement_id',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='settlement_id',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.CreateModel(
+            name='ReconciliationIssue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('unknown_payment', 'Settled but no matching payment'), ('amount_mismatch', 'Settled amount differs'), ('status_mismatch', 'Settled but payment not completed'), ('duplicate_settlement', 'Settled more than once'), ('unsettled', 'Completed but not settled')], max_length=30)),
+                ('line_number', models.PositiveIntegerField(blank=True, null=True)),
+                ('gateway_payment_id', models.CharField(blank=True, max_length=100)),
+                ('payment_ref', models.CharField(blank=True, max_length=100)),
+                ('settlement_id', models.CharField(blank=True, max_length=100)),
+                ('expected_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('settled_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('detail', models.CharField(blank=True, max_length=255)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='issues', to='payments.reconciliationrun')),
+            ],
+            options={
+                'verbose_name': 'Reconciliation Issue',
+                'verbose_name_plural': 'Reconciliation Issues',
+                'ordering': ['run', 'id'],
+            },
+        ),
+    ]
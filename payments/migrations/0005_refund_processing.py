@@ -0,0 +1,59 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def reject_duplicate_open_refunds(apps, schema_editor):
+    """Keep the oldest open refund of each payment so the constraint can be added"""
+    Refund = apps.get_model('payments', 'Refund')
+    seen = set()
+    duplicates = []
+    for refund_id, payment_id in (
+        Refund.objects.filter(status__in=['pending', 'processing'])
+        .order_by('payment_id', 'created_at', 'id').values_list('id', 'payment_id')
+    ):
+        if payment_id in seen:
+            duplicates.append(refund_id)
+        seen.add(payment_id)
+    Refund.objects.filter(id__in=duplicates).update(
+        status='rejected', last_error='Duplicate of an earlier refund request',
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_settlement_reconciliation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='refund',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='refund',
+            name='available_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='refund',
+            name='last_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='refund',
+            name='locked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='refund',
+            index=models.Index(fields=['status', 'available_at'], name='refund_status_available_idx'),
+        ),
+        migrations.RunPython(reject_duplicate_open_refunds, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='refund',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'processing'])), fields=('payment',), name='unique_open_refund_per_payment'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_refund_processing'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='payments_user_history_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+        ('payments', '0006_payment_history_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentSummaryVersion',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='payment_summary_version', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('version', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
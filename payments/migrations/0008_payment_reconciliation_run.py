@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-19 14:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0007_payment_summary_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedpayment',
+            name='reconciliation_run',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='payments.reconciliationrun'),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='reconciliation_run',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='payments.reconciliationrun'),
+        ),
+    ]
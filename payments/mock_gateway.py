@@ -0,0 +1,155 @@
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so pooled connections can be observed
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.gateway._connection_opened()
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+        status, payload = self.server.gateway._respond(method, self.path, body, self.headers)
+        data = json.dumps(payload).encode()
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out and hung up; nothing left to answer
+            self.close_connection = True
+
+
+class MockGatewayServer:
+    """In-process stand-in for the Razorpay API, for tests and local runs.
+
+    Serves ``POST /v1/orders``, ``GET /v1/payments/<id>`` and
+    ``POST /v1/payments/<id>/refund`` on a random localhost port::
+
+        with MockGatewayServer() as gateway:
+            client = GatewayClient(gateway.url)
+            gateway.latency = 0.5      # every response is delayed
+            gateway.fail_next(2, 503)  # the next two requests fail
+            gateway.down = True        # every request fails with 503
+
+    ``requests`` and ``connections`` count what the server has seen.
+    """
+
+    def __init__(self):
+        self.latency = 0
+        self.down = False
+        self.requests = []
+        self.connections = 0
+        self.orders = {}
+        self.payments = {}
+        self._failures = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.gateway = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def fail_next(self, count=1, status=500):
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def add_payment(self, amount_paise, status='captured', payment_id=None):
+        payment_id = payment_id or f'pay_{uuid.uuid4().hex[:14]}'
+        self.payments[payment_id] = {
+            'id': payment_id, 'entity': 'payment', 'amount': amount_paise,
+            'currency': 'INR', 'status': status, 'amount_refunded': 0,
+        }
+        return payment_id
+
+    def _connection_opened(self):
+        with self._lock:
+            self.connections += 1
+
+    def _respond(self, method, path, body, headers):
+        with self._lock:
+            self.requests.append((method, path))
+            failure = self._failures.pop(0) if self._failures else None
+        if self.latency:
+            time.sleep(self.latency)
+        if self.down:
+            return 503, {'error': {'code': 'SERVER_ERROR', 'description': 'Gateway is down'}}
+        if failure:
+            return failure, {'error': {'code': 'SERVER_ERROR', 'description': 'Injected failure'}}
+
+        if method == 'POST' and path == '/v1/orders':
+            return self._create_order(body, headers)
+        match = re.fullmatch(r'/v1/payments/([\w-]+)(/refund)?', path)
+        if match and method == 'GET' and not match[2]:
+            payment = self.payments.get(match[1])
+            return (200, payment) if payment else _not_found('payment')
+        if match and method == 'POST' and match[2]:
+            return self._refund(match[1], body)
+        return _not_found('route')
+
+    def _create_order(self, body, headers):
+        key = headers.get('Idempotency-Key')
+        with self._lock:
+            if key and key in self.orders:
+                return 200, self.orders[key]
+            order = {
+                'id': f'order_{uuid.uuid4().hex[:14]}', 'entity': 'order', 'amount': body.get('amount'),
+                'currency': body.get('currency', 'INR'), 'receipt': body.get('receipt'), 'status': 'created',
+            }
+            self.orders[key or order['id']] = order
+        return 200, order
+
+    def _refund(self, payment_id, body):
+        with self._lock:
+            payment = self.payments.get(payment_id)
+            if payment is None:
+                return _not_found('payment')
+            amount = body.get('amount') or payment['amount'] - payment['amount_refunded']
+            if amount > payment['amount'] - payment['amount_refunded']:
+                return 400, {'error': {'code': 'BAD_REQUEST_ERROR', 'description': 'Refund exceeds payment'}}
+            payment['amount_refunded'] += amount
+        return 200, {
+            'id': f'rfnd_{uuid.uuid4().hex[:14]}', 'entity': 'refund', 'payment_id': payment_id,
+            'amount': amount, 'receipt': body.get('receipt'), 'status': 'processed',
+        }
+
+
+def _not_found(what):
+    return 404, {'error': {'code': 'BAD_REQUEST_ERROR', 'description': f'No such {what}'}}
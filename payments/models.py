@@ -2,7 +2,8 @@
 # Create your models here.
 from django.db import models
 from django.contrib.auth import get_user_model
-from orders.models import Order
+from orders.models import ArchivedOrder, Order
+from django.utils import timezone
 import uuid
 
 User = get_user_model()
@@ -44,6 +45,13 @@ class Payment(models.Model):
     razorpay_payment_id = models.CharField(max_length=100, blank=True, null=True)
     razorpay_signature = models.CharField(max_length=200, blank=True, null=True)
     
+    # Gateway settlement that paid this out, set by reconciliation
+    settlement_id = models.CharField(max_length=100, blank=True, null=True)
+    # Last reconciliation run that matched a settlement line to this payment
+    reconciliation_run = models.ForeignKey(
+        'ReconciliationRun', on_delete=models.SET_NULL, blank=True, null=True, related_name='+', editable=False,
+    )
+    
     # Additional Info
     payment_response = models.JSONField(blank=True, null=True)
     failure_reason = models.TextField(blank=True, null=True)
@@ -58,6 +66,10 @@ class Payment(models.Model):
         verbose_name = 'Payment'
         verbose_name_plural = 'Payments'
         ordering = ['-created_at']
+        indexes = [
+            # Payment history pages walk (created_at, id) per user
+            models.Index(fields=['user', '-created_at', '-id'], name='payments_user_history_idx'),
+        ]
     
     def save(self, *args, **kwargs):
         if not self.payment_id:
@@ -103,10 +115,26 @@ class Refund(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     processed_at = models.DateTimeField(blank=True, null=True)
     
+    # Refund processor bookkeeping
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    
     class Meta:
         verbose_name = 'Refund'
         verbose_name_plural = 'Refunds'
         ordering = ['-created_at']
+        constraints = [
+            # One refund in flight per payment
+            models.UniqueConstraint(
+                fields=['payment'], condition=models.Q(status__in=['pending', 'processing']),
+                name='unique_open_refund_per_payment',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='refund_status_available_idx'),
+        ]
     
     def save(self, *args, **kwargs):
         if not self.refund_id:
@@ -114,4 +142,178 @@ class Refund(models.Model):
         super().save(*args, **kwargs)
     
     def __str__(self):
-        return f"Refund {self.refund_id} - {self.payment.payment_id}"
\ No newline at end of file
+        return f"Refund {self.refund_id} - {self.payment.payment_id}"
+    
+    def get_status_badge_class(self):
+        """Return Bootstrap badge class based on status"""
+        status_classes = {
+            'pending': 'bg-warning',
+            'processing': 'bg-info',
+            'completed': 'bg-success',
+            'rejected': 'bg-danger',
+        }
+        return status_classes.get(self.status, 'bg-secondary')
+
+
+class ArchivedPayment(models.Model):
+    """Payment of an archived order (same id as the original)"""
+    id = models.BigIntegerField(primary_key=True)
+    payment_id = models.CharField(max_length=100, unique=True)
+    order = models.OneToOneField(ArchivedOrder, on_delete=models.CASCADE, related_name='payment')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_payments')
+    
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=3, default='INR')
+    payment_method = models.CharField(max_length=20, choices=Payment.PAYMENT_METHOD_CHOICES)
+    status = models.CharField(max_length=20, choices=Payment.STATUS_CHOICES)
+    
+    razorpay_order_id = models.CharField(max_length=100, blank=True, null=True)
+    razorpay_payment_id = models.CharField(max_length=100, blank=True, null=True)
+    razorpay_signature = models.CharField(max_length=200, blank=True, null=True)
+    
+    # Gateway settlement that paid this out, set by reconciliation
+    settlement_id = models.CharField(max_length=100, blank=True, null=True)
+    # Last reconciliation run that matched a settlement line to this payment
+    reconciliation_run = models.ForeignKey(
+        'ReconciliationRun', on_delete=models.SET_NULL, blank=True, null=True, related_name='+', editable=False,
+    )
+    
+    payment_response = models.JSONField(blank=True, null=True)
+    failure_reason = models.TextField(blank=True, null=True)
+    notes = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    paid_at = models.DateTimeField(blank=True, null=True)
+    archived_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name = 'Archived Payment'
+        verbose_name_plural = 'Archived Payments'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Archived payment {self.payment_id}"
+
+
+class ArchivedRefund(models.Model):
+    """Refund of an archived payment (same id as the original)"""
+    id = models.BigIntegerField(primary_key=True)
+    payment = models.ForeignKey(ArchivedPayment, on_delete=models.CASCADE, related_name='refunds')
+    refund_id = models.CharField(max_length=100, unique=True)
+    
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    reason = models.TextField()
+    status = models.CharField(max_length=20, choices=Refund.STATUS_CHOICES)
+    razorpay_refund_id = models.CharField(max_length=100, blank=True, null=True)
+    
+    created_at = models.DateTimeField()
+    processed_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        verbose_name = 'Archived Refund'
+        verbose_name_plural = 'Archived Refunds'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Archived refund {self.refund_id}"
+
+
+class WebhookEvent(models.Model):
+    """Raw payment gateway webhook, stored as received.
+
+    Rows are only ever inserted by the endpoint; the processor fills in the
+    processing columns once. ``event_id`` is unique, so the gateway's
+    retries of an event are dropped at insert time.
+    """
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('ignored', 'Ignored'),
+        ('failed', 'Failed'),
+    ]
+    
+    event_id = models.CharField(max_length=100, unique=True)
+    event_type = models.CharField(max_length=50)
+    body = models.TextField()
+    received_at = models.DateTimeField(default=timezone.now)
+    
+    # Written by the processor
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    processed_at = models.DateTimeField(blank=True, null=True)
+    error = models.TextField(blank=True)
+    
+    class Meta:
+        verbose_name = 'Webhook Event'
+        verbose_name_plural = 'Webhook Events'
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['status', 'id'], name='payments_webhook_pending_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.event_type} {self.event_id}"
+
+
+class ReconciliationRun(models.Model):
+    """One reconciliation of a gateway settlement file against payments"""
+    source = models.CharField(max_length=255)
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    
+    lines = models.PositiveIntegerField(default=0)
+    matched = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    issue_count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = 'Reconciliation Run'
+        verbose_name_plural = 'Reconciliation Runs'
+        ordering = ['-started_at']
+    
+    def __str__(self):
+        return f"{self.source} ({self.started_at:%Y-%m-%d %H:%M})"
+
+
+class ReconciliationIssue(models.Model):
+    """A settlement line or payment that did not reconcile"""
+    
+    KIND_CHOICES = [
+        ('unknown_payment', 'Settled but no matching payment'),
+        ('amount_mismatch', 'Settled amount differs'),
+        ('status_mismatch', 'Settled but payment not completed'),
+        ('duplicate_settlement', 'Settled more than once'),
+        ('unsettled', 'Completed but not settled'),
+    ]
+    
+    run = models.ForeignKey(ReconciliationRun, on_delete=models.CASCADE, related_name='issues')
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    line_number = models.PositiveIntegerField(blank=True, null=True)
+    gateway_payment_id = models.CharField(max_length=100, blank=True)
+    # Our PAY- reference; payments may since have been archived
+    payment_ref = models.CharField(max_length=100, blank=True)
+    settlement_id = models.CharField(max_length=100, blank=True)
+    expected_amount = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True)
+    settled_amount = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True)
+    detail = models.CharField(max_length=255, blank=True)
+    
+    class Meta:
+        verbose_name = 'Reconciliation Issue'
+        verbose_name_plural = 'Reconciliation Issues'
+        ordering = ['run', 'id']
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.gateway_payment_id or self.payment_ref}"
+
+
+
+class PaymentSummaryVersion(models.Model):
+    """Bumped with every change to a user's payments; cached summaries are keyed on it"""
+    
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True,
+                                related_name='payment_summary_version')
+    version = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"Payment summary v{self.version} of {self.user_id}"
@@ -0,0 +1,185 @@
+import csv
+import io
+import json
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ArchivedPayment, Payment, ReconciliationIssue, ReconciliationRun
+
+SETTLED_STATUSES = ('completed', 'refunded')
+
+# Accepted column names, first match wins
+ID_COLUMNS = ('entity_id', 'payment_id', 'id')
+SETTLEMENT_COLUMNS = ('settlement_id', 'settlement_utr')
+
+LOOKUP_FIELDS = (
+    'id', 'payment_id', 'razorpay_payment_id', 'amount', 'status', 'settlement_id', 'reconciliation_run',
+)
+
+
+def _first(row, names):
+    for name in names:
+        if row.get(name):
+            return str(row[name]).strip()
+    return ''
+
+
+def read_settlement_rows(file, fmt='csv'):
+    """Yield ``(line_number, row)`` from a binary settlement file, one row at a time.
+
+    ``fmt`` is ``csv`` (with a header) or ``jsonl`` (one JSON object per line).
+    """
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    if fmt == 'jsonl':
+        for line_number, line in enumerate(text, start=1):
+            if line.strip():
+                yield line_number, json.loads(line)
+    else:
+        # Line 1 is the header
+        yield from enumerate(csv.DictReader(text), start=2)
+
+
+class SettlementLine:
+    __slots__ = ('line_number', 'gateway_id', 'amount', 'settlement_id')
+
+    def __init__(self, line_number, gateway_id, amount, settlement_id):
+        self.line_number = line_number
+        self.gateway_id = gateway_id
+        self.amount = amount
+        self.settlement_id = settlement_id
+
+
+def _parse(line_number, row, paise):
+    """A SettlementLine for payment rows; None for refunds, adjustments etc."""
+    if (row.get('type') or 'payment').strip().lower() != 'payment':
+        return None
+    try:
+        amount = Decimal(str(row.get('amount') or row.get('credit') or '').strip())
+    except InvalidOperation:
+        amount = None
+    if amount is not None and paise:
+        amount /= 100
+    return SettlementLine(line_number, _first(row, ID_COLUMNS), amount, _first(row, SETTLEMENT_COLUMNS))
+
+
+def _lookup(model, ids):
+    """``{gateway or PAY- id: payment values}`` for one batch, in one query"""
+    found = {}
+    for payment in model.objects.filter(
+        Q(razorpay_payment_id__in=ids) | Q(payment_id__in=ids)
+    ).values(*LOOKUP_FIELDS):
+        found[payment['payment_id']] = payment
+        if payment['razorpay_payment_id']:
+            found[payment['razorpay_payment_id']] = payment
+    return found
+
+
+def _issue(run, kind, line=None, payment=None, detail=''):
+    return ReconciliationIssue(
+        run=run, kind=kind, detail=detail,
+        line_number=line.line_number if line else None,
+        gateway_payment_id=(line.gateway_id if line else payment['razorpay_payment_id']) or '',
+        payment_ref=payment['payment_id'] if payment else '',
+        settlement_id=line.settlement_id if line else '',
+        expected_amount=payment['amount'] if payment else None,
+        settled_amount=line.amount if line else None,
+    )
+
+
+def reconcile_batch(run, lines):
+    """Match one batch of settlement lines: two lookups, then grouped writes.
+
+    Every matched payment is stamped with ``run``, so a payment settled twice
+    in one file is reported from the database however far apart its lines
+    are; only the current batch is held in memory.
+    """
+    ids = {line.gateway_id for line in lines if line.gateway_id}
+    payments = _lookup(Payment, ids)
+    archived = _lookup(ArchivedPayment, ids - payments.keys())
+
+    issues = []
+    stamp = {Payment: {}, ArchivedPayment: {}}  # model -> {fields to set: [pk, ...]}
+    matched = 0
+    for line in lines:
+        model = Payment if line.gateway_id in payments else ArchivedPayment
+        payment = payments.get(line.gateway_id) or archived.get(line.gateway_id)
+        if payment is None:
+            issues.append(_issue(run, 'unknown_payment', line))
+            continue
+        if payment['reconciliation_run'] == run.id:
+            # Matched earlier in this batch (line known) or in an earlier one
+            where = f"on line {payment['line_number']}" if 'line_number' in payment else 'earlier in this file'
+            issues.append(_issue(run, 'duplicate_settlement', line, payment, detail=f'Also settled {where}'))
+            continue
+        payment.update(reconciliation_run=run.id, line_number=line.line_number)
+        fields = () if payment['settlement_id'] else (('settlement_id', line.settlement_id or None),)
+        stamp[model].setdefault(fields, []).append(payment['id'])
+        if payment['settlement_id'] and payment['settlement_id'] != line.settlement_id:
+            issues.append(_issue(run, 'duplicate_settlement', line, payment,
+                                 detail=f"Already settled in {payment['settlement_id']}"))
+            continue
+        ok = True
+        if line.amount != payment['amount']:
+            issues.append(_issue(run, 'amount_mismatch', line, payment))
+            ok = False
+        if payment['status'] not in SETTLED_STATUSES:
+            issues.append(_issue(run, 'status_mismatch', line, payment,
+                                 detail=f"Payment is {payment['status']}"))
+            ok = False
+        matched += ok
+
+    for model, groups in stamp.items():
+        for fields, pks in groups.items():
+            model.objects.filter(id__in=pks).update(reconciliation_run=run, **dict(fields))
+    ReconciliationIssue.objects.bulk_create(issues)
+    return matched, len(issues)
+
+
+def report_unsettled(run, older_than_days=3, chunk_size=2000):
+    """Record completed gateway payments still unsettled after the settlement lag"""
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    unsettled = (
+        Payment.objects.filter(status='completed', settlement_id__isnull=True, paid_at__lt=cutoff)
+        .exclude(payment_method='cod')
+        .order_by('id').values(*LOOKUP_FIELDS)
+    )
+    count = 0
+    rows = unsettled.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = [_issue(run, 'unsettled', payment=payment) for payment in islice(rows, chunk_size)]
+        if not chunk:
+            return count
+        ReconciliationIssue.objects.bulk_create(chunk)
+        count += len(chunk)
+
+
+def reconcile(file, source, fmt='csv', batch_size=2000, paise=False, unsettled_after_days=3):
+    """Reconcile a settlement file against payments and write the issues found.
+
+    The file is streamed and matched ``batch_size`` lines at a time, so
+    memory stays flat however large it is. Matched payments get the run
+    and the line's settlement_id; completed payments left without one after
+    ``unsettled_after_days`` are reported as unsettled. Returns the run.
+    """
+    run = ReconciliationRun.objects.create(source=source)
+    rows = read_settlement_rows(file, fmt)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        run.lines += len(batch)
+        parsed = [_parse(line_number, row, paise) for line_number, row in batch]
+        settlement_lines = [line for line in parsed if line is not None]
+        run.skipped += len(batch) - len(settlement_lines)
+        matched, issues = reconcile_batch(run, settlement_lines)
+        run.matched += matched
+        run.issue_count += issues
+
+    run.issue_count += report_unsettled(run, unsettled_after_days)
+    run.finished_at = timezone.now()
+    run.save()
+    return run
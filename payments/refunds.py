@@ -0,0 +1,170 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ecommerce.backoff import retry_delay
+from .gateway import CircuitOpen, GatewayRejected, GatewayUnavailable, get_client
+from .history import invalidate_payment_summaries
+from .models import Payment, Refund
+
+logger = logging.getLogger(__name__)
+
+
+class RefundStats:
+    """Running totals of a refund worker"""
+
+    def __init__(self):
+        self.claimed = 0
+        self.completed = 0
+        self.awaiting_gateway = 0  # accepted, completed later by the refund.processed webhook
+        self.rejected = 0
+        self.retried = 0
+        self.started = time.monotonic()
+
+    @property
+    def per_second(self):
+        elapsed = time.monotonic() - self.started
+        return self.claimed / elapsed if elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f'{self.claimed} claimed, {self.completed} completed, {self.awaiting_gateway} awaiting gateway, '
+            f'{self.rejected} rejected, {self.retried} retried ({self.per_second:.1f}/s)'
+        )
+
+
+def claim_refunds(batch_size=50):
+    """Move up to ``batch_size`` due gateway refunds from pending to processing.
+
+    Same claim as the outbox: rows are picked with SKIP LOCKED where
+    available and the conditional ``status='pending'`` UPDATE makes the claim
+    exclusive. Refunds of payments that never went through the gateway (COD)
+    are left for staff to settle by hand.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        due = (
+            Refund.objects.filter(status='pending', available_at__lte=now)
+            .exclude(payment__razorpay_payment_id__isnull=True)
+            .exclude(payment__razorpay_payment_id='')
+            .order_by('id')
+        )
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True, of=('self',))
+        ids = list(due.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return []
+        Refund.objects.filter(id__in=ids, status='pending').update(status='processing', locked_at=now)
+    return list(
+        Refund.objects.filter(id__in=ids, status='processing', locked_at=now).select_related('payment')
+    )
+
+
+def requeue_stale(lease_seconds=300):
+    """Return refunds whose worker died before reaching the gateway to the queue.
+
+    Calling the gateway again is safe: the refund id is the idempotency key.
+    """
+    cutoff = timezone.now() - timedelta(seconds=lease_seconds)
+    return Refund.objects.filter(status='processing', locked_at__lt=cutoff).update(
+        status='pending', locked_at=None,
+    )
+
+
+def _call_gateway(client, refund):
+    """Runs on a worker thread; only talks to the gateway, never the database"""
+    try:
+        return refund, client.refund(
+            refund.payment.razorpay_payment_id, int(refund.amount * 100), receipt=refund.refund_id,
+        )
+    except Exception as e:
+        return refund, e
+
+
+def process_batch(executor, client, stats, batch_size=50, max_attempts=5):
+    """Claim one batch, refund it through the gateway in parallel and record the outcomes.
+
+    Returns the number of refunds claimed.
+    """
+    refunds = claim_refunds(batch_size)
+    if not refunds:
+        return 0
+    stats.claimed += len(refunds)
+    now = timezone.now()
+    done, refunded_payments = [], []
+    for refund, result in executor.map(lambda refund: _call_gateway(client, refund), refunds):
+        refund.locked_at = None
+        if isinstance(result, dict):
+            refund.razorpay_refund_id = result.get('id')
+            refund.attempts += 1
+            refund.last_error = ''
+            if result.get('status') == 'processed':
+                refund.status = 'completed'
+                refund.processed_at = now
+                refunded_payments.append(refund.payment_id)
+                stats.completed += 1
+            else:
+                stats.awaiting_gateway += 1
+        elif isinstance(result, CircuitOpen):
+            # Never reached the gateway, so it does not count as an attempt
+            refund.status = 'pending'
+            refund.available_at = now + timedelta(seconds=client.breaker.reset_timeout)
+            stats.retried += 1
+        elif isinstance(result, GatewayUnavailable):
+            refund.attempts += 1
+            refund.last_error = str(result)
+            if refund.attempts >= max_attempts:
+                logger.error('Refund %s gave up after %s attempts: %s', refund.refund_id, refund.attempts, result)
+                refund.status = 'rejected'
+                refund.processed_at = now
+                stats.rejected += 1
+            else:
+                refund.status = 'pending'
+                refund.available_at = now + timedelta(seconds=retry_delay(refund.attempts, base=30))
+                stats.retried += 1
+        else:
+            if not isinstance(result, GatewayRejected):
+                logger.exception('Refund %s failed', refund.refund_id, exc_info=result)
+            refund.attempts += 1
+            refund.last_error = str(result)
+            refund.status = 'rejected'
+            refund.processed_at = now
+            stats.rejected += 1
+        done.append(refund)
+
+    with transaction.atomic():
+        Refund.objects.bulk_update(done, [
+            'status', 'razorpay_refund_id', 'attempts', 'available_at', 'locked_at', 'last_error', 'processed_at',
+        ])
+        mark_payments_refunded(refunded_payments)
+    return len(refunds)
+
+
+def mark_payments_refunded(payment_ids):
+    payments = Payment.objects.filter(id__in=payment_ids, status='completed')
+    invalidate_payment_summaries(payments.values_list('user_id', flat=True))
+    return payments.update(status='refunded', updated_at=timezone.now())
+
+
+def run_refunds(concurrency=8, batch_size=50, max_attempts=5, once=False, poll_interval=5.0,
+                lease_seconds=300, client=None):
+    """Process pending refunds forever, or until none is due when ``once`` is set.
+
+    At most ``concurrency`` gateway calls are in flight at a time. Returns
+    the RefundStats of the run.
+    """
+    client = client or get_client()
+    stats = RefundStats()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='refunds') as executor:
+        while True:
+            requeue_stale(lease_seconds)
+            if process_batch(executor, client, stats, batch_size, max_attempts):
+                logger.info('Refunds: %s', stats)
+                continue
+            if once:
+                return stats
+            time.sleep(poll_interval)
@@ -1,3 +1,353 @@
-from django.test import TestCase
+import os
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from orders.cancellation import cancel_orders
+from orders.models import Order
+from .fake_gateway import FakeGateway
+from .gateway import CircuitBreaker, GatewayClient, GatewayRejected, GatewayUnavailable
+from .history import get_payment_summary
+from .mock_gateway import MockGatewayServer
+from .models import Payment, PaymentSummaryVersion, ReconciliationIssue, ReconciliationRun, Refund, WebhookEvent
+from .refunds import mark_payments_refunded, run_refunds
+from .webhooks import process_pending
+
+User = get_user_model()
+
+SECRET = 'test-webhook-secret'
+
+
+@override_settings(RAZORPAY_WEBHOOK_SECRET=SECRET)
+class PaymentWebhookTests(TestCase):
+
+    def setUp(self):
+        self.gateway = FakeGateway(SECRET)
+        user = User.objects.create_user('alice', email='alice@example.com', password='secret')
+        self.order = Order.objects.create(
+            user=user, subtotal=500, total_amount=500, payment_method='razorpay',
+            full_name='Alice', phone='9999999999', email='alice@example.com',
+            address_line1='1 Main Road', city='Pune', state='Maharashtra', pincode='411001',
+        )
+
+    def test_rejects_bad_signature(self):
+        delivery = self.gateway.payment_captured(self.order)
+        response = self.gateway.deliver(self.client, delivery, signature='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_redelivery_is_stored_once(self):
+        delivery = self.gateway.payment_captured(self.order)
+        for _ in range(3):
+            self.assertEqual(self.gateway.deliver(self.client, delivery).status_code, 200)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+    def test_endpoint_does_not_touch_the_order(self):
+        self.gateway.deliver(self.client, self.gateway.payment_captured(self.order))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'pending')
+
+    def test_captured_payment_completes_order(self):
+        self.gateway.deliver(self.client, self.gateway.payment_captured(self.order, payment_id='pay_1'))
+        self.assertEqual(process_pending(), 1)
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.payment_status), ('processing', 'completed'))
+        payment = Payment.objects.get(order=self.order)
+        self.assertEqual((payment.status, payment.razorpay_payment_id), ('completed', 'pay_1'))
+        self.assertEqual(WebhookEvent.objects.get().status, 'processed')
+
+    def test_late_failure_does_not_undo_payment(self):
+        self.gateway.deliver(self.client, self.gateway.payment_captured(self.order))
+        self.gateway.deliver(self.client, self.gateway.payment_failed(self.order))
+        process_pending()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'completed')
+        self.assertEqual(Payment.objects.get(order=self.order).status, 'completed')
+
+    def test_payment_for_cancelled_order_is_flagged(self):
+        cancel_orders([self.order.id])
+        self.gateway.deliver(self.client, self.gateway.payment_captured(self.order, payment_id='pay_test'))
+        process_pending()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'cancelled')
+        event = WebhookEvent.objects.get()
+        self.assertEqual(event.status, 'failed')
+        self.assertIn('refund', event.error)
+        # The capture is kept and its refund queued, rather than rolled back with the event
+        payment = Payment.objects.get(order=self.order)
+        self.assertEqual((payment.status, payment.razorpay_payment_id), ('completed', 'pay_test'))
+        refund = Refund.objects.get(payment=payment)
+        self.assertEqual((refund.status, refund.amount), ('pending', payment.amount))
+
+    def test_amount_mismatch_is_flagged(self):
+        self.gateway.deliver(self.client, self.gateway.payment_captured(self.order, amount=100))
+        process_pending()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'pending')
+        self.assertEqual(WebhookEvent.objects.get().status, 'failed')
+        payment = Payment.objects.get(order=self.order)
+        self.assertEqual((payment.status, payment.amount), ('completed', 1))
+
+
+class GatewayClientTests(SimpleTestCase):
+
+    def setUp(self):
+        self.gateway = MockGatewayServer().start()
+        self.addCleanup(self.gateway.stop)
+
+    def client_for(self, **kwargs):
+        kwargs.setdefault('backoff', 0.01)
+        return GatewayClient(self.gateway.url, 'key', 'secret', **kwargs)
+
+    def test_idempotent_call_is_retried(self):
+        payment_id = self.gateway.add_payment(50000)
+        self.gateway.fail_next(2, 503)
+        payment = self.client_for(retries=2).fetch_payment(payment_id)
+        self.assertEqual(payment['amount'], 50000)
+        self.assertEqual(len(self.gateway.requests), 3)
+
+    def test_unkeyed_post_is_not_retried(self):
+        self.gateway.fail_next(1, 500)
+        client = self.client_for(retries=2)
+        with self.assertRaises(GatewayUnavailable):
+            client.request('POST', '/v1/orders', {'amount': 100})
+        self.assertEqual(len(self.gateway.requests), 1)
+
+    def test_keyed_post_is_retried_once_applied(self):
+        self.gateway.fail_next(1, 502)
+        client = self.client_for(retries=1)
+        first = client.create_order(50000, receipt='ORD-1')
+        again = client.create_order(50000, receipt='ORD-1')
+        self.assertEqual(first['id'], again['id'])
+
+    def test_rejection_is_not_retried(self):
+        with self.assertRaises(GatewayRejected) as raised:
+            self.client_for(retries=2).fetch_payment('pay_missing')
+        self.assertEqual(raised.exception.status_code, 404)
+        self.assertEqual(len(self.gateway.requests), 1)
+
+    def test_read_timeout_fails_fast(self):
+        self.gateway.latency = 1
+        client = self.client_for(timeout=(1, 0.1), retries=0)
+        started = time.monotonic()
+        with self.assertRaises(GatewayUnavailable):
+            client.create_order(100, receipt='ORD-2')
+        self.assertLess(time.monotonic() - started, 0.9)
+
+    def test_breaker_opens_and_recovers(self):
+        client = self.client_for(retries=0, breaker=CircuitBreaker(failure_threshold=3, reset_timeout=0.2))
+        self.gateway.down = True
+        for _ in range(3):
+            with self.assertRaises(GatewayUnavailable):
+                client.fetch_payment('pay_1')
+        with self.assertRaises(GatewayUnavailable):
+            client.fetch_payment('pay_1')
+        self.assertEqual(len(self.gateway.requests), 3)
+        self.assertEqual(client.breaker.state, 'open')
+
+        self.gateway.down = False
+        time.sleep(0.25)
+        payment_id = self.gateway.add_payment(100)
+        client.fetch_payment(payment_id)
+        self.assertEqual(client.breaker.state, 'closed')
+
+    def test_unexpected_error_frees_the_trial_call(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        client = self.client_for(retries=0, breaker=breaker)
+        with mock.patch.object(client.session, 'request', side_effect=ValueError('bad response')):
+            with self.assertRaises(ValueError):
+                client.fetch_payment('pay_1')
+        payment_id = self.gateway.add_payment(100)
+        client.fetch_payment(payment_id)
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_connections_are_reused(self):
+        payment_id = self.gateway.add_payment(100)
+        client = self.client_for()
+        for _ in range(20):
+            client.fetch_payment(payment_id)
+        self.assertEqual(self.gateway.connections, 1)
+
+
+class RefundProcessorTests(TestCase):
+
+    def setUp(self):
+        self.gateway = MockGatewayServer().start()
+        self.addCleanup(self.gateway.stop)
+        self.gateway_client = GatewayClient(self.gateway.url, retries=0, backoff=0.01)
+        user = User.objects.create_user('bob', email='bob@example.com', password='secret')
+        order = Order.objects.create(
+            user=user, subtotal=500, total_amount=500, payment_method='razorpay',
+            full_name='Bob', phone='9999999999', email='bob@example.com',
+            address_line1='1 Main Road', city='Pune', state='Maharashtra', pincode='411001',
+        )
+        self.payment = Payment.objects.create(
+            order=order, user=user, amount=500, payment_method='razorpay', status='completed',
+            razorpay_payment_id=self.gateway.add_payment(50000),
+        )
+        self.refund = Refund.objects.create(payment=self.payment, amount=500, reason='Damaged')
+
+    def test_duplicate_open_refund_is_blocked(self):
+        with self.assertRaises(IntegrityError):
+            Refund.objects.create(payment=self.payment, amount=500, reason='Again')
+
+    def test_refund_completes_payment(self):
+        stats = run_refunds(once=True, client=self.gateway_client)
+        self.refund.refresh_from_db()
+        self.payment.refresh_from_db()
+        self.assertEqual(self.refund.status, 'completed')
+        self.assertIsNotNone(self.refund.processed_at)
+        self.assertTrue(self.refund.razorpay_refund_id)
+        self.assertEqual(self.payment.status, 'refunded')
+        self.assertEqual(stats.completed, 1)
+
+    def test_outage_is_retried_later(self):
+        self.gateway.down = True
+        stats = run_refunds(once=True, client=self.gateway_client)
+        self.refund.refresh_from_db()
+        self.assertEqual(self.refund.status, 'pending')
+        self.assertEqual(self.refund.attempts, 1)
+        self.assertGreater(self.refund.available_at, self.refund.created_at)
+        self.assertEqual(stats.retried, 1)
+
+    def test_gateway_rejection_is_final(self):
+        Refund.objects.filter(id=self.refund.id).update(amount=900)
+        run_refunds(once=True, client=self.gateway_client)
+        self.refund.refresh_from_db()
+        self.assertEqual(self.refund.status, 'rejected')
+        self.assertIn('400', self.refund.last_error)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'completed')
+
+    def test_refund_updates_cached_summary(self):
+        cache.clear()
+        self.assertEqual(get_payment_summary(self.payment.user_id)['refunded'], 0)
+        run_refunds(once=True, client=self.gateway_client)
+        summary = get_payment_summary(self.payment.user_id)
+        self.assertEqual(summary['refunded'], 500)
+        self.assertEqual(summary['net'], 0)
+
+    def test_summary_version_is_bumped_with_the_payment(self):
+        cache.clear()
+        get_payment_summary(self.payment.user_id)
+        version = PaymentSummaryVersion.objects.get(user_id=self.payment.user_id).version
+        # e.g. a rolled back webhook: neither the change nor the bump is kept
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            mark_payments_refunded([self.payment.id])
+            raise RuntimeError
+        self.assertEqual(get_payment_summary(self.payment.user_id)['refunded'], 0)
+        self.assertEqual(PaymentSummaryVersion.objects.get(user_id=self.payment.user_id).version, version)
+
+        mark_payments_refunded([self.payment.id])
+        self.assertEqual(get_payment_summary(self.payment.user_id)['refunded'], 500)
+
+
+class PaymentHistoryTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('dave', email='dave@example.com', password='secret')
+        self.client.force_login(self.user)
+
+    def add_payments(self, count):
+        for _ in range(count):
+            order = Order.objects.create(
+                user=self.user, subtotal=100, total_amount=100, payment_method='razorpay',
+                full_name='Dave', phone='9999999999', email='dave@example.com',
+                address_line1='1 Main Road', city='Pune', state='Maharashtra', pincode='411001',
+            )
+            Payment.objects.create(order=order, user=self.user, amount=100, payment_method='razorpay',
+                                   status='completed')
+
+    def test_queries_do_not_grow_with_history(self):
+        url = reverse('payments:payment_history')
+        self.add_payments(2)
+        cache.clear()
+        # Session, user and cart, plus the view's three: the page, the summary
+        # version and, on a cache miss, the summary
+        with self.assertNumQueries(6):
+            self.client.get(url)
+        with self.assertNumQueries(5):
+            self.client.get(url)
+
+        self.add_payments(30)
+        cache.clear()
+        with self.assertNumQueries(6):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['payments'].object_list), 20)
+        self.assertEqual(response.context['summary']['count'], 32)
+
+
+class ReconcileSettlementsTests(TestCase):
+
+    SETTLEMENT = (
+        'type,entity_id,amount,settlement_id\n'
+        'payment,pay_a,500,setl_1\n'
+        'payment,pay_b,250,setl_1\n'
+        'refund,rfnd_a,500,setl_1\n'
+        'payment,pay_a,500,setl_1\n'
+        'payment,pay_unknown,100,setl_1\n'
+    )
+
+    def setUp(self):
+        user = User.objects.create_user('carol', email='carol@example.com', password='secret')
+        self.payments = {}
+        for gateway_id, amount in [('pay_a', 500), ('pay_b', 300)]:
+            order = Order.objects.create(
+                user=user, subtotal=amount, total_amount=amount, payment_method='razorpay',
+                full_name='Carol', phone='9999999999', email='carol@example.com',
+                address_line1='1 Main Road', city='Pune', state='Maharashtra', pincode='411001',
+            )
+            self.payments[gateway_id] = Payment.objects.create(
+                order=order, user=user, amount=amount, payment_method='razorpay', status='completed',
+                razorpay_payment_id=gateway_id,
+            )
+
+    def reconcile(self, batch_size):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write(self.SETTLEMENT)
+        self.addCleanup(os.remove, file.name)
+        out = StringIO()
+        call_command('reconcile_settlements', file.name, '--batch-size', str(batch_size), stdout=out)
+        return ReconciliationRun.objects.latest('id'), out.getvalue()
+
+    def assert_reconciled(self, batch_size, duplicate_detail):
+        run, output = self.reconcile(batch_size)
+        self.assertEqual((run.lines, run.matched, run.skipped, run.issue_count), (5, 1, 1, 3))
+        self.assertIn('5 line(s), 1 matched, 1 skipped, 3 issue(s)', output)
+        issues = dict(ReconciliationIssue.objects.filter(run=run).values_list('line_number', 'kind'))
+        self.assertEqual(issues, {3: 'amount_mismatch', 5: 'duplicate_settlement', 6: 'unknown_payment'})
+        self.assertEqual(ReconciliationIssue.objects.get(kind='duplicate_settlement').detail, duplicate_detail)
+        for payment in self.payments.values():
+            payment.refresh_from_db()
+            self.assertEqual((payment.settlement_id, payment.reconciliation_run), ('setl_1', run))
+
+    def test_repeat_in_one_batch_is_flagged(self):
+        self.assert_reconciled(batch_size=10, duplicate_detail='Also settled on line 2')
+
+    def test_repeat_across_batches_is_flagged(self):
+        # Lines 2 and 5 fall in different batches; the run stamp catches the repeat
+        self.assert_reconciled(batch_size=2, duplicate_detail='Also settled earlier in this file')
+
+    def test_a_later_run_is_not_a_repeat(self):
+        first, _ = self.reconcile(batch_size=2)
+        run, _ = self.reconcile(batch_size=2)
+        self.assertNotEqual(run, first)
+        self.assertEqual((run.matched, run.issue_count), (first.matched, first.issue_count))
+
+    def test_payment_settled_by_another_file_is_flagged(self):
+        Payment.objects.filter(razorpay_payment_id='pay_a').update(settlement_id='setl_0')
+        run, _ = self.reconcile(batch_size=10)
+        details = list(
+            ReconciliationIssue.objects.filter(run=run, kind='duplicate_settlement')
+            .order_by('line_number').values_list('line_number', 'detail')
+        )
+        self.assertEqual(details, [(2, 'Already settled in setl_0'), (5, 'Also settled on line 2')])
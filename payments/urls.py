@@ -16,6 +16,7 @@ urlpatterns = [
     
     # Payment History
     path('history/', views.payment_history, name='payment_history'),
+    path('history/refunds/', views.refund_history, name='refund_history'),
     
     # Refund
     path('refund/<str:payment_id>/', views.request_refund, name='request_refund'),
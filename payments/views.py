@@ -4,17 +4,25 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.http import HttpResponse, JsonResponse, HttpResponseBadRequest
+from django.views.decorators.http import require_POST
 from django.conf import settings
+from django.db import IntegrityError, transaction
 from django.utils import timezone
-#import razorpay
+import hashlib
 import json
 
+from .gateway import GatewayError, gateway_configured, get_client
+from .history import get_payment_summary
 from .models import Payment, Refund
+from .webhooks import record_event, verify_signature
 from orders.models import Order
+from orders.transitions import InvalidTransition, transition
+from cart.models import Cart
+from cart.reservations import release_cart
+from ecommerce.pagination import paginate_by_cursor
 
-# Initialize Razorpay Client
-#razorpay_client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
+PAYMENTS_PER_PAGE = 20
 
 
 @login_required
@@ -22,6 +30,10 @@ def initiate_payment(request, order_number):
     """Initiate Razorpay payment"""
     order = get_object_or_404(Order, order_number=order_number, user=request.user)
     
+    if order.status == 'cancelled':
+        messages.error(request, 'This order has been cancelled.')
+        return redirect('orders:order_detail', order_number=order.order_number)
+    
     # Check if order already has a completed payment
     if hasattr(order, 'payment') and order.payment.status == 'completed':
         messages.error(request, 'Payment already completed for this order.')
@@ -42,22 +54,52 @@ def initiate_payment(request, order_number):
         payment.status = 'pending'
         payment.save()
         
-        order.payment_status = 'pending'
-        order.save()
+        if order.payment_status == 'failed':
+            try:
+                transition(order, payment_status='pending')
+            except InvalidTransition:
+                messages.error(request, 'This order can no longer be paid.')
+                return redirect('orders:order_detail', order_number=order.order_number)
         
         messages.success(request, 'Order placed successfully! Pay on delivery.')
         return redirect('orders:order_confirmation', order_number=order.order_number)
     # For online payments - redirect to configured payment gateway
-    messages.info(request, 'Online payment integration will be added soon. Please use COD.')
-    return redirect('orders:order_detail', order_number=order.order_number)
-        
+    if not gateway_configured():
+        messages.info(request, 'Online payment integration will be added soon. Please use COD.')
+        return redirect('orders:order_detail', order_number=order.order_number)
 
+    if not payment.razorpay_order_id:
+        try:
+            gateway_order = get_client().create_order(
+                int(order.total_amount * 100), receipt=order.order_number,
+            )
+        except GatewayError:
+            messages.error(request, 'The payment gateway is not responding. Please try again shortly or choose COD.')
+            return redirect('orders:order_detail', order_number=order.order_number)
+        payment.razorpay_order_id = gateway_order['id']
+        payment.save(update_fields=['razorpay_order_id', 'updated_at'])
+    return redirect('orders:razorpay_dummy', order_number=order.order_number)
 
 
 @csrf_exempt
+@require_POST
 def payment_callback(request):
-    """Handle payment callback"""
-    return HttpResponseBadRequest('payment gateway not configured')
+    """Gateway webhook: verify, store and acknowledge.
+
+    Nothing else happens here, so gateway retries and bursts never wait on
+    order updates; process_payment_webhooks applies the stored events.
+    """
+    body = request.body
+    if not verify_signature(body, request.headers.get('X-Razorpay-Signature', '')):
+        return HttpResponseBadRequest('invalid signature')
+    try:
+        event_type = json.loads(body)['event']
+        text = body.decode()
+    except (ValueError, KeyError, TypeError):
+        return HttpResponseBadRequest('malformed event')
+    event_id = request.headers.get('X-Razorpay-Event-Id') or hashlib.sha256(body).hexdigest()
+    record_event(event_id, event_type, text)
+    return HttpResponse(status=200)
 
 
 @login_required
@@ -75,16 +117,40 @@ def payment_success(request, payment_id):
 @login_required
 def payment_failure(request):
     """Payment failure page"""
+    # Give held stock back to other shoppers
+    for cart in Cart.objects.filter(user=request.user):
+        release_cart(cart)
     return render(request, 'payments/payment_failure.html')
 
 
 @login_required
 def payment_history(request):
     """User's payment history"""
+    # Three queries per page however long the history: the page of payments
+    # with their orders, the summary version, and the totals on a cache miss
     payments = Payment.objects.filter(user=request.user).select_related('order')
+    page = paginate_by_cursor(payments, request.GET.get('cursor'), per_page=PAYMENTS_PER_PAGE)
+    
+    context = {
+        'payments': page,
+        'page': page,
+        'summary': get_payment_summary(request.user.id),
+        'active_tab': 'payments',
+    }
+    return render(request, 'payments/payment_history.html', context)
+
+
+@login_required
+def refund_history(request):
+    """User's refund requests"""
+    refunds = Refund.objects.filter(payment__user=request.user).select_related('payment__order')
+    page = paginate_by_cursor(refunds, request.GET.get('cursor'), per_page=PAYMENTS_PER_PAGE)
     
     context = {
-        'payments': payments,
+        'refunds': page,
+        'page': page,
+        'summary': get_payment_summary(request.user.id),
+        'active_tab': 'refunds',
     }
     return render(request, 'payments/payment_history.html', context)
 
@@ -105,12 +171,17 @@ def request_refund(request, payment_id):
             messages.error(request, 'Please provide a reason for refund.')
             return redirect('orders:order_detail', order_number=payment.order.order_number)
         
-        # Create refund request
-        refund = Refund.objects.create(
-            payment=payment,
-            amount=payment.amount,
-            reason=reason,
-        )
+        # Create refund request; process_refunds sends it to the gateway
+        try:
+            with transaction.atomic():
+                Refund.objects.create(
+                    payment=payment,
+                    amount=payment.amount,
+                    reason=reason,
+                )
+        except IntegrityError:
+            messages.info(request, 'A refund for this payment is already being processed.')
+            return redirect('orders:order_detail', order_number=payment.order.order_number)
         
         messages.success(request, 'Refund request submitted successfully. We will process it within 5-7 business days.')
         return redirect('orders:order_detail', order_number=payment.order.order_number)
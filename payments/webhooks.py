@@ -0,0 +1,206 @@
+import hashlib
+import hmac
+import json
+import logging
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from orders.models import Order
+from orders.transitions import InvalidTransition, transition
+from .history import invalidate_payment_summaries
+from .models import Payment, Refund, WebhookEvent
+from .refunds import mark_payments_refunded
+
+logger = logging.getLogger(__name__)
+
+# event_type -> handler taking the decoded event
+_handlers = {}
+
+
+class WebhookError(Exception):
+    """An event that cannot be applied; it is marked failed for a person to look at.
+
+    With ``keep_changes`` what the handler wrote before raising is committed,
+    e.g. a captured payment that still has to be refunded.
+    """
+
+    def __init__(self, message, keep_changes=False):
+        super().__init__(message)
+        self.keep_changes = keep_changes
+
+
+def handles(*event_types):
+    def decorator(func):
+        for event_type in event_types:
+            _handlers[event_type] = func
+        return func
+    return decorator
+
+
+def sign(body, secret):
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(body, signature, secret=None):
+    """Check the gateway's HMAC-SHA256 of the raw request body"""
+    secret = settings.RAZORPAY_WEBHOOK_SECRET if secret is None else secret
+    if not secret or not signature:
+        return False
+    return hmac.compare_digest(sign(body, secret), signature)
+
+
+def record_event(event_id, event_type, body):
+    """Store a verified event with one INSERT; redeliveries are silently dropped"""
+    WebhookEvent.objects.bulk_create(
+        [WebhookEvent(event_id=event_id, event_type=event_type, body=body)],
+        ignore_conflicts=True,
+    )
+
+
+def process_event(event):
+    """Apply one stored event and record the outcome"""
+    handler = _handlers.get(event.event_type)
+    status, error = 'processed', ''
+    try:
+        if handler is None:
+            status = 'ignored'
+        else:
+            with transaction.atomic():
+                try:
+                    handler(json.loads(event.body))
+                except WebhookError as e:
+                    if not e.keep_changes:
+                        raise
+                    status, error = 'failed', str(e)
+    except WebhookError as e:
+        status, error = 'failed', str(e)
+    except Exception as e:
+        logger.exception('Webhook event %s failed', event.event_id)
+        status, error = 'failed', repr(e)
+    WebhookEvent.objects.filter(id=event.id).update(
+        status=status, error=error, processed_at=timezone.now(),
+    )
+    return status
+
+
+def process_pending(batch_size=500):
+    """Apply pending events in arrival order. Returns how many were handled.
+
+    Run a single processor: events are applied strictly in id order.
+    """
+    events = list(WebhookEvent.objects.filter(status='pending').order_by('id')[:batch_size])
+    for event in events:
+        process_event(event)
+    return len(events)
+
+
+def _payment_entity(data):
+    try:
+        return data['payload']['payment']['entity']
+    except (KeyError, TypeError):
+        raise WebhookError('Event has no payment entity')
+
+
+def _order_for(entity):
+    number = (entity.get('notes') or {}).get('order_number')
+    order = None
+    if number:
+        order = Order.objects.filter(order_number=number).first()
+    elif entity.get('order_id'):
+        order = Order.objects.filter(payment__razorpay_order_id=entity['order_id']).first()
+    if order is None:
+        raise WebhookError(f"No order for payment {entity.get('id')}")
+    return order
+
+
+def _payment_for(order, entity):
+    payment, _ = Payment.objects.get_or_create(
+        order=order,
+        defaults={
+            'user_id': order.user_id,
+            'amount': order.total_amount,
+            'payment_method': 'razorpay',
+            'razorpay_order_id': entity.get('order_id'),
+        },
+    )
+    return payment
+
+
+@handles('payment.authorized')
+def payment_authorized(data):
+    entity = _payment_entity(data)
+    payment = _payment_for(_order_for(entity), entity)
+    Payment.objects.filter(id=payment.id, status='pending').update(
+        status='processing', razorpay_payment_id=entity['id'], updated_at=timezone.now(),
+    )
+    invalidate_payment_summaries([payment.user_id])
+
+
+@handles('payment.captured', 'order.paid')
+def payment_captured(data):
+    entity = _payment_entity(data)
+    order = _order_for(entity)
+    if not isinstance(entity.get('amount'), int) or not entity.get('id'):
+        raise WebhookError('Payment entity has no id or amount')
+    captured = Decimal(entity['amount']) / 100
+    payment = _payment_for(order, entity)
+    # The money was taken whatever happens to the order, so the capture is
+    # always recorded; it is what a refund is made against
+    now = timezone.now()
+    Payment.objects.filter(id=payment.id).exclude(status__in=['completed', 'refunded']).update(
+        status='completed', amount=captured, razorpay_payment_id=entity['id'], payment_response=entity,
+        paid_at=now, updated_at=now,
+    )
+    invalidate_payment_summaries([payment.user_id])
+    if captured != order.total_amount:
+        raise WebhookError(
+            f'Captured {captured} does not match order {order.order_number} ({order.total_amount}); '
+            'the payment is recorded for staff to settle or refund.',
+            keep_changes=True,
+        )
+    try:
+        transition(order, status='processing', payment_status='completed', payment_id=entity['id'])
+    except InvalidTransition as e:
+        if order.payment_status != 'completed':
+            # e.g. the order was cancelled before the money arrived
+            _queue_refund(payment, captured, f'Order {order.order_number} was {order.status} when paid')
+            raise WebhookError(f'{e} A refund of the captured payment has been queued.', keep_changes=True)
+
+
+def _queue_refund(payment, amount, reason):
+    """Queue a refund for process_refunds unless the payment already has one open"""
+    try:
+        with transaction.atomic():
+            Refund.objects.create(payment=payment, amount=amount, reason=reason)
+    except IntegrityError:
+        pass
+
+
+@handles('payment.failed')
+def payment_failed(data):
+    entity = _payment_entity(data)
+    order = _order_for(entity)
+    payment = _payment_for(order, entity)
+    Payment.objects.filter(id=payment.id, status__in=['pending', 'processing']).update(
+        status='failed', failure_reason=entity.get('error_description') or '', updated_at=timezone.now(),
+    )
+    invalidate_payment_summaries([payment.user_id])
+    try:
+        transition(order, payment_status='failed')
+    except InvalidTransition:
+        pass  # a late failure of an earlier attempt; the order was paid since
+
+
+@handles('refund.processed')
+def refund_processed(data):
+    try:
+        entity = data['payload']['refund']['entity']
+    except (KeyError, TypeError):
+        raise WebhookError('Event has no refund entity')
+    refunds = Refund.objects.filter(razorpay_refund_id=entity['id']).exclude(status='completed')
+    payment_ids = list(refunds.values_list('payment_id', flat=True))
+    refunds.update(status='completed', processed_at=timezone.now(), locked_at=None)
+    mark_payments_refunded(payment_ids)
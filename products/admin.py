@@ -16,6 +16,7 @@ class CategoryAdmin(admin.ModelAdmin):
 class SubCategoryAdmin(admin.ModelAdmin):
     list_display = ['name', 'category', 'slug', 'is_active', 'created_at']
     list_filter = ['category', 'is_active', 'created_at']
+    list_select_related = ['category']
     search_fields = ['name', 'description']
     prepopulated_fields = {'slug': ('name',)}
     list_editable = ['is_active']
@@ -74,12 +75,16 @@ class ProductAdmin(admin.ModelAdmin):
     inlines = [ProductImageInline, ProductVariantInline]
     
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('category', 'subcategory', 'brand')
+        # SubCategory.__str__ renders its parent category name
+        return super().get_queryset(request).select_related(
+            'category', 'subcategory__category', 'brand'
+        )
 
 @admin.register(ProductImage)
 class ProductImageAdmin(admin.ModelAdmin):
     list_display = ['product', 'image', 'is_primary', 'created_at']
     list_filter = ['is_primary', 'created_at']
+    list_select_related = ['product']
     search_fields = ['product__name', 'alt_text']
 
 @admin.register(ProductVariant)
@@ -87,4 +92,5 @@ class ProductVariantAdmin(admin.ModelAdmin):
     list_display = ['product', 'variant_type', 'variant_value', 'price_adjustment', 
                     'stock_quantity', 'is_available']
     list_filter = ['variant_type', 'is_available']
+    list_select_related = ['product']
     search_fields = ['product__name', 'variant_value']
\ No newline at end of file
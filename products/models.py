@@ -1,9 +1,28 @@
 
 # Create your models here.
+from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
 from django.utils.text import slugify
 from django.urls import reverse
-from django.db.models import Avg
+from django.db.models import Case, F, Q, When
+
+
+def final_price_expression(prefix=''):
+    """Database expression equivalent of Product.get_final_price()
+
+    ``prefix`` is the lookup path to the product, e.g. ``'product__'`` when
+    annotating cart or order items.
+    """
+    return Case(
+        When(
+            Q(**{f'{prefix}discount_price__gt': 0})
+            & Q(**{f'{prefix}discount_price__lt': F(f'{prefix}price')}),
+            then=F(f'{prefix}discount_price'),
+        ),
+        default=F(f'{prefix}price'),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+    )
+
 
 class Category(models.Model):
     """Main Product Categories"""
@@ -158,24 +177,32 @@ class Product(models.Model):
         """Check if product is in stock"""
         return self.stock_quantity > 0
     
+    def get_rating_summary(self):
+        """The review histogram (reviews.ProductRating), None before the first review.
+
+        Select it with ``select_related('rating_summary')`` when listing products.
+        """
+        try:
+            return self.rating_summary
+        except ObjectDoesNotExist:
+            return None
+    
     def get_average_rating(self):
         """Get average rating from reviews"""
-        reviews = self.reviews.filter(is_approved=True)
-        if reviews.exists():
-            return round(reviews.aggregate(models.Avg('rating'))['rating__avg'], 1)
-        return 0
+        summary = self.get_rating_summary()
+        return summary.average if summary else 0
     
     def get_review_count(self):
         """Get total number of approved reviews"""
-        return self.reviews.filter(is_approved=True).count()
+        summary = self.get_rating_summary()
+        return summary.review_count if summary else 0
         
 
     def average_rating(self):
-        avg = self.reviews.filter(is_approved=True).aggregate(Avg('rating'))['rating__avg']
-        return round(avg or 0, 1)
+        return self.get_average_rating()
     
     def rating_count(self):
-        return self.reviews.filter(is_approved=True).count()
+        return self.get_review_count()
 
 class ProductImage(models.Model):
     """Product Images - Multiple images per product"""
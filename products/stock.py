@@ -0,0 +1,69 @@
+from django.db import models, transaction
+from django.db.models import Case, F, Q, When
+
+from .models import Product
+
+
+class InsufficientStock(Exception):
+    """Raised when a cart asks for more units than are available to sell"""
+
+    def __init__(self, shortages):
+        # ``shortages`` is (product_id, name, units available) per short product
+        self.available = {product_id: available for product_id, _, available in shortages}
+        self.product_ids = list(self.available)
+        names = ', '.join(f'{name} ({available} left)' for _, name, available in shortages)
+        super().__init__(f"Not enough stock for: {names}")
+
+
+class _ShortStock(Exception):
+    pass
+
+
+def decrement_stock(quantities):
+    """Take ``{product_id: quantity}`` units out of stock in one statement.
+
+    The UPDATE only matches rows that still have enough stock, so concurrent
+    checkouts cannot oversell or drive ``stock_quantity`` negative. If any
+    product is short nothing is changed and InsufficientStock is raised; call
+    it inside the order's transaction so the whole order rolls back.
+    """
+    if not quantities:
+        return
+
+    condition = Q()
+    for product_id, quantity in quantities.items():
+        condition |= Q(id=product_id, stock_quantity__gte=quantity)
+
+    try:
+        with transaction.atomic():
+            updated = Product.objects.filter(condition).update(
+                stock_quantity=Case(
+                    *[When(id=product_id, then=F('stock_quantity') - quantity)
+                      for product_id, quantity in quantities.items()],
+                    output_field=models.PositiveIntegerField(),
+                )
+            )
+            if updated != len(quantities):
+                raise _ShortStock
+    except _ShortStock:
+        rows = Product.objects.filter(id__in=quantities).values_list('id', 'name', 'stock_quantity')
+        stock = {pid: (name, available) for pid, name, available in rows}
+        shortages = []
+        for pid, quantity in quantities.items():
+            name, available = stock.get(pid, ('', 0))
+            if available < quantity:
+                shortages.append((pid, name, available))
+        raise InsufficientStock(shortages)
+
+
+def restore_stock(quantities):
+    """Put ``{product_id: quantity}`` units back into stock in one statement"""
+    if not quantities:
+        return 0
+    return Product.objects.filter(id__in=quantities).update(
+        stock_quantity=Case(
+            *[When(id=product_id, then=F('stock_quantity') + quantity)
+              for product_id, quantity in quantities.items()],
+            output_field=models.PositiveIntegerField(),
+        )
+    )
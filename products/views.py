@@ -5,11 +5,14 @@ from django.db.models import Q, Avg, Count
 from django.core.paginator import Paginator
 from .models import Category, SubCategory, Brand, Product, ProductImage
 from products.models import Product
+from reviews.forms import ReviewForm
 from reviews.models import Review
+from reviews.views import get_review_page
+from cart.reservations import available_quantity
 
 def home_view(request):
     """Home page view."""
-    featured_products = Product.objects.filter(is_featured=True,is_available=True).select_related('category').prefetch_related('images')[:8]
+    featured_products = Product.objects.filter(is_featured=True,is_available=True).select_related('category', 'rating_summary').prefetch_related('images')[:8]
     print(f"Featured Products count: {featured_products.count()}")
     context = {
         'featured_products': featured_products,
@@ -19,7 +22,7 @@ def home_view(request):
 def product_list(request):
     """Display all products with filters"""
     products = Product.objects.filter(is_available=True).select_related(
-        'category', 'subcategory', 'brand'
+        'category', 'subcategory', 'brand', 'rating_summary'
     ).prefetch_related('images')
     
     # Get filter parameters
@@ -85,7 +88,7 @@ def product_list(request):
 def product_detail(request, slug):
     """Display single product details"""
     product = get_object_or_404(
-        Product.objects.select_related('category', 'subcategory', 'brand')
+        Product.objects.select_related('category', 'subcategory', 'brand', 'rating_summary')
         .prefetch_related('images', 'variants'),
         slug=slug,
         is_available=True
@@ -107,11 +110,25 @@ def product_detail(request, slug):
     # Get product variants
     product_variants = product.variants.filter(is_available=True)
     
+    # Reviews: one page of them; the rating breakdown is the precomputed histogram
+    review_page, review_sort = get_review_page(
+        product, request.GET.get('review_sort'), request.GET.get('review_cursor'),
+    )
+    can_review = (
+        request.user.is_authenticated
+        and not Review.objects.filter(product=product, user=request.user).exists()
+    )
+    
     context = {
         'product': product,
+        'available_stock': available_quantity(product),
         'product_images': product_images,
         'product_variants': product_variants,
         'related_products': related_products,
+        'rating_summary': product.get_rating_summary(),
+        'review_page': review_page,
+        'review_sort': review_sort,
+        'review_form': ReviewForm() if can_review else None,
     }
     
     return render(request, 'products/product_detail.html', context)
@@ -124,7 +141,7 @@ def category_products(request, slug):
     products = Product.objects.filter(
         category=category,
         is_available=True
-    ).select_related('category', 'subcategory', 'brand').prefetch_related('images')
+    ).select_related('category', 'subcategory', 'brand', 'rating_summary').prefetch_related('images')
     
     # Get subcategories for this category
     subcategories = category.subcategories.filter(is_active=True)
@@ -171,7 +188,7 @@ def search_products(request):
             Q(category__name__icontains=query) |
             Q(brand__name__icontains=query),
             is_available=True
-        ).select_related('category', 'brand').prefetch_related('images')
+        ).select_related('category', 'brand', 'rating_summary').prefetch_related('images')
     else:
         products = Product.objects.none()
     
@@ -0,0 +1,20 @@
+from django.contrib import admin
+from .models import Promotion, PromotionRedemption
+
+
+@admin.register(Promotion)
+class PromotionAdmin(admin.ModelAdmin):
+    list_display = ['name', 'code', 'kind', 'value', 'category', 'brand', 'times_used',
+                    'usage_limit', 'starts_at', 'ends_at', 'is_active']
+    list_filter = ['kind', 'is_active', 'category', 'brand']
+    list_select_related = ['category', 'brand']
+    search_fields = ['name', 'code']
+    readonly_fields = ['times_used']
+
+
+@admin.register(PromotionRedemption)
+class PromotionRedemptionAdmin(admin.ModelAdmin):
+    list_display = ['promotion', 'user', 'order', 'amount', 'created_at']
+    list_select_related = ['promotion', 'user', 'order']
+    search_fields = ['promotion__code', 'promotion__name', 'order__order_number', 'user__username']
+    readonly_fields = ['promotion', 'user', 'order', 'slot', 'amount']
@@ -0,0 +1,295 @@
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, PositiveIntegerField, Q, When
+from django.utils import timezone
+
+from ecommerce.rule_cache import CompiledRules
+from .models import Promotion, PromotionRedemption
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+
+class PromotionUnavailable(Exception):
+    """Raised when a promotion's usage limit is reached before the order could redeem it"""
+
+    def __init__(self, promotion):
+        self.promotion = promotion
+        super().__init__(f'The offer "{promotion.name}" is no longer available.')
+
+
+def _allocate(total, amounts):
+    """Split ``total`` over ``{category_id: amount}`` in proportion, to the paisa"""
+    base = sum(amounts.values(), ZERO)
+    shares = {}
+    left = total
+    items = list(amounts.items())
+    for category_id, amount in items[:-1]:
+        share = (total * amount / base).quantize(CENT, rounding=ROUND_HALF_UP)
+        shares[category_id] = share
+        left -= share
+    shares[items[-1][0]] = left
+    return shares
+
+
+class CompiledPromotion:
+    """A promotion reduced to plain attributes, evaluated without the database.
+
+    Lines are ``(category_id, brand_id, unit_price, quantity)`` tuples.
+    """
+
+    def __init__(self, promotion):
+        self.id = promotion.id
+        self.name = promotion.name
+        self.code = promotion.code
+        self.kind = promotion.kind
+        self.value = promotion.value
+        self.max_discount = promotion.max_discount
+        self.buy_quantity = promotion.buy_quantity
+        self.get_quantity = promotion.get_quantity
+        self.category_id = promotion.category_id
+        self.brand_id = promotion.brand_id
+        self.min_subtotal = promotion.min_subtotal
+        self.starts_at = promotion.starts_at
+        self.ends_at = promotion.ends_at
+        self.usage_limit = promotion.usage_limit
+        self.per_user_limit = promotion.per_user_limit
+
+    def is_running(self, now):
+        return ((self.starts_at is None or self.starts_at <= now)
+                and (self.ends_at is None or now < self.ends_at))
+
+    def in_scope(self, line):
+        return ((self.category_id is None or line[0] == self.category_id)
+                and (self.brand_id is None or line[1] == self.brand_id))
+
+    def discount(self, lines):
+        """``{category_id: amount}`` off the lines in scope; None if the cart does not qualify"""
+        scoped = [line for line in lines if self.in_scope(line)]
+        amounts = defaultdict(lambda: ZERO)
+        for category_id, _, price, quantity in scoped:
+            amounts[category_id] += price * quantity
+        subtotal = sum(amounts.values(), ZERO)
+        if not scoped or subtotal <= 0 or subtotal < self.min_subtotal:
+            return None
+
+        if self.kind == 'percent':
+            total = (subtotal * self.value / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+            if self.max_discount is not None:
+                total = min(total, self.max_discount)
+            return _allocate(total, amounts)
+        if self.kind == 'flat':
+            return _allocate(min(self.value, subtotal), amounts)
+
+        # Buy X get Y: one in every X + Y units is free, cheapest units first
+        units = sum(line[3] for line in scoped)
+        free = units // (self.buy_quantity + self.get_quantity) * self.get_quantity
+        if not free:
+            return None
+        off = defaultdict(lambda: ZERO)
+        for category_id, _, price, quantity in sorted(scoped, key=lambda line: line[2]):
+            taken = min(quantity, free)
+            off[category_id] += price * taken
+            free -= taken
+            if not free:
+                break
+        return dict(off)
+
+
+class AppliedPromotions:
+    """Promotions that apply to a cart and the discount they give"""
+
+    def __init__(self):
+        self.promotions = []  # (CompiledPromotion, amount)
+        self.by_category = defaultdict(lambda: ZERO)
+        self.discount = ZERO
+        self.coupon = None
+        self.coupon_error = None
+
+    def add(self, promotion, shares, line_amounts):
+        # Stacked promotions never take a category below zero
+        amount = ZERO
+        for category_id, share in shares.items():
+            share = min(share, line_amounts[category_id] - self.by_category[category_id])
+            if share > 0:
+                self.by_category[category_id] += share
+                amount += share
+        if amount > 0:
+            self.promotions.append((promotion, amount))
+            self.discount += amount
+        return amount
+
+
+class PromotionSet:
+    """Running and upcoming promotions, indexed for cart evaluation.
+
+    Automatic promotions are bucketed by scope so a cart only evaluates the
+    ones that can match its categories and brands.
+    """
+
+    def __init__(self, promotions):
+        self.by_code = {}
+        self.unscoped = []
+        self.by_category = defaultdict(list)
+        self.by_brand = defaultdict(list)
+        for promotion in promotions:
+            compiled = CompiledPromotion(promotion)
+            if compiled.code:
+                self.by_code[compiled.code] = compiled
+            elif compiled.category_id is not None:
+                self.by_category[compiled.category_id].append(compiled)
+            elif compiled.brand_id is not None:
+                self.by_brand[compiled.brand_id].append(compiled)
+            else:
+                self.unscoped.append(compiled)
+
+    def find(self, code):
+        return self.by_code.get((code or '').strip().upper())
+
+    def candidates(self, lines, code=None, now=None):
+        """Promotions worth evaluating for ``lines``: automatic ones in scope, then the coupon"""
+        now = now or timezone.now()
+        found = {promotion.id: promotion for promotion in self.unscoped}
+        for category_id in {line[0] for line in lines}:
+            found.update((promotion.id, promotion) for promotion in self.by_category.get(category_id, ()))
+        for brand_id in {line[1] for line in lines}:
+            found.update((promotion.id, promotion) for promotion in self.by_brand.get(brand_id, ()))
+        candidates = [promotion for promotion in found.values() if promotion.is_running(now)]
+        coupon = self.find(code) if code else None
+        if coupon is not None and coupon.is_running(now):
+            candidates.append(coupon)
+        return candidates
+
+    def evaluate(self, lines, code=None, unavailable=(), now=None):
+        """Apply the automatic promotions and the coupon ``code`` to ``lines``.
+
+        ``unavailable`` holds ids of promotions the customer may not use any
+        more (limits reached); see ``unavailable_promotions``.
+        """
+        lines = list(lines)
+        line_amounts = defaultdict(lambda: ZERO)
+        for category_id, _, price, quantity in lines:
+            line_amounts[category_id] += price * quantity
+
+        result = AppliedPromotions()
+        coupon = None
+        for promotion in self.candidates(lines, code, now):
+            if promotion.code:
+                coupon = promotion
+                continue
+            if promotion.id not in unavailable:
+                shares = promotion.discount(lines)
+                if shares:
+                    result.add(promotion, shares, line_amounts)
+
+        if code:
+            if coupon is None:
+                result.coupon_error = 'This coupon code is not valid.'
+            elif coupon.id in unavailable:
+                result.coupon_error = 'This coupon has already been used up.'
+            else:
+                shares = coupon.discount(lines)
+                if not shares:
+                    result.coupon_error = 'Your cart does not qualify for this coupon.'
+                elif result.add(coupon, shares, line_amounts):
+                    result.coupon = coupon
+        return result
+
+
+def _build_promotion_set():
+    now = timezone.now()
+    return PromotionSet(
+        Promotion.objects.filter(is_active=True).exclude(ends_at__lte=now)
+    )
+
+
+_rules = CompiledRules(_build_promotion_set, Promotion)
+
+
+def get_promotion_set():
+    """The compiled promotions, rebuilt when a promotion is edited"""
+    return _rules.get()
+
+
+def unavailable_promotions(promotions, user):
+    """Ids of ``promotions`` whose global or per-user limit is used up.
+
+    Usage changes with every order, so it is read here rather than compiled
+    in; promotions without limits cost no query.
+    """
+    limited = [promotion.id for promotion in promotions if promotion.usage_limit is not None]
+    per_user = {promotion.id: promotion.per_user_limit for promotion in promotions
+                if promotion.per_user_limit is not None}
+    unavailable = set()
+    if limited:
+        unavailable.update(Promotion.objects.filter(
+            id__in=limited, times_used__gte=F('usage_limit'),
+        ).values_list('id', flat=True))
+    if per_user and user.is_authenticated:
+        used = PromotionRedemption.objects.filter(promotion_id__in=per_user, user=user) \
+            .values('promotion_id').annotate(uses=Count('id')).values_list('promotion_id', 'uses')
+        unavailable.update(pid for pid, uses in used if uses >= per_user[pid])
+    return unavailable
+
+
+def apply_to_cart(items, user, code=None):
+    """Evaluate promotions for cart items (with their products loaded)"""
+    lines = [
+        (item.product.category_id, item.product.brand_id, item.product.get_final_price(), item.quantity)
+        for item in items
+    ]
+    promotion_set = get_promotion_set()
+    now = timezone.now()
+    unavailable = unavailable_promotions(promotion_set.candidates(lines, code, now), user)
+    return promotion_set.evaluate(lines, code, unavailable, now)
+
+
+def _free_slot(promotion, user):
+    taken = set(PromotionRedemption.objects.filter(
+        promotion_id=promotion.id, user=user, slot__isnull=False,
+    ).values_list('slot', flat=True))
+    return min((slot for slot in range(1, promotion.per_user_limit + 1) if slot not in taken), default=None)
+
+
+def redeem(applied, order):
+    """Record the order's use of each applied promotion.
+
+    The global counter only moves with a conditional UPDATE, so concurrent
+    checkouts can never take more than ``usage_limit`` uses; per-user limits
+    are held by the redemption slot constraint. Call it inside the order's
+    transaction: PromotionUnavailable rolls the whole order back.
+    """
+    within_limit = Q(usage_limit__isnull=True) | Q(times_used__lt=F('usage_limit'))
+    for promotion, amount in applied.promotions:
+        if not Promotion.objects.filter(within_limit, id=promotion.id).update(times_used=F('times_used') + 1):
+            raise PromotionUnavailable(promotion)
+        slot = None
+        if promotion.per_user_limit is not None:
+            slot = _free_slot(promotion, order.user)
+            if slot is None:
+                raise PromotionUnavailable(promotion)
+        try:
+            with transaction.atomic():
+                PromotionRedemption.objects.create(
+                    promotion_id=promotion.id, user=order.user, order=order, slot=slot, amount=amount,
+                )
+        except IntegrityError:
+            # A concurrent checkout by the same customer took the slot
+            raise PromotionUnavailable(promotion)
+
+
+def release_redemptions(order_ids):
+    """Give the uses of cancelled orders back to their promotions"""
+    redemptions = PromotionRedemption.objects.filter(order_id__in=order_ids)
+    uses = dict(redemptions.order_by().values('promotion_id').annotate(uses=Count('id'))
+                .values_list('promotion_id', 'uses'))
+    if not uses:
+        return 0
+    Promotion.objects.filter(id__in=uses).update(times_used=Case(
+        *[When(id=promotion_id, then=F('times_used') - count) for promotion_id, count in uses.items()],
+        output_field=PositiveIntegerField(),
+    ))
+    redemptions.delete()
+    return sum(uses.values())
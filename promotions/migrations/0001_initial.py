@@ -0,0 +1,67 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('products', '0001_initial'),
+        ('orders', '0009_order_discount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Promotion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('code', models.CharField(blank=True, help_text='Leave blank to apply automatically', max_length=50, null=True, unique=True)),
+                ('kind', models.CharField(choices=[('percent', 'Percentage off'), ('flat', 'Flat amount off'), ('bxgy', 'Buy X get Y free')], default='percent', max_length=10)),
+                ('value', models.DecimalField(decimal_places=2, default=0, help_text='Percent for percentage promotions, amount for flat ones', max_digits=10)),
+                ('max_discount', models.DecimalField(blank=True, decimal_places=2, help_text='Cap for percentage promotions', max_digits=10, null=True)),
+                ('buy_quantity', models.PositiveIntegerField(default=0)),
+                ('get_quantity', models.PositiveIntegerField(default=0)),
+                ('min_subtotal', models.DecimalField(decimal_places=2, default=0, help_text='Minimum value of the lines in scope', max_digits=10)),
+                ('starts_at', models.DateTimeField(blank=True, null=True)),
+                ('ends_at', models.DateTimeField(blank=True, null=True)),
+                ('usage_limit', models.PositiveIntegerField(blank=True, help_text='Total redemptions allowed', null=True)),
+                ('per_user_limit', models.PositiveIntegerField(blank=True, null=True)),
+                ('times_used', models.PositiveIntegerField(default=0, editable=False)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('brand', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.brand')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.category')),
+            ],
+            options={
+                'verbose_name': 'Promotion',
+                'verbose_name_plural': 'Promotions',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PromotionRedemption',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.PositiveIntegerField(blank=True, editable=False, null=True)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='redemptions', to='orders.order')),
+                ('promotion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='redemptions', to='promotions.promotion')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='promotion_redemptions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='promotionredemption',
+            constraint=models.UniqueConstraint(condition=models.Q(('slot__isnull', False)), fields=('promotion', 'user', 'slot'), name='promotions_one_redemption_per_slot'),
+        ),
+    ]
@@ -0,0 +1,108 @@
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.utils import timezone
+from accounts.models import User
+from orders.models import Order
+from products.models import Brand, Category
+
+
+class Promotion(models.Model):
+    """Coupon or automatic promotion.
+
+    Promotions without a code apply to every qualifying cart; coupons apply
+    once their code is entered. Scope (category and/or brand) limits the
+    lines the discount is computed on.
+    """
+    KIND_CHOICES = (
+        ('percent', 'Percentage off'),
+        ('flat', 'Flat amount off'),
+        ('bxgy', 'Buy X get Y free'),
+    )
+    
+    name = models.CharField(max_length=200)
+    code = models.CharField(max_length=50, unique=True, blank=True, null=True,
+                            help_text='Leave blank to apply automatically')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default='percent')
+    value = models.DecimalField(max_digits=10, decimal_places=2, default=0,
+                                help_text='Percent for percentage promotions, amount for flat ones')
+    max_discount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                       help_text='Cap for percentage promotions')
+    buy_quantity = models.PositiveIntegerField(default=0)
+    get_quantity = models.PositiveIntegerField(default=0)
+    
+    # Scope
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    brand = models.ForeignKey(Brand, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    min_subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0,
+                                       help_text='Minimum value of the lines in scope')
+    
+    # Validity and limits
+    starts_at = models.DateTimeField(null=True, blank=True)
+    ends_at = models.DateTimeField(null=True, blank=True)
+    usage_limit = models.PositiveIntegerField(null=True, blank=True, help_text='Total redemptions allowed')
+    per_user_limit = models.PositiveIntegerField(null=True, blank=True)
+    times_used = models.PositiveIntegerField(default=0, editable=False)
+    is_active = models.BooleanField(default=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Promotion'
+        verbose_name_plural = 'Promotions'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return self.code or self.name
+    
+    def save(self, *args, **kwargs):
+        if self.code:
+            self.code = self.code.strip().upper()
+        else:
+            self.code = None
+        super().save(*args, **kwargs)
+    
+    def clean(self):
+        if self.kind == 'bxgy' and not (self.buy_quantity and self.get_quantity):
+            raise ValidationError('Buy X get Y promotions need both quantities.')
+        if self.kind == 'percent' and not 0 < self.value <= 100:
+            raise ValidationError('Percentages must be between 0 and 100.')
+        if self.starts_at and self.ends_at and self.starts_at >= self.ends_at:
+            raise ValidationError('The promotion ends before it starts.')
+    
+    def is_running(self, now=None):
+        now = now or timezone.now()
+        return (self.is_active
+                and (self.starts_at is None or self.starts_at <= now)
+                and (self.ends_at is None or now < self.ends_at))
+
+
+class PromotionRedemption(models.Model):
+    """One use of a promotion by an order.
+
+    ``slot`` numbers a user's redemptions of a promotion with a per-user
+    limit; its unique constraint stops concurrent checkouts from both taking
+    the last one.
+    """
+    promotion = models.ForeignKey(Promotion, on_delete=models.CASCADE, related_name='redemptions')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='promotion_redemptions')
+    # Kept when the order is archived so per-user limits still count it
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True,
+                              related_name='redemptions')
+    slot = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['promotion', 'user', 'slot'],
+                condition=models.Q(slot__isnull=False),
+                name='promotions_one_redemption_per_slot',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.promotion} - {self.order_id}"
@@ -0,0 +1,43 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from orders.models import Order
+from .engine import AppliedPromotions, CompiledPromotion, PromotionUnavailable, redeem
+from .models import Promotion, PromotionRedemption
+
+User = get_user_model()
+
+
+class CouponRedemptionTests(TestCase):
+
+    def setUp(self):
+        self.coupon = Promotion.objects.create(
+            name='Launch', code='LAUNCH', kind='flat', value=50, usage_limit=1,
+        )
+
+    def make_order(self, username):
+        user = User.objects.create_user(username, email=f'{username}@example.com', password='secret')
+        return Order.objects.create(
+            user=user, subtotal=500, discount=50, total_amount=450, payment_method='cod',
+            full_name=username, phone='9999999999', email=f'{username}@example.com',
+            address_line1='1 Main Road', city='Pune', state='Maharashtra', pincode='411001',
+        )
+
+    def applied(self):
+        # As evaluated at checkout, before either order redeemed the coupon
+        applied = AppliedPromotions()
+        applied.promotions.append((CompiledPromotion(self.coupon), Decimal('50.00')))
+        return applied
+
+    def test_coupon_is_not_redeemed_past_its_limit(self):
+        first, second = self.applied(), self.applied()
+
+        redeem(first, self.make_order('alice'))
+        with self.assertRaises(PromotionUnavailable):
+            redeem(second, self.make_order('bob'))
+
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.times_used, 1)
+        self.assertEqual(PromotionRedemption.objects.count(), 1)
@@ -1,9 +1,80 @@
 from django.contrib import admin
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils import timezone
+from ecommerce.pagination import paginate_by_cursor
+from .duplicates import comment_signature, index_signatures
 from .models import Review
+from .moderation import moderate_reviews
+from .ratings import adjust_ratings, review_changes
+
+MODERATION_PAGE_SIZE = 100
 
 
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
-    list_display = ('product', 'user', 'rating', 'is_approved', 'created_at')
-    list_filter = ('rating', 'is_approved')
+    list_display = ('product', 'user', 'rating', 'is_approved', 'helpful_count', 'created_at', 'moderated_at', 'duplicate_of')
+    list_filter = (
+        'rating', 'is_approved', ('moderated_at', admin.EmptyFieldListFilter),
+        ('duplicate_of', admin.EmptyFieldListFilter),
+    )
+    list_select_related = ('product', 'user', 'duplicate_of__product', 'duplicate_of__user')
     search_fields = ('product__name', 'user__username')
+    readonly_fields = ('helpful_count', 'moderated_at', 'duplicate_of')
+    actions = ['approve_reviews', 'reject_reviews']
+
+    def _moderate(self, request, queryset, approve):
+        moderated, changed = moderate_reviews(queryset, approve)
+        verb = 'approved' if approve else 'rejected'
+        self.message_user(request, f'{moderated} review(s) {verb}, {changed} changed visibility.')
+
+    @admin.action(description='Approve selected reviews')
+    def approve_reviews(self, request, queryset):
+        self._moderate(request, queryset, True)
+
+    @admin.action(description='Reject selected reviews')
+    def reject_reviews(self, request, queryset):
+        self._moderate(request, queryset, False)
+
+    def save_model(self, request, obj, form, change):
+        # Approving, hiding or re-rating a review moves it in the product histogram
+        old = None
+        if change:
+            old = (form.initial['product'], form.initial['rating'], form.initial['is_approved'])
+        if 'is_approved' in form.changed_data:
+            obj.moderated_at = timezone.now()
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            if 'comment' in form.changed_data:
+                index_signatures({obj.id: comment_signature(obj.comment)})
+            adjust_ratings(review_changes(old, (obj.product_id, obj.rating, obj.is_approved)))
+
+    def get_urls(self):
+        return [
+            path('moderation/', self.admin_site.admin_view(self.moderation_queue_view),
+                 name='reviews_review_moderation'),
+        ] + super().get_urls()
+
+    def moderation_queue_view(self, request):
+        """Reviews no moderator has looked at yet, newest first, approved or rejected in bulk"""
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        if request.method == 'POST':
+            ids = request.POST.getlist('ids')
+            decision = request.POST.get('decision')
+            if ids and decision in ('approve', 'reject'):
+                self._moderate(request, Review.objects.filter(id__in=ids), decision == 'approve')
+            return redirect(reverse('admin:reviews_review_moderation'))
+
+        queue = Review.objects.filter(moderated_at__isnull=True).select_related('product', 'user', 'duplicate_of')
+        page = paginate_by_cursor(queue, request.GET.get('cursor'), per_page=MODERATION_PAGE_SIZE)
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Review Moderation Queue',
+            'opts': self.model._meta,
+            'page': page,
+        }
+        return TemplateResponse(request, 'admin/reviews/moderation_queue.html', context)
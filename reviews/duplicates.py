@@ -0,0 +1,264 @@
+"""Near-duplicate review detection with MinHash signatures and LSH banding.
+
+A comment's signature is the minimum of each of NUM_HASHES hash functions
+over its character shingles; two signatures agree at a position with
+probability equal to the Jaccard similarity of the shingle sets. The
+signature is cut into BANDS bands, each hashed to a bucket stored in
+ReviewSignatureBand, so near-duplicates are found by an indexed lookup of
+a review's buckets rather than by comparing it with every other review.
+"""
+import hashlib
+import random
+import re
+import struct
+import time
+import zlib
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .models import Review, ReviewSignature, ReviewSignatureBand
+from .ratings import rebuild_ratings
+
+try:
+    import numpy as np
+except ImportError:  # batch signatures are then computed one review at a time
+    np = None
+
+# Changing any of these invalidates stored signatures; run scan_duplicate_reviews after
+NUM_HASHES = 120
+BANDS = 20  # of 6 rows: pairs from about 0.6 similarity share a bucket
+ROWS = NUM_HASHES // BANDS
+SHINGLE_SIZE = 5
+MIN_SHINGLES = 40  # shorter comments ("Great product!") repeat innocently and are not compared
+
+# Earliest reviews of each bucket compared with a new one, so a large
+# ring of copies costs no more to check against than a small one
+MAX_CANDIDATES = 50
+
+# Buckets per query, within every backend's parameter limit
+QUERY_CHUNK_SIZE = 900
+
+# Shingles hashed at once with numpy, at NUM_HASHES * 8 bytes each (about 19MB)
+SIGNATURE_CHUNK_SHINGLES = 20000
+
+_PRIME = (1 << 61) - 1
+_MASK = 0xFFFFFFFF
+_SIGNATURE_FORMAT = f'<{NUM_HASHES}I'
+_rng = random.Random(5381)
+# (a * x + b) mod p over 32-bit shingle hashes; a < 2**29 keeps a * x + b within uint64
+_COEFFICIENTS = [(_rng.randrange(1, 1 << 29), _rng.randrange(_PRIME)) for _ in range(NUM_HASHES)]
+
+
+def shingle_hashes(text):
+    """CRC32s of the distinct SHINGLE_SIZE-character runs of ``text``, ignoring case and punctuation"""
+    text = ' '.join(re.findall(r'\w+', text.lower())).encode()
+    return {zlib.crc32(text[i:i + SHINGLE_SIZE]) for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def _minhash(hashes):
+    return [min(((a * x + b) % _PRIME) & _MASK for x in hashes) for a, b in _COEFFICIENTS]
+
+
+def comment_signature(text):
+    """Packed MinHash signature of a comment, or None if it is too short to compare"""
+    hashes = shingle_hashes(text)
+    if len(hashes) < MIN_SHINGLES:
+        return None
+    return struct.pack(_SIGNATURE_FORMAT, *_minhash(hashes))
+
+
+def comment_signatures(texts):
+    """Signatures of many comments, as comment_signature gives them.
+
+    With numpy every hash function is applied to the shingles of many
+    comments at once, SIGNATURE_CHUNK_SHINGLES shingles at a time so memory
+    stays bounded however long the comments are.
+    """
+    shingles = [shingle_hashes(text) for text in texts]
+    usable = [i for i, hashes in enumerate(shingles) if len(hashes) >= MIN_SHINGLES]
+    result = [None] * len(texts)
+    if np is None:
+        for i in usable:
+            result[i] = struct.pack(_SIGNATURE_FORMAT, *_minhash(shingles[i]))
+        return result
+
+    chunk, size = [], 0
+    for i in usable:
+        if chunk and size + len(shingles[i]) > SIGNATURE_CHUNK_SHINGLES:
+            _sign_chunk(chunk, shingles, result)
+            chunk, size = [], 0
+        chunk.append(i)
+        size += len(shingles[i])
+    if chunk:
+        _sign_chunk(chunk, shingles, result)
+    return result
+
+
+def _sign_chunk(indexes, shingles, result):
+    flat = np.fromiter((x for i in indexes for x in shingles[i]), dtype=np.uint64)
+    offsets = np.cumsum([0] + [len(shingles[i]) for i in indexes[:-1]])
+    a = np.array([a for a, _ in _COEFFICIENTS], dtype=np.uint64)[:, None]
+    b = np.array([b for _, b in _COEFFICIENTS], dtype=np.uint64)[:, None]
+    values = ((a * flat + b) % np.uint64(_PRIME)) & np.uint64(_MASK)
+    minima = np.minimum.reduceat(values, offsets, axis=1).T.astype('<u4')
+    for i, row in zip(indexes, minima):
+        result[i] = row.tobytes()
+
+
+def band_buckets(signature):
+    """One signed 64-bit bucket per band; the band number is hashed in, so bands never share one"""
+    width = ROWS * 4
+    return [
+        int.from_bytes(
+            hashlib.blake2b(bytes([band]) + signature[band * width:(band + 1) * width], digest_size=8).digest(),
+            'little', signed=True,
+        )
+        for band in range(BANDS)
+    ]
+
+
+def similarity(signature, other):
+    """Estimated Jaccard similarity of the comments behind two signatures"""
+    pairs = zip(struct.unpack(_SIGNATURE_FORMAT, signature), struct.unpack(_SIGNATURE_FORMAT, bytes(other)))
+    return sum(x == y for x, y in pairs) / NUM_HASHES
+
+
+def index_signatures(signatures):
+    """Store ``{review_id: signature}``, replacing what those reviews had; None removes it"""
+    review_ids = list(signatures)
+    with transaction.atomic():
+        ReviewSignatureBand.objects.filter(review_id__in=review_ids).delete()
+        ReviewSignature.objects.filter(review_id__in=review_ids).delete()
+        ReviewSignature.objects.bulk_create([
+            ReviewSignature(review_id=review_id, signature=signature)
+            for review_id, signature in signatures.items() if signature
+        ])
+        ReviewSignatureBand.objects.bulk_create([
+            ReviewSignatureBand(review_id=review_id, bucket=bucket)
+            for review_id, signature in signatures.items() if signature
+            for bucket in band_buckets(signature)
+        ])
+
+
+def find_duplicates(signatures):
+    """The most similar earlier review for each ``{review_id: signature}``, if similar enough.
+
+    A review not saved yet uses the id None and may match any review.
+    Candidates are the first MAX_CANDIDATES reviews of each bucket, found
+    for the whole batch in a few indexed queries; those at or above
+    REVIEW_DUPLICATE_THRESHOLD are compared and the closest kept.
+    """
+    owners = defaultdict(set)  # bucket -> ids of the given reviews in it
+    for review_id, signature in signatures.items():
+        if signature:
+            for bucket in band_buckets(signature):
+                owners[bucket].add(review_id)
+
+    candidates = defaultdict(set)
+    buckets = list(owners)
+    for start in range(0, len(buckets), QUERY_CHUNK_SIZE):
+        rows = (
+            ReviewSignatureBand.objects.filter(bucket__in=buckets[start:start + QUERY_CHUNK_SIZE])
+            .annotate(position=Window(RowNumber(), partition_by=[F('bucket')], order_by=F('review_id').asc()))
+            .filter(position__lte=MAX_CANDIDATES)
+            .values_list('bucket', 'review_id')
+        )
+        for bucket, candidate_id in rows:
+            for review_id in owners[bucket]:
+                if review_id is None or candidate_id < review_id:
+                    candidates[review_id].add(candidate_id)
+
+    candidate_ids = sorted(set().union(*candidates.values()))
+    stored = {}
+    for start in range(0, len(candidate_ids), QUERY_CHUNK_SIZE):
+        stored.update(
+            ReviewSignature.objects.filter(review_id__in=candidate_ids[start:start + QUERY_CHUNK_SIZE])
+            .values_list('review_id', 'signature')
+        )
+
+    threshold = settings.REVIEW_DUPLICATE_THRESHOLD
+    duplicates = {}
+    for review_id, candidate_ids in candidates.items():
+        scored = [
+            (similarity(signatures[review_id], stored[candidate_id]), -candidate_id)
+            for candidate_id in candidate_ids if candidate_id in stored
+        ]
+        if scored:
+            score, candidate_id = max(scored)
+            if score >= threshold:
+                duplicates[review_id] = -candidate_id
+    return duplicates
+
+
+def find_duplicate(signature):
+    """The indexed review a comment about to be submitted nearly repeats, or None"""
+    if not signature:
+        return None
+    return find_duplicates({None: signature}).get(None)
+
+
+class ScanStats:
+    """Running totals of a duplicate scan"""
+
+    def __init__(self):
+        self.scanned = 0
+        self.indexed = 0
+        self.flagged = 0
+        self.held = 0
+        self.started = time.monotonic()
+
+    @property
+    def per_second(self):
+        elapsed = time.monotonic() - self.started
+        return self.scanned / elapsed if elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f'{self.scanned} scanned, {self.indexed} indexed, {self.flagged} flagged as duplicates, '
+            f'{self.held} held for moderation ({self.per_second:.0f}/s)'
+        )
+
+
+def scan_reviews(batch_size=500, hold=False, stats=None):
+    """Re-sign every review and flag each one that nearly repeats an earlier review.
+
+    Reviews are read in id order, ``batch_size`` at a time: a batch is
+    signed and indexed, then matched against everything indexed so far,
+    including itself. With ``hold``, flagged reviews no moderator has
+    decided on are hidden until one does.
+    """
+    stats = stats or ScanStats()
+    last_id = 0
+    while True:
+        batch = list(
+            Review.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'comment')[:batch_size]
+        )
+        if not batch:
+            return stats
+        last_id = batch[-1][0]
+        signatures = dict(zip([review_id for review_id, _ in batch], comment_signatures([c for _, c in batch])))
+        index_signatures(signatures)
+        stats.scanned += len(batch)
+        stats.indexed += sum(1 for signature in signatures.values() if signature)
+
+        duplicates = find_duplicates(signatures)
+        by_original = defaultdict(list)
+        for review_id, original_id in duplicates.items():
+            by_original[original_id].append(review_id)
+        with transaction.atomic():
+            # Comments edited since the last scan may no longer repeat anything
+            Review.objects.filter(id__in=list(signatures), duplicate_of__isnull=False).exclude(
+                id__in=list(duplicates)
+            ).update(duplicate_of=None)
+            for original_id, review_ids in by_original.items():
+                Review.objects.filter(id__in=review_ids).update(duplicate_of_id=original_id)
+            stats.flagged += len(duplicates)
+            if hold and duplicates:
+                held = Review.objects.filter(id__in=list(duplicates), is_approved=True, moderated_at__isnull=True)
+                product_ids = list(held.order_by().values_list('product_id', flat=True).distinct())
+                stats.held += held.update(is_approved=False)
+                rebuild_ratings(product_ids)
@@ -0,0 +1,19 @@
+from django import forms
+
+from .models import Review
+
+
+class ReviewForm(forms.ModelForm):
+    """Review submission form"""
+    rating = forms.TypedChoiceField(
+        choices=[(stars, f'{stars} star{"s" if stars > 1 else ""}') for stars in range(5, 0, -1)],
+        coerce=int,
+        widget=forms.Select(attrs={'class': 'form-select'}),
+    )
+
+    class Meta:
+        model = Review
+        fields = ['rating', 'comment']
+        widgets = {
+            'comment': forms.Textarea(attrs={'class': 'form-control', 'rows': 4, 'placeholder': 'Share your experience'}),
+        }
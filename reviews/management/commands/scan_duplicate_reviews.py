@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from reviews import duplicates
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the MinHash signatures of all reviews and flag near-duplicate comments. '
+        'Signatures are vectorised with numpy when it is installed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Reviews signed and matched at a time')
+        parser.add_argument('--hold', action='store_true', help='Hide unmoderated duplicates until a moderator decides')
+
+    def handle(self, *args, **options):
+        if duplicates.np is None:
+            self.stderr.write('numpy is not installed; signing one review at a time.')
+        stats = duplicates.scan_reviews(batch_size=options['batch_size'], hold=options['hold'])
+        self.stdout.write(f'Reviews: {stats}')
@@ -0,0 +1,83 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:23
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+
+STAR_FIELDS = {1: 'one_star', 2: 'two_star', 3: 'three_star', 4: 'four_star', 5: 'five_star'}
+
+
+def build_histograms(apps, schema_editor):
+    Review = apps.get_model('reviews', 'Review')
+    ProductRating = apps.get_model('reviews', 'ProductRating')
+    summaries = {}
+    for row in (
+        Review.objects.filter(is_approved=True).order_by()
+        .values('product_id', 'rating').annotate(count=Count('id'))
+    ):
+        summary = summaries.setdefault(row['product_id'], ProductRating(product_id=row['product_id']))
+        setattr(summary, STAR_FIELDS[row['rating']], row['count'])
+        summary.review_count += row['count']
+        summary.rating_total += row['rating'] * row['count']
+    ProductRating.objects.bulk_create(summaries.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('reviews', '0002_alter_review_rating'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRating',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_summary', serialize=False, to='products.product')),
+                ('one_star', models.PositiveIntegerField(default=0)),
+                ('two_star', models.PositiveIntegerField(default=0)),
+                ('three_star', models.PositiveIntegerField(default=0)),
+                ('four_star', models.PositiveIntegerField(default=0)),
+                ('five_star', models.PositiveIntegerField(default=0)),
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('rating_total', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReviewVote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='helpful_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', 'is_approved', '-created_at', '-id'], name='reviews_product_newest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', 'is_approved', '-helpful_count', '-id'], name='reviews_product_helpful_idx'),
+        ),
+        migrations.AddField(
+            model_name='reviewvote',
+            name='review',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='votes', to='reviews.review'),
+        ),
+        migrations.AddField(
+            model_name='reviewvote',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='review_votes', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='reviewvote',
+            unique_together={('review', 'user')},
+        ),
+        migrations.RunPython(build_histograms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0003_rating_histogram'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='moderated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(condition=models.Q(('moderated_at__isnull', True)), fields=['-created_at', '-id'], name='reviews_moderation_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0004_review_moderation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewSignature',
+            fields=[
+                ('review', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='signature', serialize=False, to='reviews.review')),
+                ('signature', models.BinaryField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='reviews.review'),
+        ),
+        migrations.CreateModel(
+            name='ReviewSignatureBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.BigIntegerField()),
+                ('review', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='signature_bands', to='reviews.review')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket', 'review'], name='reviews_signature_bucket_idx')],
+            },
+        ),
+    ]
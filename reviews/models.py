@@ -21,12 +21,89 @@ class Review(models.Model):
     rating = models.PositiveSmallIntegerField(default=1, validators=[MinValueValidator(1), MaxValueValidator(5)])
     comment = models.TextField(blank=True)
     is_approved = models.BooleanField(default=True)
+    helpful_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Set when a moderator approves or rejects the review; unset ones form the queue
+    moderated_at = models.DateTimeField(blank=True, null=True)
+    # Earlier review whose comment this one nearly repeats, as found by its MinHash signature
+    duplicate_of = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, blank=True, null=True, related_name='duplicates'
+    )
 
     class Meta:
         unique_together = ('product', 'user')
         ordering = ['-created_at']
+        indexes = [
+            # Product review pages, newest or most helpful first
+            models.Index(fields=['product', 'is_approved', '-created_at', '-id'], name='reviews_product_newest_idx'),
+            models.Index(fields=['product', 'is_approved', '-helpful_count', '-id'], name='reviews_product_helpful_idx'),
+            models.Index(
+                fields=['-created_at', '-id'], condition=models.Q(moderated_at__isnull=True),
+                name='reviews_moderation_queue_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.product.name} - {self.user} ({self.rating})"
 
+
+class ReviewVote(models.Model):
+    """A user finding a review helpful; one vote per user and review"""
+    review = models.ForeignKey(Review, on_delete=models.CASCADE, related_name='votes')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='review_votes')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('review', 'user')
+
+
+class ReviewSignature(models.Model):
+    """MinHash signature of a review's comment, one unsigned 32-bit value per hash function"""
+    review = models.OneToOneField(Review, on_delete=models.CASCADE, primary_key=True, related_name='signature')
+    signature = models.BinaryField()
+
+
+class ReviewSignatureBand(models.Model):
+    """One LSH band of a review's signature, hashed to a bucket.
+
+    Reviews sharing any bucket are near-duplicate candidates, so finding
+    them is an indexed lookup however many reviews there are.
+    """
+    review = models.ForeignKey(Review, on_delete=models.CASCADE, related_name='signature_bands')
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [models.Index(fields=['bucket', 'review'], name='reviews_signature_bucket_idx')]
+
+
+class ProductRating(models.Model):
+    """Star counts of a product's approved reviews, kept current as reviews change"""
+    STAR_FIELDS = {1: 'one_star', 2: 'two_star', 3: 'three_star', 4: 'four_star', 5: 'five_star'}
+
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='rating_summary')
+    one_star = models.PositiveIntegerField(default=0)
+    two_star = models.PositiveIntegerField(default=0)
+    three_star = models.PositiveIntegerField(default=0)
+    four_star = models.PositiveIntegerField(default=0)
+    five_star = models.PositiveIntegerField(default=0)
+    review_count = models.PositiveIntegerField(default=0)
+    rating_total = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.product} - {self.average} ({self.review_count})"
+
+    @property
+    def average(self):
+        if not self.review_count:
+            return 0
+        return round(self.rating_total / self.review_count, 1)
+
+    def histogram(self):
+        """(stars, count, percent) from five stars down"""
+        rows = []
+        for stars in range(5, 0, -1):
+            count = getattr(self, self.STAR_FIELDS[stars])
+            percent = round(count * 100 / self.review_count) if self.review_count else 0
+            rows.append((stars, count, percent))
+        return rows
+
@@ -0,0 +1,19 @@
+from django.db import transaction
+from django.utils import timezone
+
+from .ratings import rebuild_ratings
+
+
+def moderate_reviews(queryset, approve):
+    """Approve or reject every review in ``queryset`` with one UPDATE.
+
+    Only products whose visible reviews actually changed get their
+    histograms recounted, in grouped queries. Returns (moderated, changed).
+    """
+    with transaction.atomic():
+        changing = queryset.filter(is_approved=not approve)
+        product_ids = list(changing.order_by().values_list('product_id', flat=True).distinct())
+        changed = changing.count() if product_ids else 0
+        moderated = queryset.update(is_approved=approve, moderated_at=timezone.now())
+        rebuild_ratings(product_ids)
+    return moderated, changed
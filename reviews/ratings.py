@@ -0,0 +1,91 @@
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import ProductRating, Review
+
+
+def adjust_ratings(changes):
+    """Apply ``(product_id, rating, delta)`` changes to the product histograms.
+
+    ``delta`` is +1 for a review that became visible (submitted approved,
+    or approved later) and -1 for one that stopped being visible. Each
+    product costs one UPDATE of counters, so concurrent reviews never lose
+    counts.
+    """
+    per_product = defaultdict(lambda: defaultdict(int))
+    for product_id, rating, delta in changes:
+        if delta:
+            counts = per_product[product_id]
+            counts[ProductRating.STAR_FIELDS[rating]] += delta
+            counts['review_count'] += delta
+            counts['rating_total'] += rating * delta
+
+    with transaction.atomic():
+        for product_id, counts in per_product.items():
+            counts = {name: value for name, value in counts.items() if value}
+            if not counts:
+                continue
+            updates = {name: F(name) + value for name, value in counts.items()}
+            if ProductRating.objects.filter(product_id=product_id).update(**updates):
+                continue
+            if counts.get('review_count', 0) <= 0:
+                continue  # no histogram to take from, e.g. its product is being deleted
+            try:
+                with transaction.atomic():
+                    ProductRating.objects.create(product_id=product_id, **counts)
+            except IntegrityError:
+                # Created by a concurrent review since the UPDATE
+                ProductRating.objects.filter(product_id=product_id).update(**updates)
+
+
+def review_changes(old, new):
+    """Histogram changes for a review going from ``old`` to ``new``.
+
+    Both are ``(product_id, rating, is_approved)``; ``old`` is None for a
+    new review and ``new`` is None for a deleted one.
+    """
+    changes = []
+    if old and old[2]:
+        changes.append((old[0], old[1], -1))
+    if new and new[2]:
+        changes.append((new[0], new[1], 1))
+    return changes
+
+
+def rebuild_ratings(product_ids, chunk_size=500):
+    """Recount the histograms of ``product_ids`` from their reviews.
+
+    One grouped query and one upsert per ``chunk_size`` products. The
+    histogram rows are locked first, so a review submitted meanwhile adds
+    its vote after the recount instead of being lost in it.
+    """
+    product_ids = sorted(set(product_ids))
+    for start in range(0, len(product_ids), chunk_size):
+        chunk = product_ids[start:start + chunk_size]
+        with transaction.atomic():
+            list(ProductRating.objects.select_for_update().filter(product_id__in=chunk).values_list('pk'))
+            summaries = {product_id: ProductRating(product_id=product_id) for product_id in chunk}
+            for row in (
+                Review.objects.filter(product_id__in=chunk, is_approved=True).order_by()
+                .values('product_id', 'rating').annotate(count=Count('id'))
+            ):
+                summary = summaries[row['product_id']]
+                setattr(summary, ProductRating.STAR_FIELDS[row['rating']], row['count'])
+                summary.review_count += row['count']
+                summary.rating_total += row['rating'] * row['count']
+            ProductRating.objects.bulk_create(
+                summaries.values(),
+                update_conflicts=True,
+                unique_fields=['product'],
+                update_fields=[*ProductRating.STAR_FIELDS.values(), 'review_count', 'rating_total'],
+            )
+
+
+@receiver(post_delete, sender=Review)
+def _review_deleted(sender, instance, **kwargs):
+    # Covers admin deletes and cascades from products and users
+    adjust_ratings(review_changes((instance.product_id, instance.rating, instance.is_approved), None))
@@ -1,3 +1,278 @@
+from unittest import mock, skipUnless
+
+from django.contrib.messages import get_messages
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from products.models import Category, Product
+from . import duplicates
+from .duplicates import comment_signature, comment_signatures, find_duplicates, index_signatures, scan_reviews
+from .models import ProductRating, Review, ReviewVote
+from .moderation import moderate_reviews
+from .ratings import adjust_ratings, review_changes
+
+COMMENT = (
+    'Battery easily lasts two days with heavy use, the screen stays readable in '
+    'direct sunlight and the camera is far better than I expected for the price.'
+)
+OTHER_COMMENT = (
+    'Arrived a week late in a crushed box, the charger was missing and support '
+    'took five emails to agree to a replacement, which has not shipped yet.'
+)
+
+
+def make_user(username, **kwargs):
+    return User.objects.create_user(username, email=f'{username}@example.com', password='secret', **kwargs)
+
+
+class ReviewTestCase(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Phones')
+        self.product = Product.objects.create(
+            name='Phone', description='A phone', category=category, price=100, stock_quantity=3,
+        )
+        self.alice = make_user('alice')
+
+    def review(self, user, rating, is_approved=True, product=None, comment=''):
+        review = Review.objects.create(
+            product=product or self.product, user=user, rating=rating, comment=comment, is_approved=is_approved,
+        )
+        adjust_ratings(review_changes(None, (review.product_id, rating, is_approved)))
+        return review
+
+    def assert_histogram(self, product, **stars):
+        """``stars`` as one_star=..., five_star=...; unnamed counts must be 0"""
+        rating = ProductRating.objects.get(product=product)
+        counts = {name: getattr(rating, name) for name in ProductRating.STAR_FIELDS.values()}
+        expected = {name: stars.get(name, 0) for name in ProductRating.STAR_FIELDS.values()}
+        self.assertEqual(counts, expected)
+        self.assertEqual(rating.review_count, sum(expected.values()))
+        self.assertEqual(
+            rating.rating_total, sum(stars * expected[name] for stars, name in ProductRating.STAR_FIELDS.items()),
+        )
+
+
+class RatingHistogramTests(ReviewTestCase):
+
+    def test_review_changes(self):
+        self.assertEqual(review_changes(None, (1, 5, True)), [(1, 5, 1)])
+        self.assertEqual(review_changes(None, (1, 5, False)), [])
+        self.assertEqual(review_changes((1, 5, True), (1, 3, True)), [(1, 5, -1), (1, 3, 1)])
+        self.assertEqual(review_changes((1, 5, True), (1, 5, False)), [(1, 5, -1)])
+        self.assertEqual(review_changes((1, 5, True), None), [(1, 5, -1)])
+
+    def test_adjust_ratings_creates_and_updates_the_histogram(self):
+        adjust_ratings([(self.product.id, 5, 1), (self.product.id, 4, 1), (self.product.id, 5, 1)])
+        self.assert_histogram(self.product, five_star=2, four_star=1)
+        adjust_ratings([(self.product.id, 5, -1), (self.product.id, 2, 1)])
+        self.assert_histogram(self.product, five_star=1, four_star=1, two_star=1)
+
+    def test_adjust_ratings_does_not_create_a_negative_histogram(self):
+        adjust_ratings([(self.product.id, 5, -1)])
+        self.assertFalse(ProductRating.objects.exists())
+
+    def test_deleting_a_review_takes_it_out(self):
+        review = self.review(self.alice, 5)
+        self.review(make_user('bob'), 3)
+        review.delete()
+        self.assert_histogram(self.product, three_star=1)
+
+    def test_deleting_a_hidden_review_changes_nothing(self):
+        self.review(self.alice, 5)
+        self.review(make_user('bob'), 1, is_approved=False).delete()
+        self.assert_histogram(self.product, five_star=1)
+
+    def test_deleting_a_user_takes_their_reviews_out(self):
+        other = Product.objects.create(
+            name='Case', description='A case', category=self.product.category, price=10, stock_quantity=3,
+        )
+        self.review(self.alice, 5)
+        self.review(self.alice, 4, product=other)
+        self.review(make_user('bob'), 2)
+        self.alice.delete()
+        self.assert_histogram(self.product, two_star=1)
+        self.assert_histogram(other)
+
+    def test_deleting_a_product_removes_its_histogram(self):
+        self.review(self.alice, 5)
+        self.product.delete()
+        self.assertFalse(ProductRating.objects.exists())
+
+
+class SubmitReviewTests(ReviewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.alice)
+        self.url = reverse('reviews:submit_review', args=[self.product.id])
+
+    def message(self, response):
+        """The message the response added; earlier ones are never displayed here"""
+        return [str(message) for message in get_messages(response.wsgi_request)][-1]
+
+    def test_submitted_review_is_counted(self):
+        response = self.client.post(self.url, {'rating': 4, 'comment': 'Good value'})
+        self.assertRedirects(response, f'{self.product.get_absolute_url()}#reviews', fetch_redirect_response=False)
+        self.assertEqual(self.message(response), 'Thank you for your review!')
+        self.assertTrue(Review.objects.get(user=self.alice).is_approved)
+        self.assert_histogram(self.product, four_star=1)
+
+    def test_second_review_of_a_product_is_refused(self):
+        self.client.post(self.url, {'rating': 4, 'comment': 'Good value'})
+        response = self.client.post(self.url, {'rating': 1, 'comment': 'Changed my mind'})
+        self.assertEqual(self.message(response), 'You have already reviewed this product.')
+        self.assertEqual(Review.objects.get(user=self.alice).rating, 4)
+        self.assert_histogram(self.product, four_star=1)
+
+    def test_repeated_comment_waits_for_a_moderator(self):
+        self.client.force_login(make_user('bob'))
+        self.client.post(self.url, {'rating': 5, 'comment': COMMENT})
+        self.client.force_login(self.alice)
+        response = self.client.post(self.url, {'rating': 5, 'comment': COMMENT + '!!'})
+        self.assertEqual(self.message(response), 'Thank you for your review! It will appear once it has been checked.')
+        review = Review.objects.get(user=self.alice)
+        self.assertFalse(review.is_approved)
+        self.assertEqual(review.duplicate_of, Review.objects.get(user__username='bob'))
+        self.assert_histogram(self.product, five_star=1)
+
+
+class HelpfulVoteTests(ReviewTestCase):
+
+    def test_one_vote_per_user(self):
+        review = self.review(self.alice, 5)
+        url = reverse('reviews:mark_helpful', args=[review.id])
+        for username in ['bob', 'carol']:
+            self.client.force_login(make_user(username))
+            self.client.post(url)
+            self.client.post(url)
+        # Authors cannot vote for their own review
+        self.client.force_login(self.alice)
+        self.client.post(url)
+        review.refresh_from_db()
+        self.assertEqual(review.helpful_count, 2)
+        self.assertEqual(ReviewVote.objects.filter(review=review).count(), 2)
+
+
+class ReviewAdminTests(ReviewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(make_user('admin', is_staff=True, is_superuser=True))
+
+    def edit(self, review, **changes):
+        data = {
+            'product': review.product_id, 'user': review.user_id, 'rating': review.rating,
+            'comment': review.comment, 'is_approved': 'on' if review.is_approved else '',
+        }
+        data.update(changes)
+        response = self.client.post(reverse('admin:reviews_review_change', args=[review.id]), data)
+        self.assertEqual(response.status_code, 302)
+        review.refresh_from_db()
+
+    def test_rerating_moves_the_review(self):
+        review = self.review(self.alice, 5)
+        self.edit(review, rating=2)
+        self.assert_histogram(self.product, two_star=1)
+        self.assertIsNone(review.moderated_at)
+
+    def test_hiding_and_approving(self):
+        review = self.review(self.alice, 5)
+        self.edit(review, is_approved='')
+        self.assert_histogram(self.product)
+        self.assertIsNotNone(review.moderated_at)
+        self.edit(review, is_approved='on')
+        self.assert_histogram(self.product, five_star=1)
+
+
+class ModerationTests(ReviewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.other = Product.objects.create(
+            name='Case', description='A case', category=self.product.category, price=10, stock_quantity=3,
+        )
+        self.bob = make_user('bob')
+        self.shown = self.review(self.alice, 5)
+        self.hidden = self.review(self.bob, 2, is_approved=False, product=self.other)
+        self.review(self.alice, 4, product=self.other)
+        # Marks the histograms, so a recount shows in them
+        ProductRating.objects.update(one_star=7)
+
+    def test_only_products_whose_visible_reviews_changed_are_recounted(self):
+        moderated, changed = moderate_reviews(Review.objects.filter(id__in=[self.shown.id, self.hidden.id]), True)
+        self.assertEqual((moderated, changed), (2, 1))
+        self.assertEqual(ProductRating.objects.get(product=self.product).one_star, 7)
+        self.assert_histogram(self.other, four_star=1, two_star=1)
+        self.assertFalse(Review.objects.filter(moderated_at__isnull=True, id__in=[self.shown.id, self.hidden.id]))
+
+    def test_rejecting(self):
+        moderated, changed = moderate_reviews(Review.objects.filter(product=self.other), False)
+        self.assertEqual((moderated, changed), (2, 1))
+        self.assert_histogram(self.other)
+        self.assertEqual(ProductRating.objects.get(product=self.product).one_star, 7)
+
+    def test_nothing_changing_recounts_nothing(self):
+        moderated, changed = moderate_reviews(Review.objects.filter(is_approved=True), True)
+        self.assertEqual((moderated, changed), (2, 0))
+        self.assertEqual(set(ProductRating.objects.values_list('one_star', flat=True)), {7})
+
+    def test_queue_decision(self):
+        self.client.force_login(make_user('admin', is_staff=True, is_superuser=True))
+        response = self.client.post(
+            reverse('admin:reviews_review_moderation'),
+            {'ids': [self.shown.id, self.hidden.id], 'decision': 'reject'}, follow=True,
+        )
+        self.assertContains(response, '2 review(s) rejected, 1 changed visibility.')
+        self.assert_histogram(self.product)
+        self.assertEqual(ProductRating.objects.get(product=self.other).one_star, 7)
+
+
+class DuplicateDetectionTests(ReviewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.original = self.review(self.alice, 5, comment=COMMENT)
+        self.copy = self.review(make_user('bob'), 5, comment=COMMENT.replace('two days', '2 days'))
+        self.other = self.review(make_user('carol'), 1, comment=OTHER_COMMENT)
+
+    def index(self, *reviews):
+        signatures = {review.id: comment_signature(review.comment) for review in reviews}
+        index_signatures(signatures)
+        return signatures
+
+    @skipUnless(duplicates.np is not None, 'numpy is not installed')
+    def test_batch_signatures_match_single_ones(self):
+        texts = [COMMENT, 'Great product!', OTHER_COMMENT, '', COMMENT * 20]
+        # Small chunks, so batches are split between comments
+        with mock.patch.object(duplicates, 'SIGNATURE_CHUNK_SHINGLES', 150):
+            self.assertEqual(comment_signatures(texts), [comment_signature(text) for text in texts])
+
+    def test_earliest_close_match_is_found(self):
+        again = self.review(make_user('dave'), 4, comment=COMMENT)
+        signatures = self.index(self.original, self.copy, self.other, again)
+        self.assertEqual(find_duplicates(signatures), {self.copy.id: self.original.id, again.id: self.original.id})
+
+    def test_short_comments_are_not_compared(self):
+        self.assertIsNone(comment_signature('Great product!'))
+        short = [self.review(make_user(name), 5, comment='Great product!') for name in ['dave', 'erin']]
+        self.assertEqual(find_duplicates(self.index(*short)), {})
+
+    def test_scan_holds_only_unmoderated_duplicates(self):
+        moderated = self.review(make_user('dave'), 4, comment=COMMENT)
+        Review.objects.filter(id=moderated.id).update(moderated_at=timezone.now())
+        ProductRating.objects.update(one_star=7)  # shows whether the histogram was rebuilt
+
+        stats = scan_reviews(batch_size=2, hold=True)
 
-# Create your tests here.
+        self.assertEqual((stats.scanned, stats.indexed, stats.flagged, stats.held), (4, 4, 2, 1))
+        flags = dict(Review.objects.values_list('id', 'duplicate_of'))
+        self.assertEqual(flags, {
+            self.original.id: None, self.copy.id: self.original.id, self.other.id: None,
+            moderated.id: self.original.id,
+        })
+        visible = set(Review.objects.filter(is_approved=True).values_list('id', flat=True))
+        self.assertEqual(visible, {self.original.id, self.other.id, moderated.id})
+        self.assert_histogram(self.product, five_star=1, four_star=1, one_star=1)
@@ -0,0 +1,9 @@
+from django.urls import path
+from . import views
+
+app_name = 'reviews'
+
+urlpatterns = [
+    path('submit/<int:product_id>/', views.submit_review, name='submit_review'),
+    path('<int:review_id>/helpful/', views.mark_helpful, name='mark_helpful'),
+]
@@ -1,3 +1,82 @@
-from django.shortcuts import render
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.shortcuts import get_object_or_404, redirect
+from django.views.decorators.http import require_POST
 
-# Create your views here.
+from ecommerce.pagination import paginate_by_cursor
+from products.models import Product
+from .duplicates import comment_signature, find_duplicate, index_signatures
+from .forms import ReviewForm
+from .models import Review, ReviewVote
+from .ratings import adjust_ratings, review_changes
+
+REVIEWS_PER_PAGE = 10
+
+# Sort option -> cursor fields, descending
+REVIEW_SORTS = {
+    'newest': ('created_at', 'id'),
+    'helpful': ('helpful_count', 'id'),
+}
+
+
+def get_review_page(product, sort='newest', cursor=None):
+    """One page of a product's approved reviews; returns (page, sort actually used)"""
+    if sort not in REVIEW_SORTS:
+        sort = 'newest'
+    reviews = Review.objects.filter(product=product, is_approved=True).select_related('user')
+    return paginate_by_cursor(reviews, cursor, fields=REVIEW_SORTS[sort], per_page=REVIEWS_PER_PAGE), sort
+
+
+def _product_reviews_url(product):
+    return f'{product.get_absolute_url()}#reviews'
+
+
+@login_required
+@require_POST
+def submit_review(request, product_id):
+    """Add the user's review of a product; one review per user and product"""
+    product = get_object_or_404(Product, id=product_id, is_available=True)
+    form = ReviewForm(request.POST)
+    if not form.is_valid():
+        messages.error(request, 'Please choose a rating between 1 and 5 stars.')
+        return redirect(_product_reviews_url(product))
+    
+    review = form.save(commit=False)
+    review.product = product
+    review.user = request.user
+    # A comment nearly repeating another review waits for a moderator
+    signature = comment_signature(review.comment)
+    review.duplicate_of_id = find_duplicate(signature)
+    if review.duplicate_of_id:
+        review.is_approved = False
+    try:
+        with transaction.atomic():
+            review.save()
+            index_signatures({review.id: signature})
+            adjust_ratings(review_changes(None, (product.id, review.rating, review.is_approved)))
+    except IntegrityError:
+        messages.info(request, 'You have already reviewed this product.')
+        return redirect(_product_reviews_url(product))
+    
+    if review.is_approved:
+        messages.success(request, 'Thank you for your review!')
+    else:
+        messages.success(request, 'Thank you for your review! It will appear once it has been checked.')
+    return redirect(_product_reviews_url(product))
+
+
+@login_required
+@require_POST
+def mark_helpful(request, review_id):
+    """Count the user's helpful vote on a review, once"""
+    review = get_object_or_404(Review.objects.select_related('product'), id=review_id, is_approved=True)
+    if review.user_id != request.user.id:
+        try:
+            with transaction.atomic():
+                ReviewVote.objects.create(review=review, user=request.user)
+                Review.objects.filter(id=review.id).update(helpful_count=F('helpful_count') + 1)
+        except IntegrityError:
+            pass  # already voted
+    return redirect(_product_reviews_url(review.product))